@@ -1,27 +1,68 @@
+import time
+_import_start = time.perf_counter()
+
 import streamlit as st
-from groq import Groq
-from PIL import Image
-import json
-import pandas as pd
 from datetime import datetime
-import io
-import base64
+import re
+import uuid
+from concurrent.futures import as_completed
 
 from dotenv import load_dotenv
 import os
 
+from llm_client import get_groq_client, get_rate_limiter, get_worker_pool
+from metrics import get_metrics, start_exporters
+from model_router import get_model_router
+from content_store import get_search_index, load_section, section_titles
+from conversation_memory import ConversationMemory
+from food_photo import (
+    ACCEPTED_TYPES as PHOTO_TYPES, MAX_UPLOAD_BYTES as PHOTO_MAX_UPLOAD_BYTES, PhotoError,
+    get_image_pool, image_hash, prepare_image
+)
+from history_store import get_history_store
+from jobs import CANCELLED, DONE, FAILED, JobCancelled, get_job_manager
+from meal_plan import (
+    MEAL_TOKEN_BUDGETS, PROSE_TOKEN_BUDGETS, REPAIR_TOKEN_BUDGET, MealPlanError,
+    dump_meal, meal_rows, parse_meal, repair_prompt, structured_prompt
+)
+from profiling import (
+    ENABLED as PROFILE_STARTUP, count_rerun, lazy_import, record_import,
+    summary as profile_summary, timed_render
+)
+from prompts import (
+    PromptBudgetError, canonical_list, compile_contexts, get_prompt_budget, meal_plan_prompt,
+    nutrition_context, symptom_context, symptom_prompt
+)
+from question_index import get_question_index, segment_key
+from response_cache import get_response_cache, make_cache_key
+from shared_tier import get_shared_tier
+from single_flight import LeaderAbandoned, get_single_flight
+from triage import FORCE_LLM as TRIAGE_FORCE_LLM, format_assessment, triage
+
+# Only the first (cold) run pays for these; reruns reuse the loaded modules
+record_import("app.py imports", time.perf_counter() - _import_start)
+
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Groq client and add to session state
-if 'groq_client' not in st.session_state:
+def _groq_client():
+    """Return the shared Groq client, or None if it could not be initialized
+
+    The client (and the groq/httpx imports) is created on first use, so
+    pages that never call the model do not pay for it.
+    """
+    try:
+        return get_groq_client()
+    except Exception:
+        return None
+
+def _report_groq_client_error():
+    """Show why the Groq client could not be created, on pages that need it"""
     try:
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        st.session_state.groq_client = Groq(api_key=groq_api_key)
+        get_groq_client()
     except Exception as e:
         st.error(f"Error initializing Groq API: {str(e)}")
-        st.session_state.groq_client = None
 
 
 # Add nutritional preferences and restrictions to session state
@@ -30,363 +71,1137 @@ if 'dietary_preferences' not in st.session_state:
 if 'food_allergies' not in st.session_state:
     st.session_state.food_allergies = []
 
-def get_nutrition_response(prompt, pregnancy_month, preferences=None, allergies=None):
-    """Get AI response specifically for nutrition queries"""
+# Chat messages rendered per page, and recent messages replayed into memory on reload
+CHAT_PAGE_SIZE = 10
+MEMORY_RELOAD_MESSAGES = 20
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+# The session id is the only key to a user's chat, assessments and
+# restrictions, so it lives in a SameSite cookie rather than the URL.
+SESSION_COOKIE = "mh_sid"
+# Opt-in legacy mode: keep the id in ?sid= so a copied URL carries the
+# session. Anyone with the URL (browser history, shared links, referrers)
+# can then read that session's history.
+SESSION_ID_IN_URL = os.getenv("SESSION_ID_IN_URL", "").lower() in ("1", "true", "yes")
+
+# Sections that make up a "Full Day Plan", in display order
+MEAL_SECTIONS = ["Breakfast", "Lunch", "Dinner", "Snacks"]
+
+# Restriction choices offered by the nutritionist
+DIETARY_PREFERENCES = ["Vegetarian", "Vegan", "Halal", "Kosher", "Gluten-Free", "Dairy-Free"]
+FOOD_ALLERGIES = ["Nuts", "Dairy", "Eggs", "Soy", "Shellfish", "Wheat", "Fish"]
+
+# How often a page checks on its running background job. Streamed text only
+# reaches the page when it polls, so this bounds the delay to the first text
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 0.25))
+
+# How long a session's restrictions, chat memory and recent history are kept in the shared tier
+SESSION_STATE_TTL = float(os.getenv("SESSION_STATE_TTL", 30 * 24 * 60 * 60))
+HISTORY_KINDS = ("nutrition", "symptom")
+# Recent messages of each history kept in the shared tier for another replica to restore
+SHARED_HISTORY_MESSAGES = int(os.getenv("SHARED_HISTORY_MESSAGES", 50))
+
+
+def is_error_response(text):
+    """Tell apart the error strings the assistant functions return instead of raising"""
+    return text.startswith(("Error:", "I apologize, but I encountered an error"))
+
+def _build_messages(context, prompt, history=None, user_content=None):
+    """Assemble the chat messages: system context, prior conversation, then the prompt
+
+    user_content replaces the plain-text prompt, e.g. with text and image parts.
+    """
+    return [
+        {"role": "system", "content": context},
+        *(history or []),
+        {"role": "user", "content": prompt if user_content is None else user_content}
+    ]
+
+def _fit_prompt(context, prompt, history=None, images=0):
+    """Trim history to the prompt budget, before the request's cache key is built
+
+    Raises PromptBudgetError if even the context and prompt are too large.
+    """
+    history, _ = get_prompt_budget().fit(context, prompt, history, images)
+    return history
+
+def _usage_tokens(usage):
+    """Pull (prompt_tokens, completion_tokens) out of a provider usage object"""
+    if usage is None:
+        return None, None
+    return usage.prompt_tokens, usage.completion_tokens
+
+def _complete(request_type, context, prompt, cache_key, history=None, user_content=None,
+              max_tokens=1000, response_format=None, cacheable=None):
+    """Run a blocking completion, serving it from the response cache when possible
+
+    The model router picks (and if needed hedges between) the models for
+    request_type. Identical requests already in flight share the leader's
+    upstream call, on this replica or, through the shared tier, on another
+    one. Every request is recorded in the metrics registry.
+    user_content may be a callable, which is only called if a model is
+    actually asked. response_format={"type": "json_object"} asks for JSON.
+    A model answer is only cached if cacheable(answer) is true, when given;
+    a rejected answer is still returned.
+    """
+    timer = get_metrics().start_call(request_type)
+    cache = get_response_cache()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        timer.finish(source="cache")
+        return cached
+
+    flight = get_single_flight()
+    while True:
+        call, leader = flight.begin(cache_key)
+        if leader:
+            break
+        try:
+            response = call.wait()
+        except LeaderAbandoned:
+            # The leader was cancelled; take over or join the next one
+            continue
+        except Exception as e:
+            timer.fail(e)
+            raise
+        timer.finish(source="coalesced")
+        return response
+
+    claimed = False
+    try:
+        # Another leader may have filled the cache since the check above
+        response, source, usage = cache.get(cache_key), "cache", None
+        if response is None:
+            claimed = cache.claim(cache_key)
+            if not claimed:
+                # Another replica is already asking the model for this
+                response, source = cache.wait_for(cache_key), "replica"
+        if response is None:
+            if callable(user_content):
+                user_content = user_content()
+            messages = _build_messages(context, prompt, history, user_content)
+            options = {"response_format": response_format} if response_format else {}
+
+            def create(model):
+                with get_rate_limiter():
+                    # Time waiting for the slot is not the model's latency
+                    get_model_router().mark_started()
+                    return get_groq_client().chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=max_tokens,
+                        **options
+                    )
+
+            timer.model, completion = get_model_router().complete(request_type, create)
+            response, source, usage = completion.choices[0].message.content, "llm", completion.usage
+            if cacheable is None or cacheable(response):
+                cache.set(cache_key, response)
+    except Exception as e:
+        flight.finish(cache_key, call, error=e)
+        timer.fail(e)
+        raise
+    finally:
+        if claimed:
+            cache.release(cache_key)
+
+    flight.finish(cache_key, call, result=response)
+    timer.finish(source, *_usage_tokens(usage))
+    return response
+
+def _stream_complete(request_type, context, prompt, cache_key, history=None, max_tokens=1000):
+    """Yield a completion chunk by chunk, caching the full text once it finishes
+
+    The model router picks the model and hedges on time to first chunk. A
+    request that matches one already in flight, here or on another replica,
+    waits for that call and yields its full text instead of opening a second
+    stream. Time to first
+    token and usage are recorded in the metrics registry.
+    """
+    timer = get_metrics().start_call(request_type)
+    cache = get_response_cache()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        timer.finish(source="cache")
+        yield cached
+        return
+
+    flight = get_single_flight()
+    while True:
+        call, leader = flight.begin(cache_key)
+        if leader:
+            break
+        try:
+            response = call.wait()
+        except LeaderAbandoned:
+            # The leader's stream was closed, e.g. its job was cancelled;
+            # take over or join the next leader
+            continue
+        except Exception as e:
+            timer.fail(e)
+            raise
+        timer.finish(source="coalesced")
+        yield response
+        return
+
+    if not cache.claim(cache_key):
+        # Another replica is already asking the model for this
+        response = cache.wait_for(cache_key)
+        if response is not None:
+            flight.finish(cache_key, call, result=response)
+            timer.finish(source="replica")
+            yield response
+            return
+        claimed = False
+    else:
+        claimed = True
+
+    def open_stream(model):
+        # Hold a limiter slot until the stream is fully consumed or closed
+        with get_rate_limiter():
+            get_model_router().mark_started()
+            stream = get_groq_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            try:
+                yield from stream
+            finally:
+                stream.close()
+
+    parts = []
+    usage = None
+    try:
+        messages = _build_messages(context, prompt, history)
+        router = get_model_router()
+        timer.model, chunks = router.stream(request_type, open_stream)
+        try:
+            for chunk in chunks:
+                # Groq reports usage on the final chunk
+                x_groq = getattr(chunk, "x_groq", None)
+                usage = getattr(x_groq, "usage", None) or getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    timer.first_token()
+                    parts.append(delta)
+                    yield delta
+        except Exception:
+            # The stream broke after it started, too late to fail over
+            router.report_failure(timer.model)
+            raise
+        finally:
+            chunks.close()
+        if not parts:
+            raise RuntimeError("the model returned an empty answer")
+    except BaseException as e:
+        flight.finish(cache_key, call, error=e)
+        if isinstance(e, Exception):
+            timer.fail(e)
+        if claimed:
+            cache.release(cache_key)
+        raise
+
+    response = "".join(parts)
+    cache.set(cache_key, response)
+    if claimed:
+        cache.release(cache_key)
+    flight.finish(cache_key, call, result=response)
+    timer.finish("llm", *_usage_tokens(usage))
+
+def get_nutrition_response(prompt, pregnancy_month, preferences=None, allergies=None, history=None,
+                           max_tokens=1000):
+    """Get AI response specifically for nutrition queries
+
+    history is an optional list of earlier chat messages, e.g. from
+    ConversationMemory.messages(), sent ahead of the prompt.
+    """
     try:
-        if st.session_state.groq_client is None:
+        if _groq_client() is None:
             return "Error: Groq API client not initialized"
 
-        context = f"""You are a maternal nutrition expert. The user is {pregnancy_month} months pregnant.
-        Dietary preferences: {preferences if preferences else 'None'}
-        Food allergies: {allergies if allergies else 'None'}
+        # The same selection, in any order, builds the same context and cache key
+        preferences = canonical_list(preferences)
+        allergies = canonical_list(allergies)
 
-        Provide nutritional advice that:
-        1. Is safe for pregnancy
-        2. Meets increased nutritional needs for the specific pregnancy month
-        3. Avoids any listed allergens
-        4. Respects dietary preferences
-        5. Includes specific food suggestions and portions
-        """
+        context = nutrition_context(pregnancy_month, preferences, allergies)
+        history = _fit_prompt(context, prompt, history)
+        cache_key = make_cache_key("nutrition", context, prompt, preferences, allergies, history)
+        return _complete("nutrition", context, prompt, cache_key, history, max_tokens=max_tokens)
+    except PromptBudgetError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"I apologize, but I encountered an error: {str(e)}"
+
+def get_meal_photo_response(photo, pregnancy_month, preferences=None, allergies=None):
+    """Check a photo of a meal against the user's stage of pregnancy and restrictions
+
+    Results are cached by image hash, so the same photo is only decoded and
+    sent once. Decoding and re-encoding run on the photo worker pool.
+    """
+    try:
+        if _groq_client() is None:
+            return "Error: Groq API client not initialized"
+
+        preferences = canonical_list(preferences)
+        allergies = canonical_list(allergies)
 
-        completion = st.session_state.groq_client.chat.completions.create(
-            model="mixtral-8x7b-32768",
-            messages=[
-                {"role": "system", "content": context},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
+        context = nutrition_context(pregnancy_month, preferences, allergies)
+        prompt = MEAL_PHOTO_PROMPT
+        _fit_prompt(context, prompt, images=1)
+        cache_key = make_cache_key(
+            "photo", context, f"{prompt}\nphoto:{image_hash(photo)}", preferences, allergies
         )
 
-        return completion.choices[0].message.content
+        def photo_content():
+            encoded, _ = get_image_pool().submit(prepare_image, photo).result()
+            return [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}},
+            ]
+
+        return _complete("photo", context, prompt, cache_key, user_content=photo_content)
+    except (PhotoError, PromptBudgetError) as e:
+        return f"Error: {e}"
     except Exception as e:
         return f"I apologize, but I encountered an error: {str(e)}"
 
+def stream_nutrition_response(prompt, pregnancy_month, preferences=None, allergies=None, history=None,
+                              max_tokens=1000):
+    """Stream AI response for nutrition queries as tokens arrive
+
+    An error before the first token is yielded as the usual error message;
+    one after it is raised.
+    """
+    started = False
+    try:
+        if _groq_client() is None:
+            yield "Error: Groq API client not initialized"
+            return
+
+        preferences = canonical_list(preferences)
+        allergies = canonical_list(allergies)
+
+        context = nutrition_context(pregnancy_month, preferences, allergies)
+        history = _fit_prompt(context, prompt, history)
+        cache_key = make_cache_key("nutrition", context, prompt, preferences, allergies, history)
+        chunks = _stream_complete("nutrition", context, prompt, cache_key, history, max_tokens)
+        try:
+            for chunk in chunks:
+                started = True
+                yield chunk
+        finally:
+            chunks.close()
+    except PromptBudgetError as e:
+        # Too long to send at all: the same request would fail the same way again
+        yield f"Error: {e}"
+    except Exception as e:
+        if started:
+            # Part of the answer is already out; an apology appended to it
+            # would read as a complete answer, so fail the request instead
+            raise
+        yield f"I apologize, but I encountered an error: {str(e)}"
+
 def get_symptom_assessment_response(prompt, pregnancy_month):
     """Get AI response specifically for symptom assessment queries"""
     try:
-        if st.session_state.groq_client is None:
+        if _groq_client() is None:
             return "Error: Groq API client not initialized"
 
-        context = f"""You are a virtual doctor. The patient is {pregnancy_month} months pregnant.
-        Provide a detailed assessment including:
-        1. Possible causes
-        2. Whether this is normal for their stage of pregnancy
-        3. Recommended actions
-        4. When to seek immediate medical attention
-        """
+        context = symptom_context(pregnancy_month)
+        _fit_prompt(context, prompt)
+        cache_key = make_cache_key("symptom", context, prompt)
+        return _complete("symptom", context, prompt, cache_key)
+    except PromptBudgetError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"I apologize, but I encountered an error: {str(e)}"
 
-        completion = st.session_state.groq_client.chat.completions.create(
-            model="llama3-8b-8192",  # or your preferred Groq model
-            messages=[
-                {"role": "system", "content": context},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+def stream_symptom_assessment_response(prompt, pregnancy_month):
+    """Stream AI response for symptom assessment queries as tokens arrive
 
-        return completion.choices[0].message.content
+    Errors are handled as in stream_nutrition_response.
+    """
+    started = False
+    try:
+        if _groq_client() is None:
+            yield "Error: Groq API client not initialized"
+            return
+
+        context = symptom_context(pregnancy_month)
+        _fit_prompt(context, prompt)
+        cache_key = make_cache_key("symptom", context, prompt)
+        chunks = _stream_complete("symptom", context, prompt, cache_key)
+        try:
+            for chunk in chunks:
+                started = True
+                yield chunk
+        finally:
+            chunks.close()
+    except PromptBudgetError as e:
+        # Too long to send at all: the same request would fail the same way again
+        yield f"Error: {e}"
     except Exception as e:
-        return f"I apologize, but I encountered an error: {str(e)}"
+        if started:
+            # Part of the answer is already out; an apology appended to it
+            # would read as a complete answer, so fail the request instead
+            raise
+        yield f"I apologize, but I encountered an error: {str(e)}"
+
+MEAL_PHOTO_PROMPT = """Identify the foods in this photo of my meal. Then tell me:
+1. Roughly what nutrients it provides
+2. Anything in it I should avoid or limit at my stage of pregnancy
+3. Whether it fits my dietary preferences and allergies
+4. A simple way to make it more balanced"""
+
+JSON_OBJECT = {"type": "json_object"}
+
+def get_structured_meal(meal_type, pregnancy_month, preferences=None, allergies=None):
+    """Generate one meal as validated JSON; return (meal, None) or (None, error message)
+
+    An answer that fails validation gets one repair pass through the model.
+    The canonical JSON then replaces the raw answer in the response cache,
+    so a cached meal is never repaired twice and full-day plans reuse meals
+    generated on their own. Answers that cannot be read are never cached.
+    """
+    try:
+        if _groq_client() is None:
+            return None, "Error: Groq API client not initialized"
+
+        preferences = canonical_list(preferences)
+        allergies = canonical_list(allergies)
+
+        context = nutrition_context(pregnancy_month, preferences, allergies)
+        prompt = structured_prompt(meal_type, pregnancy_month)
+        _fit_prompt(context, prompt)
+        cache_key = make_cache_key("nutrition", context, prompt, preferences, allergies)
+
+        def readable(text):
+            # Unreadable answers are not cached, so the next request asks again
+            try:
+                parse_meal(text, meal_type)
+            except MealPlanError:
+                return False
+            return True
+
+        text = _complete("nutrition", context, prompt, cache_key, max_tokens=MEAL_TOKEN_BUDGETS[meal_type],
+                         response_format=JSON_OBJECT, cacheable=readable)
+        if is_error_response(text):
+            return None, text
+        try:
+            meal = parse_meal(text, meal_type)
+        except MealPlanError as e:
+            fix = repair_prompt(text, e)
+            _fit_prompt(context, fix)
+            repaired = _complete("nutrition", context, fix, make_cache_key("nutrition", context, fix),
+                                 max_tokens=REPAIR_TOKEN_BUDGET, response_format=JSON_OBJECT,
+                                 cacheable=readable)
+            meal = parse_meal(repaired, meal_type)
+        get_response_cache().set(cache_key, dump_meal(meal))
+        return meal, None
+    except MealPlanError as e:
+        return None, f"Error: the meal plan could not be read ({e})"
+    except PromptBudgetError as e:
+        return None, f"Error: {e}"
+    except Exception as e:
+        return None, f"I apologize, but I encountered an error: {str(e)}"
+
+def generate_full_day_plan(pregnancy_month, preferences=None, allergies=None, structured=False):
+    """Generate every meal section concurrently, yielding (section, result) as each one finishes
+
+    Each section uses the same prompt as the matching single-meal option, so
+    sections are cached individually and shared with those options. With
+    structured=True each result is a (meal, error) pair from
+    get_structured_meal; otherwise it is the prose text.
+    """
+    pool = get_worker_pool()
+    if structured:
+        futures = {
+            pool.submit(get_structured_meal, section, pregnancy_month, preferences, allergies): section
+            for section in MEAL_SECTIONS
+        }
+    else:
+        futures = {
+            pool.submit(
+                get_nutrition_response,
+                meal_plan_prompt(section, pregnancy_month),
+                pregnancy_month,
+                preferences,
+                allergies,
+                max_tokens=PROSE_TOKEN_BUDGETS[section]
+            ): section
+            for section in MEAL_SECTIONS
+        }
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+def _stream_into(job, chunks):
+    """Publish a response stream as a job's partial output and return the full text
+
+    Cancelling the job closes the stream, which closes the upstream request.
+    """
+    try:
+        for chunk in chunks:
+            job.emit(chunk)
+    finally:
+        chunks.close()
+    return job.text()
+
+def _meal_plan_job(job, meal_type, pregnancy_month, preferences, allergies, structured):
+    """Generate a meal plan in the background
+
+    A full day publishes each (section, result) pair as it finishes.
+    """
+    if meal_type == "Full Day Plan":
+        plan = generate_full_day_plan(pregnancy_month, preferences, allergies, structured=structured)
+        try:
+            for section, result in plan:
+                job.emit((section, result))
+        finally:
+            plan.close()
+        return dict(job.partial)
+    if structured:
+        return get_structured_meal(meal_type, pregnancy_month, preferences, allergies)
+    return _stream_into(job, stream_nutrition_response(
+        meal_plan_prompt(meal_type, pregnancy_month),
+        pregnancy_month,
+        preferences,
+        allergies,
+        max_tokens=PROSE_TOKEN_BUDGETS[meal_type]
+    ))
+
+def _nutrition_chat_job(job, sid, memory, question, pregnancy_month, preferences, allergies, segment):
+    """Answer a chat question in the background, saving the turn once the answer is complete
+
+    Only answers to questions asked without earlier conversation go into the
+    shared question index; the rest depend on this session's history.
+    """
+    history = memory.messages()
+    response = _stream_into(job, stream_nutrition_response(
+        question,
+        pregnancy_month,
+        preferences,
+        allergies,
+        history
+    ))
+    if job.cancelled:
+        # Cancelled after the answer completed: the turn is dropped, not saved
+        raise JobCancelled()
+    if not history and not is_error_response(response):
+        get_question_index().add(segment, question, response)
+    _append_history(sid, "nutrition", "assistant", response)
+    memory.add("user", question)
+    memory.add("assistant", response)
+    _save_session_state(sid, "memory", memory.to_dict())
+    return response
+
+def _meal_photo_job(job, photo, pregnancy_month, preferences, allergies):
+    return get_meal_photo_response(photo, pregnancy_month, preferences, allergies)
+
+def _save_assessment(sid, prompt, response, details):
+    """Save an assessment with its inputs so it can be exported for review"""
+    _append_history(sid, "symptom", "user", prompt)
+    _append_history(sid, "symptom", "doctor", response, details=details)
+
+def _symptom_assessment_job(job, sid, prompt, pregnancy_week, details):
+    """Stream a symptom assessment from the virtual doctor in the background and save it"""
+    response = _stream_into(job, stream_symptom_assessment_response(
+        prompt,
+        pregnancy_week // 4  # Convert weeks to months
+    ))
+    if job.cancelled:
+        raise JobCancelled()
+    # An error message is shown, but it is not an assessment to keep
+    if not is_error_response(response):
+        _save_assessment(sid, prompt, response, details)
+    return response
+
+def _count_fragment_run(name):
+    """Count fragment executions, telling partial reruns apart from full script runs"""
+    script_runs = st.session_state.get('script_runs', 0)
+    seen = st.session_state.setdefault('fragment_seen_runs', {})
+    # Running again within the same full run means only the fragment reran
+    if seen.get(name) == script_runs:
+        count_rerun(f"fragment:{name}")
+    seen[name] = script_runs
+
+def _show_job(kind, render):
+    """Draw this session's latest job of a kind, polling for progress while it runs
+
+    render(job) draws the job's partial or final output. Results stay with
+    the session, so they are still here after navigating away and back.
+    """
+    job = get_job_manager().get(_history_session_id(), kind)
+    if job is None:
+        return
+    if job.active:
+        st.fragment(_poll_job, run_every=JOB_POLL_SECONDS)(kind, render)
+    else:
+        _render_job(job, render)
+
+def _poll_job(kind, render):
+    job = get_job_manager().get(_history_session_id(), kind)
+    if job is None or not job.active:
+        # One full rerun draws the final result and stops the polling timer
+        st.rerun()
+    _render_job(job, render)
+
+def _render_job(job, render):
+    render(job)
+    if job.active:
+        st.button("Cancel", key=f"cancel_{job.kind}",
+                  on_click=get_job_manager().cancel, args=(job.session_id, job.kind))
+    elif job.state == CANCELLED:
+        st.info("Cancelled.")
+    elif job.state == FAILED:
+        st.error(job.error)
+
+def _history_session_id():
+    """Return the id this session's history is stored under
+
+    It is kept in the SESSION_COOKIE cookie, so reloading the page or
+    reconnecting to another replica picks the history back up. With
+    SESSION_ID_IN_URL it is kept in the ?sid= query parameter instead.
+    """
+    sid = st.session_state.get('history_session_id')
+    if sid is None:
+        if SESSION_ID_IN_URL:
+            sid = st.query_params.get("sid")
+        else:
+            sid = st.context.cookies.get(SESSION_COOKIE)
+            # Never leave a session id in the URL, e.g. from an old bookmark
+            if "sid" in st.query_params:
+                del st.query_params["sid"]
+        if not isinstance(sid, str) or not _SESSION_ID.fullmatch(sid):
+            sid = uuid.uuid4().hex
+            if SESSION_ID_IN_URL:
+                st.query_params["sid"] = sid
+        st.session_state.history_session_id = sid
+    return sid
+
+def _persist_session_cookie():
+    """Store a new session id in the browser's cookie
+
+    Streamlit can read cookies but not set them, so an empty, content-sized iframe
+    sets it from the page; it is only drawn until the browser sends it back.
+    """
+    sid = _history_session_id()
+    if SESSION_ID_IN_URL or st.context.cookies.get(SESSION_COOKIE) == sid:
+        return
+    st.iframe(
+        "<script>"
+        "const secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';"
+        f"window.parent.document.cookie = '{SESSION_COOKIE}={sid}; Path=/; "
+        f"Max-Age={int(SESSION_STATE_TTL)}; SameSite=Strict' + secure;"
+        "</script>",
+        height="content",
+    )
+
+def _save_session_state(sid, name, value):
+    """Keep a piece of session state in the shared tier, if there is one"""
+    shared = get_shared_tier()
+    if shared is not None:
+        shared.set(f"session:{sid}:{name}", value, SESSION_STATE_TTL)
+
+def _append_history(sid, kind, role, content, details=None):
+    """Save a message to the history store, and to the session's recent history in the shared tier"""
+    created_at = time.time()
+    get_history_store().append(sid, kind, role, content, details=details, created_at=created_at)
+    shared = get_shared_tier()
+    if shared is not None:
+        key = f"session:{sid}:history:{kind}"
+        # Bypass the near-cache: another replica may have served this session a moment ago
+        messages = list(shared.get(key, near=False) or [])
+        messages.append([role, content, details, created_at])
+        shared.set(key, messages[-SHARED_HISTORY_MESSAGES:], SESSION_STATE_TTL)
+
+def _restore_session_state():
+    """Load this session's restrictions, chat memory and recent history from the shared tier
+
+    Runs once per browser session, so a session that reconnects to another
+    replica, with no sticky routing, picks up where it left off. Recent
+    messages this replica's history store does not have yet are copied
+    into it, so the restored chat memory matches the transcript on screen.
+    """
+    if st.session_state.get('session_state_restored'):
+        return
+    st.session_state.session_state_restored = True
+    shared = get_shared_tier()
+    if shared is None:
+        return
+    sid = _history_session_id()
+    restrictions, memory, *histories = shared.get_many([
+        f"session:{sid}:restrictions",
+        f"session:{sid}:memory",
+        *(f"session:{sid}:history:{kind}" for kind in HISTORY_KINDS),
+    ])
+    store = get_history_store()
+    for kind, messages in zip(HISTORY_KINDS, histories):
+        if messages and store.count(sid, kind) == 0:
+            for role, content, details, created_at in messages:
+                store.append(sid, kind, role, content, details=details, created_at=created_at)
+    if restrictions:
+        st.session_state.dietary_preferences = restrictions["preferences"]
+        st.session_state.food_allergies = restrictions["allergies"]
+    if memory and 'nutrition_chat_memory' not in st.session_state:
+        st.session_state.nutrition_chat_memory = ConversationMemory.from_dict(memory)
+
+def _nutrition_memory():
+    """Return the chat memory, rebuilding it from stored history after a reload"""
+    if 'nutrition_chat_memory' not in st.session_state:
+        memory = ConversationMemory()
+        for message in get_history_store().page(
+            _history_session_id(), "nutrition", MEMORY_RELOAD_MESSAGES
+        ):
+            memory.add(message["role"], message["content"])
+        st.session_state.nutrition_chat_memory = memory
+    return st.session_state.nutrition_chat_memory
+
+def _change_chat_page(delta):
+    """Move the nutrition chat window by delta pages (positive is older)"""
+    st.session_state.nutrition_chat_page = max(
+        0, st.session_state.get('nutrition_chat_page', 0) + delta
+    )
 
 def nutritionist_menu():
     st.title("Nutritionist - Your Maternal Nutrition Expert")
+    _report_groq_client_error()
     st.header("Maternal Nutrition Guide")
 
-    # Sidebar for preferences and restrictions
-    with st.sidebar:
+    # Sidebar for preferences and restrictions, saved together in one submit
+    with st.sidebar.form("dietary_restrictions"):
         st.subheader("Dietary Preferences")
-        st.session_state.dietary_preferences = st.multiselect(
+        dietary_preferences = st.multiselect(
             "Select your dietary preferences:",
-            ["Vegetarian", "Vegan", "Halal", "Kosher", "Gluten-Free", "Dairy-Free"]
+            DIETARY_PREFERENCES,
+            default=st.session_state.dietary_preferences
         )
 
-        st.session_state.food_allergies = st.multiselect(
+        food_allergies = st.multiselect(
             "Select food allergies:",
-            ["Nuts", "Dairy", "Eggs", "Soy", "Shellfish", "Wheat", "Fish"]
+            FOOD_ALLERGIES,
+            default=st.session_state.food_allergies
         )
 
-    # Main nutrition interface
-    tabs = st.tabs(["Meal Planner", "Nutrition Chat", "General Guidelines"])
+        if st.form_submit_button("Save preferences"):
+            st.session_state.dietary_preferences = dietary_preferences
+            st.session_state.food_allergies = food_allergies
+            _save_session_state(
+                _history_session_id(),
+                "restrictions",
+                {"preferences": dietary_preferences, "allergies": food_allergies}
+            )
+
+    # Main nutrition interface; each tab reruns on its own as a fragment
+    tabs = st.tabs(["Meal Planner", "Nutrition Chat", "Meal Photo Check", "General Guidelines"])
 
-    # Meal Planner Tab
     with tabs[0]:
-        st.subheader("Personalized Meal Plan Generator")
+        _meal_planner_panel()
+
+    with tabs[1]:
+        _nutrition_chat_panel()
 
+    with tabs[2]:
+        _meal_photo_panel()
+
+    with tabs[3]:
+        _nutrition_guidelines_panel()
+
+@st.fragment
+def _meal_planner_panel():
+    _count_fragment_run("meal_planner")
+    st.subheader("Personalized Meal Plan Generator")
+
+    with st.form("meal_planner"):
         col1, col2 = st.columns(2)
         with col1:
             pregnancy_month = st.slider("Months of Pregnancy:", 1, 9)
         with col2:
             meal_type = st.selectbox(
                 "Meal Type:",
-                ["Full Day Plan", "Breakfast", "Lunch", "Dinner", "Snacks"]
-            )
-
-        if st.button("Generate Meal Plan"):
-            prompt = f"Create a {meal_type.lower()} meal plan for someone {pregnancy_month} months pregnant."
-            response = get_nutrition_response(
-                prompt,
-                pregnancy_month,
-                st.session_state.dietary_preferences,
-                st.session_state.food_allergies
+                ["Full Day Plan"] + MEAL_SECTIONS
             )
-            st.write(response)
-
-    # Nutrition Chat Tab
-    with tabs[1]:
-        st.subheader("Chat with Nutrition Assistant")
+        output_format = st.radio("Show the plan as:", ["Table", "Text"], horizontal=True)
+        submitted = st.form_submit_button("Generate Meal Plan")
+
+    if submitted:
+        structured = output_format == "Table"
+        # Runs in the background; a newer plan replaces one still being generated
+        get_job_manager().submit(
+            _history_session_id(),
+            "meal_plan",
+            _meal_plan_job,
+            meal_type,
+            pregnancy_month,
+            st.session_state.dietary_preferences,
+            st.session_state.food_allergies,
+            structured,
+            params={"meal_type": meal_type, "structured": structured}
+        )
 
-        # Display chat history
-        for message in st.session_state.get('nutrition_chat_history', []):
+    _show_job("meal_plan", _render_meal_plan)
+
+def _render_meal_plan(job):
+    meal_type = job.params["meal_type"]
+    structured = job.params["structured"]
+    if meal_type == "Full Day Plan":
+        # Keep sections in meal order while they finish in any order
+        finished = dict(job.partial)
+        for section in MEAL_SECTIONS:
+            if section in finished:
+                if structured:
+                    st.markdown(f"### {section}")
+                    _render_meal(*finished[section])
+                else:
+                    st.markdown(f"### {section}\n\n{finished[section]}")
+            elif job.active:
+                st.info(f"Preparing {section.lower()}...")
+    elif structured:
+        if job.state == DONE:
+            _render_meal(*job.result)
+        elif job.active:
+            st.info(f"Preparing {meal_type.lower()}...")
+    elif job.partial or job.active:
+        st.markdown(job.text() or f"Preparing {meal_type.lower()}...")
+
+def _render_meal(meal, error):
+    """Show one structured meal as a table, or the error that replaced it"""
+    if error is not None:
+        st.error(error)
+        return
+    st.dataframe(meal_rows(meal), hide_index=True, width="stretch")
+    if meal["tip"]:
+        st.caption(meal["tip"])
+
+@st.fragment
+def _nutrition_chat_panel():
+    _count_fragment_run("nutrition_chat")
+    st.subheader("Chat with Nutrition Assistant")
+
+    # Display one page of the stored chat history instead of the whole conversation
+    store = get_history_store()
+    sid = _history_session_id()
+    total = store.count(sid, "nutrition")
+    page = st.session_state.get('nutrition_chat_page', 0)
+    history = store.page(sid, "nutrition", CHAT_PAGE_SIZE, page * CHAT_PAGE_SIZE)
+
+    history_box = st.container()
+    with history_box:
+        if total:
+            col_earlier, col_later = st.columns(2)
+            with col_earlier:
+                st.button("Earlier messages", on_click=_change_chat_page, args=(1,),
+                          disabled=(page + 1) * CHAT_PAGE_SIZE >= total)
+            with col_later:
+                st.button("Later messages", on_click=_change_chat_page, args=(-1,),
+                          disabled=page == 0)
+
+        for message in history:
             if message["role"] == "user":
                 st.write("You:", message["content"])
             else:
                 st.write("Nutritionist:", message["content"])
 
-        # Chat input
+    # Chat input, submitted together with the month
+    with st.form("nutrition_chat"):
         user_question = st.text_input("Ask about nutrition during pregnancy:")
         pregnancy_month = st.slider("Current month of pregnancy:", 1, 9, key="chat_pregnancy_month")
+        submitted = st.form_submit_button("Ask")
 
-        if st.button("Ask"):
-            if user_question:
-                if 'nutrition_chat_history' not in st.session_state:
-                    st.session_state.nutrition_chat_history = []
+    if submitted and user_question:
+        job = get_job_manager().get(sid, "nutrition_chat")
+        if job is not None and job.active:
+            st.warning("Please wait for the answer to your last question, or cancel it.")
+        else:
+            memory = _nutrition_memory()
+            st.session_state.nutrition_chat_page = 0
 
-                # Add user message to history
-                st.session_state.nutrition_chat_history.append(
-                    {"role": "user", "content": user_question}
-                )
+            # Add user message to history; the store writes it in the background
+            _append_history(sid, "nutrition", "user", user_question)
+
+            # Draw the new turn straight into the history so no rerun is needed
+            with history_box:
+                st.write("You:", user_question)
 
-                # Get AI response
-                response = get_nutrition_response(
+            # Reuse the answer to a near-identical earlier question if there is one.
+            # Stored answers were given without any conversation, so a follow-up
+            # in an ongoing conversation always goes to the model
+            segment = segment_key(
+                pregnancy_month,
+                st.session_state.dietary_preferences,
+                st.session_state.food_allergies
+            )
+            match = None
+            if not memory.messages():
+                match = get_question_index().lookup(segment, user_question)
+            if match is not None:
+                response = match[0]
+                get_metrics().record_local("nutrition", "similar")
+                with history_box:
+                    st.write("Nutritionist:", response)
+
+                # Add AI response to history and memory
+                _append_history(sid, "nutrition", "assistant", response)
+                memory.add("user", user_question)
+                memory.add("assistant", response)
+                _save_session_state(sid, "memory", memory.to_dict())
+            else:
+                # Answer in the background with the compact conversation context
+                # from memory; the job saves the turn when the answer is complete
+                get_job_manager().submit(
+                    sid,
+                    "nutrition_chat",
+                    _nutrition_chat_job,
+                    sid,
+                    memory,
                     user_question,
                     pregnancy_month,
                     st.session_state.dietary_preferences,
-                    st.session_state.food_allergies
+                    st.session_state.food_allergies,
+                    segment
                 )
 
-                # Add AI response to history
-                st.session_state.nutrition_chat_history.append(
-                    {"role": "assistant", "content": response}
-                )
-
-                st.experimental_rerun()
-
-    # General Guidelines Tab
-    with tabs[2]:
-        st.subheader("Nutrition Guidelines by Trimester")
-
-        trimester = st.selectbox(
-            "Select Trimester:",
-            ["First Trimester (Months 1-3)",
-             "Second Trimester (Months 4-6)",
-             "Third Trimester (Months 7-9)"]
-        )
-
-        # Show trimester-specific guidelines
-        if trimester == "First Trimester (Months 1-3)":
-            st.write("""
-            ### First Trimester Nutrition Guidelines
-            - Focus on folate-rich foods
-            - Small, frequent meals to manage nausea
-            - Stay hydrated
-            - Key nutrients: Folic acid, Iron, Vitamin B6
-
-            **Recommended Foods:**
-            - Leafy greens
-            - Whole grains
-            - Lean proteins
-            - Citrus fruits
-            """)
-
-        elif trimester == "Second Trimester (Months 4-6)":
-            st.write("""
-            ### Second Trimester Nutrition Guidelines
-            - Increased caloric needs
-            - Focus on calcium and vitamin D
-            - Protein-rich foods
-            - Omega-3 fatty acids
-
-            **Recommended Foods:**
-            - Dairy products
-            - Fatty fish (low-mercury)
-            - Lean meats
-            - Nuts and seeds
-            """)
-
+    # A finished answer is already in the stored history, so only a running one is drawn
+    with history_box:
+        _show_job("nutrition_chat", _render_chat_answer)
+
+def _render_chat_answer(job):
+    if job.active:
+        st.write("Nutritionist:", job.text() or "...")
+
+@st.fragment
+def _meal_photo_panel():
+    _count_fragment_run("meal_photo")
+    st.subheader("Check a Photo of Your Meal")
+
+    with st.form("meal_photo"):
+        photo = st.file_uploader("Upload a photo of your meal:", type=PHOTO_TYPES)
+        pregnancy_month = st.slider("Current month of pregnancy:", 1, 9, key="photo_pregnancy_month")
+        submitted = st.form_submit_button("Check Meal")
+
+    if submitted:
+        if photo is None:
+            st.warning("Please upload a photo first.")
+        elif photo.size > PHOTO_MAX_UPLOAD_BYTES:
+            st.error(f"That photo is too large. Please upload one under {PHOTO_MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
         else:
-            st.write("""
-            ### Third Trimester Nutrition Guidelines
-            - Higher protein needs
-            - Iron-rich foods
-            - Smaller, more frequent meals
-            - Foods to aid digestion
-
-            **Recommended Foods:**
-            - High-protein foods
-            - Iron-fortified foods
-            - Fiber-rich fruits and vegetables
-            - Healthy fats
-            """)
-
-        # Important note
-        st.info("""
-        **Note:** These are general guidelines. Always consult your healthcare provider
-        for personalized nutrition advice during pregnancy.
-        """)
+            get_job_manager().submit(
+                _history_session_id(),
+                "meal_photo",
+                _meal_photo_job,
+                photo,
+                pregnancy_month,
+                st.session_state.dietary_preferences,
+                st.session_state.food_allergies
+            )
 
-# Function for the Educational Library Tab
-def educational_library():
-    st.title("Educational Library - Pregnancy Resources")
-    
-    # Welcome message
-    st.write("""
-    Welcome to our Educational Library! Here, you'll find comprehensive resources to guide you through every aspect of pregnancy, from early stages to postpartum care.
-    """)
+    _show_job("meal_photo", _render_meal_photo)
 
-    # Sidebar to choose a topic
-    topic = st.sidebar.selectbox(
-        "Choose a section:",
-        ["Pregnancy Stages & Development", "Nutrition and Diet Guides", "Exercise & Fitness", 
-         "Mental Health & Emotional Well-being", "Common Pregnancy Symptoms", "Prenatal Care & Medical Tests", 
-         "Childbirth Preparation", "Postpartum Care", "Baby Care Basics", "Expert Articles & Research", 
-         "Pregnancy & Parenting Blogs", "Interactive Quizzes", "Pregnancy Glossary", "FAQ", "Interactive Journals"]
+def _render_meal_photo(job):
+    if job.active:
+        st.info("Looking at your meal...")
+    elif job.state == DONE:
+        if is_error_response(job.result):
+            st.error(job.result)
+        else:
+            st.markdown(job.result)
+
+@st.fragment
+def _nutrition_guidelines_panel():
+    _count_fragment_run("nutrition_guidelines")
+    st.subheader("Nutrition Guidelines by Trimester")
+
+    trimester = st.selectbox(
+        "Select Trimester:",
+        ["First Trimester (Months 1-3)",
+         "Second Trimester (Months 4-6)",
+         "Third Trimester (Months 7-9)"]
     )
 
-    # Pregnancy Stages & Development
-    if topic == "Pregnancy Stages & Development":
-        st.subheader("Pregnancy Stages & Development")
-        st.write("""
-        Learn what to expect each month during pregnancy, from fetal development to physical changes in the body.
-        """)
-        st.image("https://example.com/pregnancy_stages_image.jpg", caption="Pregnancy Development Stages")
-        
-        st.write("""
-        **First Trimester** (0-12 Weeks):
-        - Key Development: The embryo forms organs and structures.
-        - Symptoms: Morning sickness, fatigue, and nausea.
-
-        **Second Trimester** (13-26 Weeks):
-        - Key Development: Fetal movement, developing organs.
-        - Symptoms: Reduced nausea, increased energy.
-
-        **Third Trimester** (27-40 Weeks):
-        - Key Development: Baby grows rapidly, prepares for birth.
-        - Symptoms: Physical discomfort, back pain, frequent urination.
-
-        For more details on each month, check out these guides:
-        - [First Trimester Guide](https://example.com/first_trimester)
-        - [Second Trimester Guide](https://example.com/second_trimester)
-        - [Third Trimester Guide](https://example.com/third_trimester)
-        """)
-
-    # Nutrition and Diet Guides
-    elif topic == "Nutrition and Diet Guides":
-        st.subheader("Nutrition and Diet Guides")
-        st.write("""
-        Proper nutrition during pregnancy is essential for both you and your baby. Here's a breakdown of what to eat during each trimester.
-        """)
-        
-        st.write("""
-        **First Trimester**:
-        - Focus on folic acid, vitamin D, and iron-rich foods like leafy greens, eggs, and fortified cereals.
-
-        **Second Trimester**:
-        - Add more protein-rich foods like beans, lentils, and lean meats. Focus on calcium and vitamin D for strong bones.
-
-        **Third Trimester**:
-        - Focus on healthy fats, whole grains, and continue to include calcium and protein-rich foods.
-        """)
-
-        # Interactive Meal Planner (This will be a simple input and suggestion tool)
-        st.write("**Dietary Preferences**")
-        dietary_preference = st.selectbox(
-            "Select your dietary preference:",
-            ["Vegetarian", "Non-Vegetarian", "Vegan", "Gluten-Free", "No preference"]
-        )
-
-        if dietary_preference:
-            st.write(f"Suggested meal plan for {dietary_preference} diet:")
-            # You can enhance this by providing actual meal recommendations based on input
-            st.write("Breakfast: Oatmeal with nuts and fruits")
-            st.write("Lunch: Grilled chicken with quinoa and salad")
-            st.write("Dinner: Stir-fried vegetables with tofu")
-
-    # Exercise & Fitness for Pregnant Women
-    elif topic == "Exercise & Fitness":
-        st.subheader("Exercise & Fitness for Pregnant Women")
-        st.write("""
-        Staying active during pregnancy can help you feel better and prepare for childbirth. Here are some safe exercises.
-        """)
-        st.video("https://www.youtube.com/watch?v=exercise_video_id", caption="Pregnancy Fitness Video")
-        
+    # Show trimester-specific guidelines
+    if trimester == "First Trimester (Months 1-3)":
         st.write("""
-        **Recommended Exercises:**
-        - **Walking:** Low-impact and safe for all trimesters.
-        - **Yoga:** Helps with flexibility and reduces stress.
-        - **Pelvic Floor Exercises:** Strengthen muscles for labor.
+        ### First Trimester Nutrition Guidelines
+        - Focus on folate-rich foods
+        - Small, frequent meals to manage nausea
+        - Stay hydrated
+        - Key nutrients: Folic acid, Iron, Vitamin B6
+
+        **Recommended Foods:**
+        - Leafy greens
+        - Whole grains
+        - Lean proteins
+        - Citrus fruits
         """)
 
-    # Mental Health & Emotional Well-being
-    elif topic == "Mental Health & Emotional Well-being":
-        st.subheader("Mental Health & Emotional Well-being")
+    elif trimester == "Second Trimester (Months 4-6)":
         st.write("""
-        Pregnancy is an emotional rollercoaster. It's important to manage your mental well-being during this time.
+        ### Second Trimester Nutrition Guidelines
+        - Increased caloric needs
+        - Focus on calcium and vitamin D
+        - Protein-rich foods
+        - Omega-3 fatty acids
+
+        **Recommended Foods:**
+        - Dairy products
+        - Fatty fish (low-mercury)
+        - Lean meats
+        - Nuts and seeds
         """)
 
+    else:
         st.write("""
-        **Tips:**
-        - Take time for yourself with relaxation and mindfulness exercises.
-        - Practice breathing techniques to manage anxiety.
-        - Talk to a professional if you feel overwhelmed.
+        ### Third Trimester Nutrition Guidelines
+        - Higher protein needs
+        - Iron-rich foods
+        - Smaller, more frequent meals
+        - Foods to aid digestion
+
+        **Recommended Foods:**
+        - High-protein foods
+        - Iron-fortified foods
+        - Fiber-rich fruits and vegetables
+        - Healthy fats
         """)
 
-        st.audio("https://example.com/guided_meditation.mp3", caption="Guided Meditation for Pregnancy")
-
-    # Common Pregnancy Symptoms
-    elif topic == "Common Pregnancy Symptoms":
-        st.subheader("Common Pregnancy Symptoms")
-        st.write("""
-        Here's a guide on common symptoms and how to manage them during pregnancy.
-        """)
-
-        st.write("""
-        - **Nausea & Vomiting:** Eat small meals, drink fluids, and rest.
-        - **Back Pain:** Practice good posture, use a pregnancy pillow.
-        - **Fatigue:** Rest when needed and maintain a balanced diet.
-        """)
+    # Important note
+    st.info("""
+    **Note:** These are general guidelines. Always consult your healthcare provider
+    for personalized nutrition advice during pregnancy.
+    """)
 
-        # Symptom Tracker
-        st.write("**Track Your Symptoms**")
-        symptom = st.selectbox("Select your current symptom:", ["Nausea", "Back Pain", "Fatigue", "Headache"])
-        if symptom:
-            st.write(f"You are experiencing: {symptom}")
-            st.write("Based on your symptom, here are some remedies: ...")
+def _render_dietary_preference(widget):
+    st.write("**Dietary Preferences**")
+    dietary_preference = st.selectbox(widget["label"], widget["options"])
+
+    if dietary_preference:
+        st.write(f"Suggested meal plan for {dietary_preference} diet:")
+        for meal in widget["meals"]:
+            st.write(meal)
+
+def _render_symptom_tracker(widget):
+    st.write("**Track Your Symptoms**")
+    symptom = st.selectbox(widget["label"], widget["options"])
+    if symptom:
+        st.write(f"You are experiencing: {symptom}")
+        st.write(f"Based on your symptom, here are some remedies: {widget['remedies'][symptom]}")
+
+def _render_visit_checklist(widget):
+    st.write("**Prenatal Visit Checklist**")
+    checklist_completed = st.multiselect(widget["label"], widget["items"])
+    st.write(f"Completed checklist: {', '.join(checklist_completed)}")
+
+def _render_journal(widget):
+    if 'journal_entries' not in st.session_state:
+        st.session_state.journal_entries = []
+
+    prompt = st.selectbox("Journal prompt:", widget["prompts"])
+    entry = st.text_area(prompt, height=120, key="journal_entry")
+    if st.button("Save entry") and entry:
+        st.session_state.journal_entries.append(
+            {"date": datetime.now().strftime("%Y-%m-%d %H:%M"), "prompt": prompt, "entry": entry}
+        )
 
-    # Prenatal Care & Medical Tests
-    elif topic == "Prenatal Care & Medical Tests":
-        st.subheader("Prenatal Care & Medical Tests")
-        st.write("""
-        Prenatal care is crucial during pregnancy. Here are some key tests and what to expect.
-        """)
+    for saved in reversed(st.session_state.journal_entries):
+        st.write(f"**{saved['date']}** - {saved['prompt']}")
+        st.write(saved["entry"])
+
+# Interactive widgets a library section can declare in its content file
+LIBRARY_WIDGETS = {
+    "dietary_preference": _render_dietary_preference,
+    "symptom_tracker": _render_symptom_tracker,
+    "visit_checklist": _render_visit_checklist,
+    "journal": _render_journal,
+}
+
+def _render_quiz(section):
+    answers = []
+    for n, item in enumerate(section["quiz"]):
+        answers.append(st.radio(item["question"], item["options"], index=None,
+                                key=f"quiz_{section['slug']}_{n}"))
+
+    if st.button("Check answers"):
+        correct = 0
+        for item, answer in zip(section["quiz"], answers):
+            if answer == item["options"][item["answer"]]:
+                correct += 1
+                st.success(f"{item['question']} - Correct! {item['explanation']}")
+            else:
+                st.error(f"{item['question']} - {item['explanation']}")
+        st.write(f"You scored {correct} out of {len(section['quiz'])}.")
+
+def render_library_section(section):
+    """Render one content-store section with its media, articles and widgets"""
+    st.subheader(section.get("heading", section["title"]))
+    st.write(section["intro"])
+
+    for media in section.get("media", []):
+        if media["type"] == "image":
+            st.image(media["url"], caption=media.get("caption"))
+        elif media["type"] == "video":
+            st.video(media["url"])
+            st.caption(media.get("caption", ""))
+        elif media["type"] == "audio":
+            st.audio(media["url"])
+            st.caption(media.get("caption", ""))
+
+    for article in section.get("articles", []):
+        st.markdown(f"**{article['title']}**")
+        st.markdown(article["body"])
+
+    if section.get("glossary"):
+        term_filter = st.text_input("Filter terms:", key=f"glossary_filter_{section['slug']}")
+        for entry in section["glossary"]:
+            if term_filter.lower() in entry["term"].lower():
+                st.markdown(f"**{entry['term']}**: {entry['definition']}")
+
+    for entry in section.get("faq", []):
+        with st.expander(entry["question"]):
+            st.write(entry["answer"])
+
+    if section.get("quiz"):
+        _render_quiz(section)
+
+    widget = section.get("widget")
+    if widget:
+        LIBRARY_WIDGETS[widget["type"]](widget)
+
+def _open_library_section(title):
+    st.session_state.library_topic = title
 
-        st.write("""
-        **Key Tests**:
-        - **Blood Tests:** Check for iron levels, infections, and blood type.
-        - **Ultrasound:** Track fetal development.
-        - **Glucose Test:** Screen for gestational diabetes.
-        """)
+# Function for the Educational Library Tab
+def educational_library():
+    st.title("Educational Library - Pregnancy Resources")
+    
+    # Welcome message
+    st.write("""
+    Welcome to our Educational Library! Here, you'll find comprehensive resources to guide you through every aspect of pregnancy, from early stages to postpartum care.
+    """)
 
-        # Interactive Test Checklist
-        st.write("**Prenatal Visit Checklist**")
-        visit_checklist = ["Discuss any concerns", "Review ultrasound results", "Ask about recommended exercises"]
-        checklist_completed = st.multiselect("Select completed items:", visit_checklist)
-        st.write(f"Completed checklist: {', '.join(checklist_completed)}")
+    # Sidebar to choose a topic
+    topic = st.sidebar.selectbox("Choose a section:", section_titles(), key="library_topic")
 
-    # Continue with more sections similarly...
+    # Search across every section using the prebuilt index
+    query = st.text_input("Search the library:")
+    if query:
+        results = get_search_index().search(query)
+        if not results:
+            st.write("No matching articles found.")
+        for n, (score, doc) in enumerate(results):
+            st.markdown(f"**{doc['title']}** ({doc['section']})")
+            st.caption(doc["snippet"])
+            st.button(f"Open {doc['section']}", key=f"library_result_{n}",
+                      on_click=_open_library_section, args=(doc["section"],))
+        st.divider()
 
-    # **Optional**: You can implement a blog section, expert articles, quizzes, and journaling features in a similar fashion.
+    # Sections are parsed on first use and then cached for the process
+    render_library_section(load_section(topic))
 
 
 def home_page():
@@ -434,78 +1249,287 @@ def home_page():
 
 def symptom_checker():
     st.title("Virtual Doctor - Your Pregnancy Symptom Checker 👩‍⚕️")
+    _report_groq_client_error()
+    _symptom_assessment_panel()
 
-    # Patient Information
-    st.subheader("Basic Information")
-    col1, col2 = st.columns(2)
+@st.fragment
+def _symptom_assessment_panel():
+    _count_fragment_run("symptom_assessment")
 
-    with col1:
-        pregnancy_week = st.slider("Current Week of Pregnancy:", 1, 42)
-        previous_complications = st.multiselect(
-            "Any previous pregnancy complications?",
-            ["None", "Gestational Diabetes", "Preeclampsia", "Morning Sickness", "Other"]
-        )
+    # All inputs are submitted together, so editing them does not rerun anything
+    with st.form("symptom_checker"):
+        # Patient Information
+        st.subheader("Basic Information")
+        col1, col2 = st.columns(2)
+        with col1:
+            pregnancy_week = st.slider("Current Week of Pregnancy:", 1, 42)
+            previous_complications = st.multiselect(
+                "Any previous pregnancy complications?",
+                ["None", "Gestational Diabetes", "Preeclampsia", "Morning Sickness", "Other"]
+            )
 
-    with col2:
-        current_symptoms = st.multiselect(
-            "Current Symptoms:",
-            ["Nausea", "Headache", "Fatigue", "Cramping", "Bleeding",
-             "Swelling", "Back Pain", "Fever", "Other"]
-        )
-        symptom_severity = st.select_slider(
-            "Symptom Severity:",
-            options=["Mild", "Moderate", "Severe"]
-        )
+        with col2:
+            current_symptoms = st.multiselect(
+                "Current Symptoms:",
+                ["Nausea", "Headache", "Fatigue", "Cramping", "Bleeding",
+                 "Swelling", "Back Pain", "Fever", "Other"]
+            )
+            symptom_severity = st.select_slider(
+                "Symptom Severity:",
+                options=["Mild", "Moderate", "Severe"]
+            )
 
-    # Additional Details
-    st.subheader("Symptom Details")
-    symptom_description = st.text_area(
-        "Please describe your symptoms in detail:",
-        height=100
-    )
+        # Additional Details
+        st.subheader("Symptom Details")
+        symptom_description = st.text_area(
+            "Please describe your symptoms in detail:",
+            height=100
+        )
+        # Common low-risk combinations are answered locally unless the user asks for the AI doctor
+        force_llm = st.checkbox("Always get a full AI assessment", value=TRIAGE_FORCE_LLM)
+        submitted = st.form_submit_button("Get Assessment")
 
-    # Emergency Warning
-    if any(symptom in ["Bleeding", "Fever"] for symptom in current_symptoms) or symptom_severity == "Severe":
-        st.error("""
-        ⚠️ IMPORTANT: If you're experiencing severe symptoms, heavy bleeding, or high fever,
-        please seek immediate medical attention or contact your healthcare provider.
-        This tool is not a replacement for professional medical care.
-        """)
+    if submitted:
+        urgent = any(symptom in ["Bleeding", "Fever"] for symptom in current_symptoms) or symptom_severity == "Severe"
 
-    if st.button("Get Assessment"):
         if current_symptoms:
-            prompt = f"""
-            Patient is {pregnancy_week} weeks pregnant with the following symptoms:
-            - Current Symptoms: {', '.join(current_symptoms)}
-            - Severity: {symptom_severity}
-            - Previous Complications: {', '.join(previous_complications)}
-            - Additional Details: {symptom_description}
-            """
-
-            # Get response from the virtual doctor
-            response = get_symptom_assessment_response(
-                prompt,
-                pregnancy_week // 4  # Convert weeks to months
-            )
-
-            # Add AI response to history with the correct role
-            if 'symptom_chat_history' not in st.session_state:
-                st.session_state.symptom_chat_history = []
-
-            # Add user message to history
-            st.session_state.symptom_chat_history.append(
-                {"role": "user", "content": prompt}
+            prompt = symptom_prompt(
+                pregnancy_week,
+                current_symptoms,
+                symptom_severity,
+                previous_complications,
+                symptom_description
             )
 
-            # Add AI response to history
-            st.session_state.symptom_chat_history.append(
-                {"role": "doctor", "content": response}  # Change role to "doctor"
-            )
+            assessment = None
+            if not force_llm:
+                assessment = triage(
+                    pregnancy_week,
+                    current_symptoms,
+                    symptom_severity,
+                    previous_complications,
+                    symptom_description
+                )
 
-            st.write("### Assessment")
-            st.write(response)
+            sid = _history_session_id()
+            details = {
+                "pregnancy_week": pregnancy_week,
+                "symptoms": current_symptoms,
+                "severity": symptom_severity,
+                "previous_complications": previous_complications,
+                "source": "triage" if assessment is not None else "llm",
+            }
+            if assessment is not None:
+                # Known-safe combination: answer instantly from vetted guidance
+                response = format_assessment(assessment)
+                get_metrics().record_local("symptom", "triage")
+                _save_assessment(sid, prompt, response, details)
+                get_job_manager().record(sid, "symptom_assessment", response, params={"urgent": urgent})
+            else:
+                # The virtual doctor answers in the background
+                get_job_manager().submit(
+                    sid,
+                    "symptom_assessment",
+                    _symptom_assessment_job,
+                    sid,
+                    prompt,
+                    pregnancy_week,
+                    details,
+                    params={"urgent": urgent}
+                )
         else:
+            if urgent:
+                _render_emergency_warning()
             st.warning("Please select at least one symptom for assessment.")
+            return
+
+    _show_job("symptom_assessment", _render_assessment)
+
+def _render_emergency_warning():
+    st.error("""
+    ⚠️ IMPORTANT: If you're experiencing severe symptoms, heavy bleeding, or high fever,
+    please seek immediate medical attention or contact your healthcare provider.
+    This tool is not a replacement for professional medical care.
+    """)
+
+def _render_assessment(job):
+    if job.params["urgent"]:
+        _render_emergency_warning()
+    st.write("### Assessment")
+    if job.state == DONE:
+        st.markdown(job.result)
+    elif job.active or job.partial:
+        st.markdown(job.text() or "Assessing your symptoms...")
+
+# How often the Resources page refreshes its charts
+METRICS_REFRESH_SECONDS = 5
+
+def _register_metric_collectors():
+    """Expose cache, coalescing and limiter state alongside the call metrics"""
+    def collect():
+        cache = get_response_cache().stats()
+        flight = get_single_flight().stats()
+        limiter = get_rate_limiter().stats()
+        questions = get_question_index().stats()
+        history = get_history_store().stats()
+        router = get_model_router().stats()
+        jobs = get_job_manager().stats()
+        prompts = get_prompt_budget().stats()
+        samples = [
+            ("mh_response_cache_entries", "gauge", None, cache["entries"]),
+            ("mh_response_cache_hits_total", "counter", {"tier": "memory"}, cache["hits"]),
+            ("mh_response_cache_hits_total", "counter", {"tier": "shared"}, cache["shared_hits"]),
+            ("mh_response_cache_misses_total", "counter", None, cache["misses"]),
+            ("mh_single_flight_leaders_total", "counter", None, flight["leaders"]),
+            ("mh_single_flight_coalesced_total", "counter", None, flight["coalesced"]),
+            ("mh_groq_in_flight", "gauge", None, limiter["in_flight"]),
+            ("mh_groq_throttled_total", "counter", None, limiter["throttled"]),
+            ("mh_question_index_entries", "gauge", None, questions["entries"]),
+            ("mh_history_queued", "gauge", None, history["queued"]),
+            ("mh_history_written_total", "counter", None, history["written"]),
+            ("mh_router_hedges_total", "counter", None, router["hedges"]),
+            ("mh_router_hedge_wins_total", "counter", None, router["hedge_wins"]),
+            ("mh_router_fallbacks_total", "counter", None, router["fallbacks"]),
+            ("mh_jobs_submitted_total", "counter", None, jobs["submitted"]),
+            ("mh_jobs_replaced_total", "counter", None, jobs["replaced"]),
+            ("mh_jobs_active", "gauge", {"state": "queued"}, jobs["queued"]),
+            ("mh_jobs_active", "gauge", {"state": "running"}, jobs["running"]),
+            ("mh_prompt_contexts_compiled", "gauge", None, prompts["contexts"]),
+            ("mh_prompt_requests_total", "counter", None, prompts["requests"]),
+            ("mh_prompt_tokens_estimated_total", "counter", None, prompts["tokens"]),
+            ("mh_prompt_history_trimmed_total", "counter", None, prompts["trimmed"]),
+            ("mh_prompt_over_budget_total", "counter", None, prompts["rejected"]),
+        ]
+        shared = get_shared_tier()
+        if shared is not None:
+            tier = shared.stats()
+            samples += [
+                ("mh_shared_tier_hits_total", "counter", {"tier": "near"}, tier["near_hits"]),
+                ("mh_shared_tier_hits_total", "counter", {"tier": "backend"}, tier["hits"]),
+                ("mh_shared_tier_misses_total", "counter", None, tier["misses"]),
+                ("mh_shared_tier_errors_total", "counter", None, tier["errors"]),
+                ("mh_shared_tier_written_bytes_total", "counter", {"encoding": "raw"}, tier["raw_bytes"]),
+                ("mh_shared_tier_written_bytes_total", "counter", {"encoding": "stored"}, tier["stored_bytes"]),
+                ("mh_shared_tier_claims_total", "counter", {"outcome": "won"}, tier["claims_won"]),
+                ("mh_shared_tier_claims_total", "counter", {"outcome": "lost"}, tier["claims_lost"]),
+            ]
+        for model, stats in router["models"].items():
+            samples.append(("mh_router_circuit_open", "gauge", {"model": model},
+                            int(stats["state"] != "closed")))
+            samples.append(("mh_router_circuit_trips_total", "counter", {"model": model}, stats["trips"]))
+        return samples
+
+    get_metrics().add_collector("app", collect)
+
+@st.cache_resource
+def _start_process_services():
+    """Start the metrics exporters and compile the prompt contexts, once per process
+
+    The script itself runs again on every rerun, so this is cached instead.
+    """
+    start_exporters()
+    _register_metric_collectors()
+    compile_contexts(DIETARY_PREFERENCES, FOOD_ALLERGIES)
+
+def resources_page():
+    st.title("Resources - Service Metrics 📈")
+    st.write("""
+    Live latency, token usage and cache statistics for assistant requests served by this
+    server process.
+    """)
+    _metrics_panel()
+
+@st.fragment(run_every=METRICS_REFRESH_SECONDS)
+def _metrics_panel():
+    samples = get_metrics().recent_samples()
+    if not samples:
+        st.info("No assistant requests have been recorded yet.")
+    else:
+        pd = lazy_import("pandas")
+        df = pd.DataFrame(samples)
+        llm = df[(df["source"] == "llm") & df["error"].isna()].copy()
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Requests", len(df))
+        col2.metric("Served without the model", f"{(df['source'] != 'llm').mean():.0%}")
+        col3.metric("Error rate", f"{df['error'].notna().mean():.1%}")
+        col4.metric("Tokens", int(df["prompt_tokens"].fillna(0).sum() + df["completion_tokens"].fillna(0).sum()))
+
+        if not llm.empty:
+            llm["minute"] = pd.to_datetime(llm["time"], unit="s").dt.floor("min")
+
+            st.subheader("Model latency percentiles (seconds)")
+            latency = llm.groupby("minute")["latency"].quantile([0.5, 0.95, 0.99]).unstack()
+            latency.columns = ["p50", "p95", "p99"]
+            st.line_chart(latency)
+
+            st.subheader("Time to first token percentiles (seconds)")
+            ttft = llm.groupby("minute")["ttft"].quantile([0.5, 0.95, 0.99]).unstack()
+            ttft.columns = ["p50", "p95", "p99"]
+            st.line_chart(ttft)
+
+            st.subheader("By model")
+            st.dataframe(llm.groupby("model").agg(
+                requests=("latency", "size"),
+                p50_s=("latency", lambda x: x.quantile(0.5)),
+                p95_s=("latency", lambda x: x.quantile(0.95)),
+                p99_s=("latency", lambda x: x.quantile(0.99)),
+                mean_ttft_s=("ttft", "mean"),
+                prompt_tokens=("prompt_tokens", "sum"),
+                completion_tokens=("completion_tokens", "sum"),
+            ))
+
+        st.subheader("Requests by source")
+        st.bar_chart(df.groupby(["request_type", "source"]).size().unstack(fill_value=0))
+
+        errors = df[df["error"].notna()]
+        if not errors.empty:
+            st.subheader("Errors")
+            st.dataframe(errors.groupby(["model", "error"]).size().rename("count").reset_index())
+
+    router = get_model_router().stats()
+    if router["models"]:
+        st.subheader("Model routing")
+        st.caption(
+            f"{router['hedges']} hedged requests ({router['hedge_wins']} won by the hedge), "
+            f"{router['fallbacks']} fallbacks to another model"
+        )
+        st.dataframe(
+            [{"model": model, **stats} for model, stats in router["models"].items()],
+            hide_index=True
+        )
+
+    shared = get_shared_tier()
+    if shared is not None:
+        tier = shared.stats()
+        st.subheader("Shared tier")
+        st.caption(
+            f"{tier['backend']}: {tier['near_hits']} near-cache hits, {tier['hits']} backend hits, "
+            f"{tier['misses']} misses, {tier['errors']} errors; "
+            f"{tier['claims_lost']} of {tier['claims_won'] + tier['claims_lost']} model calls "
+            f"left to another replica; {tier['stored_bytes']:,} bytes written "
+            f"for {tier['raw_bytes']:,} bytes of values"
+        )
+
+    with st.expander("Prometheus metrics"):
+        st.caption("Set METRICS_PORT to scrape these at /metrics, or METRICS_FILE to write them to a file.")
+        st.code(get_metrics().render_prometheus(), language="text")
+
+def render_profile_panel():
+    """Show import and page render timings in the sidebar"""
+    profile = profile_summary()
+    with st.sidebar.expander("Startup profile"):
+        if profile["first_render_ms"] is not None:
+            st.write(f"First page rendered {profile['first_render_ms']:.0f} ms after the app started loading")
+        st.write("**Imports (ms)**")
+        st.table({name: round(ms, 1) for name, ms in profile["imports_ms"].items()})
+        st.write("**Reruns**")
+        st.table(profile["reruns"])
+        st.write("**Page renders (ms)**")
+        st.table({
+            page: {key: round(value, 1) for key, value in stats.items()}
+            for page, stats in profile["pages"].items()
+        })
 
 def main():
     st.set_page_config(
@@ -514,6 +1538,16 @@ def main():
         layout="wide"
     )
 
+    _start_process_services()
+
+    # Count full script runs; fragments count their own partial reruns
+    st.session_state.script_runs = st.session_state.get('script_runs', 0) + 1
+    count_rerun("script")
+
+    # Pin the history id into a cookie on the first run so a reload finds it again
+    _persist_session_cookie()
+    _restore_session_state()
+
     # Initialize navigation in session state if not exists
     if 'navigation' not in st.session_state:
         st.session_state.navigation = "Home"
@@ -526,14 +1560,20 @@ def main():
     )
 
     # Page routing
-    if st.session_state.navigation == "Home":
-        home_page()
-    elif st.session_state.navigation == "Symptom Checker":
-        symptom_checker()
-    elif st.session_state.navigation == "Nutritionist":
-        nutritionist_menu()
-    elif st.session_state.navigation == "Educational Library":
-        educational_library()
+    with timed_render(st.session_state.navigation):
+        if st.session_state.navigation == "Home":
+            home_page()
+        elif st.session_state.navigation == "Symptom Checker":
+            symptom_checker()
+        elif st.session_state.navigation == "Nutritionist":
+            nutritionist_menu()
+        elif st.session_state.navigation == "Educational Library":
+            educational_library()
+        elif st.session_state.navigation == "Resources":
+            resources_page()
+
+    if PROFILE_STARTUP:
+        render_profile_panel()
 
 if __name__ == "__main__":
     main()
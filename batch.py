@@ -0,0 +1,401 @@
+"""Headless batch tools: bulk symptom assessments and meal plan cache pre-warming.
+
+Assess a CSV of patient check-ins (columns as in the symptom checker form:
+week, symptoms, severity, complications and an optional description and
+id) with
+
+    python batch.py assess checkins.csv assessments.csv --concurrency 8
+
+Each result is appended to the output file as soon as it is ready, and the
+output file is the checkpoint: running the same command again skips every
+check-in already in it, so an interrupted run resumes where it stopped.
+Check-ins whose model call keeps failing are left out and retried on the
+next run; check-ins with invalid input, or too long for the prompt budget,
+are written with an error.
+
+Fill the response cache with every month x meal x common restriction plan
+the nutritionist offers (needs SHARED_TIER_URL or RESPONSE_CACHE_DB, shared
+with the app) with
+
+    python batch.py prewarm --format both
+
+Plans already in the cache are skipped, so prewarm can also be rerun.
+"""
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from profiling import lazy_import
+
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 3
+DEFAULT_CHUNK_ROWS = 1000
+# Seconds before the first retry of a failed model call; doubles each time
+RETRY_BACKOFF = 2.0
+PROGRESS_EVERY = 50
+
+SEVERITIES = ["Mild", "Moderate", "Severe"]
+
+# Accepted input column names, mapped to the symptom checker's fields
+COLUMN_ALIASES = {
+    "id": "id", "checkin_id": "id", "patient_id": "id",
+    "week": "pregnancy_week", "pregnancy_week": "pregnancy_week",
+    "symptoms": "symptoms", "current_symptoms": "symptoms",
+    "severity": "severity", "symptom_severity": "severity",
+    "complications": "previous_complications", "previous_complications": "previous_complications",
+    "description": "description", "details": "description", "symptom_description": "description",
+}
+REQUIRED_COLUMNS = ["pregnancy_week", "symptoms", "severity"]
+
+OUTPUT_COLUMNS = [
+    "id", "pregnancy_week", "symptoms", "severity", "previous_complications",
+    "source", "assessment", "error", "assessed_at",
+]
+
+
+def _load_app():
+    """Import the app's assistant functions without a Streamlit server"""
+    import streamlit.logger
+
+    # Importing app.py outside `streamlit run` warns about the missing script context
+    streamlit.logger.set_log_level(logging.ERROR)
+    import app
+    return app
+
+
+def _split_list(value):
+    if value is None or value != value:  # missing, or NaN from pandas
+        return []
+    for separator in (";", "|"):
+        if separator in str(value):
+            return [item.strip() for item in str(value).split(separator) if item.strip()]
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
+def parse_checkin(row):
+    """Turn one input row into symptom checker inputs; raise ValueError if it is unusable"""
+    try:
+        week = int(float(row["pregnancy_week"]))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid week {row['pregnancy_week']!r}")
+    if not 1 <= week <= 42:
+        raise ValueError(f"week {week} is outside 1-42")
+    symptoms = _split_list(row["symptoms"])
+    if not symptoms:
+        raise ValueError("no symptoms")
+    severity = str(row["severity"]).strip().capitalize()
+    if severity not in SEVERITIES:
+        raise ValueError(f"invalid severity {row['severity']!r}")
+    description = row.get("description")
+    return {
+        "pregnancy_week": week,
+        "symptoms": symptoms,
+        "severity": severity,
+        "previous_complications": _split_list(row.get("previous_complications")),
+        "description": "" if description is None or description != description else str(description),
+    }
+
+
+def _completed_ids(path):
+    """Ids already in an output file, after dropping a record cut off by a crash
+
+    Assessments span several lines inside quoted fields, so the file is
+    parsed record by record and cut back to the end of the last whole one.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8", newline="") as f:
+        text = f.read()
+
+    consumed = 0
+
+    def lines():
+        nonlocal consumed
+        for line in io.StringIO(text, newline=""):
+            consumed += len(line)
+            yield line
+
+    ids = set()
+    header = None
+    complete = 0
+    try:
+        for record in csv.reader(lines(), strict=True):
+            whole = text[consumed - 1:consumed] in ("\n", "\r")
+            if header is None:
+                if not whole:
+                    break
+                if record != OUTPUT_COLUMNS:
+                    raise ValueError(f"{path} is not an assessments file written by this tool")
+                header = record
+            elif len(record) != len(header) or not whole:
+                break
+            else:
+                ids.add(record[0])
+            complete = consumed
+    except csv.Error:
+        pass
+    if complete < len(text):
+        with open(path, "r+b") as f:
+            f.truncate(len(text[:complete].encode("utf-8")))
+    return ids
+
+
+def _assess(app, checkin, force_llm, retries):
+    """Assess one check-in like the symptom checker; return (source, assessment, error)
+
+    Raises PromptBudgetError, a ValueError, if the check-in is too long to
+    send to the model; retrying would not help.
+    """
+    assessment = None
+    if not force_llm:
+        assessment = app.triage(
+            checkin["pregnancy_week"],
+            checkin["symptoms"],
+            checkin["severity"],
+            checkin["previous_complications"],
+            checkin["description"],
+        )
+    if assessment is not None:
+        return "triage", app.format_assessment(assessment), None
+
+    prompt = app.symptom_prompt(
+        checkin["pregnancy_week"],
+        checkin["symptoms"],
+        checkin["severity"],
+        checkin["previous_complications"],
+        checkin["description"],
+    )
+    month = checkin["pregnancy_week"] // 4
+    app.get_prompt_budget().check(app.symptom_context(month), prompt)
+    for attempt in range(retries + 1):
+        response = app.get_symptom_assessment_response(prompt, month)
+        if not app.is_error_response(response):
+            return "llm", response, None
+        if attempt < retries:
+            # The shared limiter already waits out rate-limit windows it has
+            # seen; this backs off further for errors that got past it
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return "llm", None, response
+
+
+def assess_file(input_path, output_path, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                force_llm=False, chunk_rows=DEFAULT_CHUNK_ROWS, log=sys.stderr):
+    """Assess every check-in in input_path, appending results to output_path
+
+    Returns a Counter of outcomes.
+    """
+    pd = lazy_import("pandas")
+    app = _load_app()
+    limiter = app.get_rate_limiter()
+
+    done = _completed_ids(output_path)
+    new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    counts = Counter(skipped=0)
+    write_lock = threading.Lock()
+
+    with open(output_path, "a", newline="", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-assess") as pool:
+        writer = csv.DictWriter(out, fieldnames=OUTPUT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+            out.flush()
+
+        def write(row_id, checkin, source, assessment, error):
+            with write_lock:
+                writer.writerow({
+                    "id": row_id,
+                    "pregnancy_week": checkin.get("pregnancy_week"),
+                    "symptoms": "; ".join(checkin.get("symptoms", [])),
+                    "severity": checkin.get("severity"),
+                    "previous_complications": "; ".join(checkin.get("previous_complications", [])),
+                    "source": source,
+                    "assessment": assessment,
+                    "error": error,
+                    "assessed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                })
+                # Flushed per row, so the checkpoint is never behind by more than one result
+                out.flush()
+
+        def run(row_id, checkin):
+            try:
+                source, assessment, error = _assess(app, checkin, force_llm, retries)
+            except ValueError as e:
+                # Invalid as given, like a row that does not parse
+                write(row_id, checkin, None, None, str(e))
+                return "invalid", row_id, None
+            if assessment is None:
+                return "failed", row_id, error
+            write(row_id, checkin, source, assessment, None)
+            return source, row_id, None
+
+        def report():
+            stats = limiter.stats()
+            print(
+                f"assessed {counts['triage'] + counts['llm']} "
+                f"(triage {counts['triage']}, llm {counts['llm']}), failed {counts['failed']}, "
+                f"invalid {counts['invalid']}, skipped {counts['skipped']}; "
+                f"throttled {stats['throttled']}",
+                file=log,
+            )
+
+        pending = set()
+
+        def collect(block):
+            if block:
+                finished = wait(pending, return_when=FIRST_COMPLETED).done
+            else:
+                finished = [future for future in pending if future.done()]
+            for future in finished:
+                pending.discard(future)
+                outcome, row_id, error = future.result()
+                counts[outcome] += 1
+                if outcome == "failed":
+                    print(f"{row_id}: {error} (will retry on the next run)", file=log)
+                if (counts["triage"] + counts["llm"] + counts["failed"]) % PROGRESS_EVERY == 0:
+                    report()
+
+        offset = 0
+        for chunk in pd.read_csv(input_path, chunksize=chunk_rows, dtype=str, keep_default_na=False):
+            chunk = chunk.rename(columns=lambda name: COLUMN_ALIASES.get(name.strip().lower(), name))
+            missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+            if missing:
+                raise ValueError(f"{input_path} is missing columns: {', '.join(missing)}")
+            has_ids = "id" in chunk.columns
+
+            for position, row in enumerate(chunk.to_dict("records")):
+                # Without an id column, a check-in is identified by its row number
+                row_id = row["id"] if has_ids and row["id"] else str(offset + position)
+                if row_id in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(row_id)
+                try:
+                    checkin = parse_checkin(row)
+                except ValueError as e:
+                    write(row_id, {}, None, None, str(e))
+                    counts["invalid"] += 1
+                    continue
+                # Keep a bounded number of check-ins in flight instead of queueing the whole file
+                while len(pending) >= concurrency * 2:
+                    collect(block=True)
+                pending.add(pool.submit(run, row_id, checkin))
+                collect(block=False)
+            offset += len(chunk)
+
+        while pending:
+            collect(block=True)
+    report()
+    return counts
+
+
+def restriction_combinations(preferences, allergies):
+    """No restrictions, then each single preference and each single allergy"""
+    return (
+        [([], [])]
+        + [([preference], []) for preference in preferences]
+        + [([], [allergy]) for allergy in allergies]
+    )
+
+
+def prewarm(formats=("table",), months=range(1, 10), concurrency=DEFAULT_CONCURRENCY, log=sys.stderr):
+    """Generate every month x meal x common restriction plan into the response cache
+
+    Returns a Counter of outcomes.
+    """
+    app = _load_app()
+    tasks = [
+        (fmt, month, meal_type, preferences, allergies)
+        for fmt in formats
+        for month in months
+        for meal_type in app.MEAL_SECTIONS
+        for preferences, allergies in restriction_combinations(app.DIETARY_PREFERENCES, app.FOOD_ALLERGIES)
+    ]
+
+    def run(fmt, month, meal_type, preferences, allergies):
+        # The same calls the meal planner makes, so they land on the same cache keys
+        if fmt == "table":
+            _, error = app.get_structured_meal(meal_type, month, preferences, allergies)
+            return error
+        response = app.get_nutrition_response(
+            app.meal_plan_prompt(meal_type, month),
+            month,
+            preferences,
+            allergies,
+            max_tokens=app.PROSE_TOKEN_BUDGETS[meal_type],
+        )
+        return response if app.is_error_response(response) else None
+
+    counts = Counter()
+    cache = app.get_response_cache()
+    before = cache.stats()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-prewarm") as pool:
+        futures = {pool.submit(run, *task): task for task in tasks}
+        for number, future in enumerate(futures, 1):
+            error = future.result()
+            counts["failed" if error else "ok"] += 1
+            if error:
+                fmt, month, meal_type, preferences, allergies = futures[future]
+                print(f"{fmt} {meal_type} month {month} {preferences + allergies}: {error}", file=log)
+            if number % PROGRESS_EVERY == 0 or number == len(tasks):
+                print(f"prewarmed {number}/{len(tasks)} plans, failed {counts['failed']}", file=log)
+    after = cache.stats()
+    counts["cached"] = after["hits"] + after["shared_hits"] - before["hits"] - before["shared_hits"]
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch symptom assessments and cache pre-warming")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    assess = subcommands.add_parser("assess", help="assess a CSV of patient check-ins")
+    assess.add_argument("input", help="check-ins CSV")
+    assess.add_argument("output", help="results CSV; also the checkpoint that a rerun resumes from")
+    assess.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="check-ins assessed at once (model calls are also capped by GROQ_MAX_CONCURRENCY)")
+    assess.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="retries for a failed model call before leaving it for the next run")
+    assess.add_argument("--force-llm", action="store_true",
+                        help="send every check-in to the model instead of answering common ones locally")
+    assess.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+
+    warm = subcommands.add_parser("prewarm", help="fill the response cache with common meal plans")
+    warm.add_argument("--format", choices=["table", "text", "both"], default="table",
+                      help="meal planner output format to generate (default: table)")
+    warm.add_argument("--months", default="1-9", help="pregnancy months, e.g. 1-9 or 3,6,9")
+    warm.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.command == "assess":
+        counts = assess_file(args.input, args.output, args.concurrency, args.retries,
+                             args.force_llm, args.chunk_rows)
+        print(f"Wrote {counts['triage'] + counts['llm'] + counts['invalid']} results to {args.output}")
+        sys.exit(1 if counts["failed"] else 0)
+
+    if args.command == "prewarm":
+        store = os.getenv("SHARED_TIER_URL") or os.getenv("RESPONSE_CACHE_DB")
+        if not store:
+            parser.error("set SHARED_TIER_URL (or RESPONSE_CACHE_DB) to the app's shared tier, "
+                         "or the plans are lost on exit")
+        if "-" in args.months:
+            first, last = args.months.split("-", 1)
+            months = range(int(first), int(last) + 1)
+        else:
+            months = [int(month) for month in args.months.split(",")]
+        formats = ("table", "text") if args.format == "both" else (args.format,)
+        counts = prewarm(formats, months, args.concurrency)
+        print(f"Prewarmed {counts['ok']} plans into {store} "
+              f"({counts['cached']} were already cached), {counts['failed']} failed")
+        sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Local stand-in for the Groq chat completions API.
+
+Serves POST /openai/v1/chat/completions in both blocking and streaming
+(server-sent events) form, with a configurable time to first token, token
+rate and injected 429/500 errors. Point the app at it with
+GROQ_BASE_URL=http://127.0.0.1:<port>. Run it on its own with
+
+    python bench/fake_groq.py --port 8765 --latency 0.3 --tokens-per-second 200
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+_WORDS = (
+    "Eat a balanced plate with whole grains, lean protein, leafy greens and fruit. "
+    "Drink water through the day, keep taking your prenatal vitamin and talk to "
+    "your provider if anything feels unusual."
+).split()
+
+_FOODS = ["Oatmeal with berries", "Greek yogurt", "Spinach salad", "Lentil soup",
+          "Baked salmon", "Brown rice", "Steamed broccoli", "Apple with almond butter"]
+_NUTRIENTS = ["Folate", "Iron", "Calcium", "Protein", "Fiber", "Omega-3", "Vitamin C"]
+
+
+def _json_meal(tokens):
+    """A meal-shaped JSON answer of roughly the given token count, for JSON mode"""
+    count = max(2, min(len(_FOODS), tokens // 40))
+    items = [{"food": _FOODS[n], "portion": "1 cup",
+              "nutrients": [_NUTRIENTS[n % len(_NUTRIENTS)], _NUTRIENTS[(n + 2) % len(_NUTRIENTS)]]}
+             for n in range(count)]
+    return json.dumps({"meal": "Meal", "items": items, "tip": "Drink water with every meal."})
+
+
+@dataclass
+class FakeGroqConfig:
+    latency: float = 0.3             # seconds before the first token
+    jitter: float = 0.1              # +/- uniform jitter on latency
+    tokens_per_second: float = 200.0
+    completion_tokens: int = 120
+    error_rate: float = 0.0          # fraction of requests answered with a 500
+    rate_limit_rate: float = 0.0     # fraction of requests answered with a 429
+    retry_after: float = 0.5
+    seed: int = None
+    down_models: tuple = ()          # models that always answer 503
+    slow_models: tuple = ()          # models whose latency is multiplied by slow_factor
+    slow_factor: float = 10.0
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled connections is normal under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeGroqServer:
+    """Threaded HTTP server speaking enough of the Groq API for the app"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeGroqConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._httpd = _QuietHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _draw(self, model):
+        """Decide this request's fate and delay under the shared random state"""
+        config = self.config
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            delay = max(0.0, config.latency + self._random.uniform(-config.jitter, config.jitter))
+            if model in config.slow_models:
+                delay *= config.slow_factor
+            if model in config.down_models:
+                self.errors += 1
+                return "down", 0.0
+            if roll < config.rate_limit_rate:
+                self.rate_limited += 1
+                return "rate_limited", delay
+            if roll < config.rate_limit_rate + config.error_rate:
+                self.errors += 1
+                return "error", delay
+        return "ok", delay
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.split("?")[0] != COMPLETIONS_PATH:
+            self._send_json(404, {"error": {"message": "Unknown path", "type": "not_found"}})
+            return
+
+        fake = self.fake
+        config = fake.config
+        model = request.get("model", "fake-model")
+        outcome, delay = fake._draw(model)
+        if outcome == "down":
+            self._send_json(503, {"error": {"message": f"{model} is unavailable", "type": "service_unavailable"}})
+            return
+        if outcome == "rate_limited":
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+                {"retry-after": str(config.retry_after), "x-ratelimit-remaining-requests": "0",
+                 "x-ratelimit-reset-requests": f"{config.retry_after}s"},
+            )
+            return
+        time.sleep(delay)
+        if outcome == "error":
+            self._send_json(500, {"error": {"message": "Injected failure", "type": "internal_server_error"}})
+            return
+
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        completion_tokens = min(config.completion_tokens, int(request.get("max_tokens") or config.completion_tokens))
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            words = _json_meal(completion_tokens).split(" ")
+        else:
+            words = [_WORDS[n % len(_WORDS)] for n in range(completion_tokens)]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        token_delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        headers = {"x-ratelimit-remaining-requests": "1000", "x-ratelimit-remaining-tokens": "100000"}
+
+        if not request.get("stream"):
+            time.sleep(token_delay * completion_tokens)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage,
+            }, headers)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # Chunked so the connection stays in the client's keep-alive pool
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def write_chunk(data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def event(choices, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices, **extra}
+            write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        try:
+            for n, word in enumerate(words):
+                event([{"index": 0, "finish_reason": None, "logprobs": None,
+                        "delta": {"content": word if n == 0 else " " + word}}])
+                time.sleep(token_delay)
+            # Groq reports usage on the final chunk under x_groq
+            event([{"index": 0, "finish_reason": "stop", "logprobs": None, "delta": {}}],
+                  x_groq={"id": completion_id, "usage": usage})
+            write_chunk(b"data: [DONE]\n\n")
+            write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def add_arguments(parser):
+    """Add the fake server options to an argument parser"""
+    parser.add_argument("--latency", type=float, default=FakeGroqConfig.latency,
+                        help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=FakeGroqConfig.jitter,
+                        help="uniform +/- jitter on the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeGroqConfig.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=FakeGroqConfig.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=FakeGroqConfig.error_rate,
+                        help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=FakeGroqConfig.rate_limit_rate,
+                        help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=FakeGroqConfig.retry_after)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--down-models", default="",
+                        help="comma-separated models that always answer 503")
+    parser.add_argument("--slow-models", default="",
+                        help="comma-separated models whose latency is multiplied by --slow-factor")
+    parser.add_argument("--slow-factor", type=float, default=FakeGroqConfig.slow_factor)
+
+
+def config_from_args(args):
+    return FakeGroqConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        down_models=tuple(model for model in args.down_models.split(",") if model),
+        slow_models=tuple(model for model in args.slow_models.split(",") if model),
+        slow_factor=args.slow_factor,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Groq chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(config_from_args(args), host=args.host, port=args.port)
+    print(f"Fake Groq API listening on {server.base_url} (set GROQ_BASE_URL to this)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Local stand-in for a Redis server, for the shared tier.
+
+Speaks enough of the Redis protocol (RESP) for shared_tier.RedisBackend:
+PING, AUTH, SELECT, GET, MGET, SET (with EX/PX/NX), DEL, DBSIZE and
+FLUSHDB, with key expiry, and EVAL of the shared tier's compare-and-delete
+script only. Point the app at it with
+SHARED_TIER_URL=redis://127.0.0.1:<port>/0. Run it on its own with
+
+    python bench/fake_redis.py --port 6390
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_tier import COMPARE_AND_DELETE  # noqa: E402
+
+
+class _Store:
+    """Keys with optional expiry, one dict per database number"""
+
+    def __init__(self):
+        self._dbs = {}
+        self._lock = threading.Lock()
+
+    def _db(self, number):
+        return self._dbs.setdefault(number, {})
+
+    def _live(self, db, key, now):
+        # Caller holds the lock
+        entry = db.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del db[key]
+            return None
+        return entry
+
+    def get_many(self, number, keys):
+        now = time.monotonic()
+        with self._lock:
+            db = self._db(number)
+            return [(entry[0] if entry else None) for entry in (self._live(db, key, now) for key in keys)]
+
+    def set(self, number, key, value, ttl=None, only_new=False):
+        now = time.monotonic()
+        with self._lock:
+            db = self._db(number)
+            if only_new and self._live(db, key, now) is not None:
+                return False
+            db[key] = (value, now + ttl if ttl is not None else None)
+            return True
+
+    def delete_if(self, number, key, value):
+        now = time.monotonic()
+        with self._lock:
+            db = self._db(number)
+            entry = self._live(db, key, now)
+            if entry is None or entry[0] != value:
+                return 0
+            del db[key]
+            return 1
+
+    def delete(self, number, keys):
+        now = time.monotonic()
+        with self._lock:
+            db = self._db(number)
+            return sum(1 for key in keys if self._live(db, key, now) is not None and db.pop(key))
+
+    def size(self, number):
+        now = time.monotonic()
+        with self._lock:
+            db = self._db(number)
+            return sum(1 for key in list(db) if self._live(db, key, now) is not None)
+
+    def flush(self, number):
+        with self._lock:
+            self._dbs.pop(number, None)
+
+
+class _ProtocolError(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    fake = None
+
+    def handle(self):
+        self.db = 0
+        self.authenticated = self.fake.password is None
+        while True:
+            try:
+                args = self._read_command()
+            except (_ProtocolError, ValueError):
+                self._write(b"-ERR Protocol error\r\n")
+                return
+            except ConnectionError:
+                return
+            if args is None:
+                return
+            try:
+                reply = self._dispatch(args)
+            except ValueError:
+                reply = b"-ERR value is not an integer or out of range\r\n"
+            try:
+                self._write(reply)
+            except ConnectionError:
+                return
+
+    def _write(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            if not header.startswith(b"$"):
+                raise _ProtocolError()
+            length = int(header[1:-2])
+            data = self.rfile.read(length + 2)
+            if len(data) != length + 2:
+                return None
+            args.append(data[:-2])
+        return args
+
+    def _dispatch(self, args):
+        if not args:
+            return b"-ERR empty command\r\n"
+        command, args = args[0].upper(), args[1:]
+        fake = self.fake
+        fake._count(command)
+        if command == b"AUTH":
+            if args and args[-1].decode("utf-8") == fake.password:
+                self.authenticated = True
+                return b"+OK\r\n"
+            return b"-WRONGPASS invalid username-password pair\r\n"
+        if not self.authenticated:
+            return b"-NOAUTH Authentication required.\r\n"
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"SELECT":
+            self.db = int(args[0])
+            return b"+OK\r\n"
+        if command == b"GET":
+            return _bulk(fake.store.get_many(self.db, args[:1])[0])
+        if command == b"MGET":
+            values = fake.store.get_many(self.db, args)
+            return b"*%d\r\n" % len(values) + b"".join(_bulk(value) for value in values)
+        if command == b"SET":
+            return self._set(args)
+        if command == b"DEL":
+            return b":%d\r\n" % fake.store.delete(self.db, args)
+        if command == b"EVAL":
+            if len(args) != 4 or args[0].decode("utf-8") != COMPARE_AND_DELETE or args[1] != b"1":
+                return b"-ERR fake server only runs the compare-and-delete script\r\n"
+            return b":%d\r\n" % fake.store.delete_if(self.db, args[2], args[3])
+        if command == b"DBSIZE":
+            return b":%d\r\n" % fake.store.size(self.db)
+        if command == b"FLUSHDB":
+            fake.store.flush(self.db)
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command.lower()
+
+    def _set(self, args):
+        if len(args) < 2:
+            return b"-ERR wrong number of arguments for 'set' command\r\n"
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        ttl = None
+        only_new = False
+        index = 0
+        while index < len(options):
+            option = options[index]
+            if option in (b"EX", b"PX") and index + 1 < len(options):
+                ttl = int(options[index + 1]) / (1 if option == b"EX" else 1000)
+                index += 2
+            elif option == b"NX":
+                only_new = True
+                index += 1
+            else:
+                return b"-ERR syntax error\r\n"
+        if not self.fake.store.set(self.db, key, value, ttl, only_new):
+            return b"$-1\r\n"
+        return b"+OK\r\n"
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRedisServer:
+    """Threaded TCP server keeping keys in memory, shared by every client"""
+
+    def __init__(self, host="127.0.0.1", port=0, password=None):
+        self.password = password
+        self.store = _Store()
+        self._lock = threading.Lock()
+        self.commands = {}
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-redis", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _count(self, command):
+        name = command.decode("utf-8", "replace").lower()
+        with self._lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            commands = dict(self.commands)
+        return {"commands": commands, "keys": self.store.size(0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Redis server for the shared tier")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--password", default=None)
+    args = parser.parse_args()
+
+    server = FakeRedisServer(host=args.host, port=args.port, password=args.password)
+    print(f"Fake Redis listening on {server.url} (set SHARED_TIER_URL to this)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
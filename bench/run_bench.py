@@ -0,0 +1,410 @@
+"""Load test the app against a local fake Groq server.
+
+Starts bench/fake_groq.py in-process, points the Groq client at it and
+drives many simulated sessions concurrently through Home, the Symptom
+Checker, the Nutritionist meal planner and the nutrition chat using
+Streamlit's AppTest. Sessions share the process-wide client, caches and
+limiter just as they do under `streamlit run`.
+
+Reports throughput, p50/p95/p99 latency per step, model latency and time
+to first token, and memory per session, and writes everything to a JSON
+file under bench/results so runs can be compared:
+
+    python bench/run_bench.py --sessions 50 --concurrency 10
+    python bench/run_bench.py --sessions 50 --compare bench/results/<earlier>.json
+
+Pass --distinct-questions to control how often sessions repeat each
+other's questions (and so how much the caches can help), and
+--shared-tier redis (a local bench/fake_redis.py) or sqlite to run with a
+shared tier behind the response cache.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_groq import FakeGroqServer, add_arguments, config_from_args  # noqa: E402
+from fake_redis import FakeRedisServer  # noqa: E402
+
+
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+STEP_TIMEOUT = 120
+
+STEPS = ("home", "symptom_checker", "meal_plan", "nutrition_chat")
+
+QUESTIONS = [
+    "Can I eat sushi while pregnant?",
+    "How much protein do I need each day?",
+    "Is coffee safe during pregnancy?",
+    "What foods are high in iron?",
+    "Which fish are low in mercury?",
+    "How can I get enough calcium without dairy?",
+    "What snacks help with morning sickness?",
+    "Is soft cheese safe to eat?",
+    "How much water should I drink a day?",
+    "What are good sources of folate?",
+    "Can I eat eggs with runny yolks?",
+    "What should I eat to help with constipation?",
+]
+MEAL_TYPES = ["Full Day Plan", "Breakfast", "Lunch", "Dinner", "Snacks"]
+SYMPTOM_CASES = [
+    # (week, symptoms, severity); the first two are answered by local triage
+    (8, ["Nausea"], "Mild"),
+    (20, ["Back Pain", "Fatigue"], "Moderate"),
+    (30, ["Headache", "Swelling"], "Mild"),
+    (16, ["Cramping"], "Moderate"),
+]
+
+_ERROR_PREFIXES = ("Error:", "I apologize, but I encountered an error")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def rss_bytes():
+    """Current resident set size of this process, or None where unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _SharedRuntime:
+    """Stands in for Runtime inside AppTest so concurrent runs share one runtime
+
+    AppTest installs a mock runtime before each run and clears it afterwards,
+    which breaks any other session that is mid-run at that moment.
+    """
+
+    def __init__(self, runtime_class):
+        object.__setattr__(self, "_runtime_class", runtime_class)
+
+    def __getattr__(self, name):
+        return getattr(self._runtime_class, name)
+
+    def __dir__(self):
+        return dir(self._runtime_class)
+
+    def __setattr__(self, name, value):
+        if name == "_instance" and value is None:
+            return
+        setattr(self._runtime_class, name, value)
+
+
+def prepare_concurrent_apptest():
+    """Let many AppTest sessions run at once in this process
+
+    Sessions share one compiled script, as a single `streamlit run` server
+    does. AppTest otherwise recompiles app.py on every run, which is both
+    unrepresentative and unsafe when many sessions compile concurrently.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    shared = ScriptCache()
+    local_script_runner.ScriptCache = app_test.ScriptCache = lambda: shared
+    app_test.Runtime = _SharedRuntime(Runtime)
+
+
+class Session:
+    """One simulated user clicking through the app"""
+
+    def __init__(self, number, rng, args):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.rng = rng
+        self.args = args
+        self.app = AppTest.from_file(APP_PATH, default_timeout=STEP_TIMEOUT)
+        self.timings = []
+
+    def _button(self, label):
+        return next(button for button in self.app.button if button.label == label)
+
+    def _step(self, name, action):
+        start = time.perf_counter()
+        error = None
+        try:
+            action()
+            if self.app.exception:
+                error = self.app.exception[0].message
+            else:
+                texts = [element.value for element in list(self.app.markdown) + list(self.app.error)]
+                if any(isinstance(text, str) and text.strip().startswith(_ERROR_PREFIXES) for text in texts):
+                    error = "error response"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.timings.append({
+            "session": self.number,
+            "step": name,
+            "seconds": time.perf_counter() - start,
+            "error": error,
+        })
+
+    def _click_and_wait(self, label, job_kind):
+        """Click a button, then wait for the background job it started and rerun to draw the result
+
+        The browser would poll for the result; the step time covers the whole wait.
+        """
+        from jobs import get_job_manager
+
+        sid = self.app.session_state["history_session_id"]
+        before = get_job_manager().get(sid, job_kind)
+        self._button(label).click().run()
+        job = get_job_manager().get(sid, job_kind)
+        if job is not None and job is not before:
+            job.wait(STEP_TIMEOUT)
+            self.app.run()
+
+    def _navigate(self, page):
+        self.app.sidebar.radio[0].set_value(page).run()
+
+    def _symptom_checker(self):
+        week, symptoms, severity = self.rng.choice(SYMPTOM_CASES)
+        self._navigate("Symptom Checker")
+        self.app.slider[0].set_value(week)
+        self.app.multiselect[1].set_value(symptoms)
+        self.app.select_slider[0].set_value(severity)
+        self._click_and_wait("Get Assessment", "symptom_assessment")
+
+    def _meal_plan(self):
+        self._navigate("Nutritionist")
+        self.app.slider[0].set_value(self.rng.randint(1, 9))
+        self.app.selectbox[0].set_value(self.rng.choice(MEAL_TYPES))
+        self._click_and_wait("Generate Meal Plan", "meal_plan")
+
+    def _chat(self, question):
+        self.app.text_input[0].set_value(question)
+        self._click_and_wait("Ask", "nutrition_chat")
+
+    def run(self):
+        pool = QUESTIONS[:self.args.distinct_questions]
+        self._step("home", self.app.run)
+        self._step("symptom_checker", self._symptom_checker)
+        self._step("meal_plan", self._meal_plan)
+        for _ in range(self.args.chat_turns):
+            self._step("nutrition_chat", lambda: self._chat(self.rng.choice(pool)))
+        return self.timings
+
+
+def run_benchmark(args):
+    # Configure the app before it builds its process-wide client and caches
+    os.environ.setdefault("GROQ_API_KEY", "bench-key")
+
+    fake = FakeGroqServer(config_from_args(args)).start()
+    os.environ["GROQ_BASE_URL"] = fake.base_url
+
+    redis = None
+    shared_dir = None
+    if args.shared_tier == "redis":
+        redis = FakeRedisServer().start()
+        os.environ["SHARED_TIER_URL"] = redis.url
+    elif args.shared_tier == "sqlite":
+        shared_dir = tempfile.TemporaryDirectory()
+        os.environ["SHARED_TIER_URL"] = "sqlite:///" + os.path.join(shared_dir.name, "shared.db")
+
+    from metrics import get_metrics
+    from model_router import get_model_router
+    from shared_tier import get_shared_tier
+
+    prepare_concurrent_apptest()
+
+    rng = random.Random(args.seed)
+    seeds = [rng.randrange(2 ** 32) for _ in range(args.sessions)]
+    sessions = []
+    sessions_lock = threading.Lock()
+
+    def simulate(number):
+        session = Session(number, random.Random(seeds[number]), args)
+        with sessions_lock:
+            sessions.append(session)
+        return session.run()
+
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench-session") as pool:
+        timings = [timing for result in pool.map(simulate, range(args.sessions)) for timing in result]
+    wall = time.perf_counter() - start
+    # Sessions are still referenced here, so their state is counted
+    rss_after = rss_bytes()
+    fake.stop()
+    shared = get_shared_tier()
+    shared_stats = shared.stats() if shared is not None else None
+    if redis is not None:
+        shared_stats["server"] = redis.stats()
+        redis.stop()
+    if shared_dir is not None:
+        shared.backend.close()
+        shared_dir.cleanup()
+
+    samples = get_metrics().recent_samples()
+    model_calls = [s for s in samples if s["source"] == "llm" and not s["error"]]
+    steps = {
+        step: {
+            **summarize([t["seconds"] for t in timings if t["step"] == step]),
+            "errors": sum(1 for t in timings if t["step"] == step and t["error"]),
+        }
+        for step in STEPS
+    }
+    errors = [t for t in timings if t["error"]]
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "chat_turns": args.chat_turns,
+            "distinct_questions": args.distinct_questions,
+            "seed": args.seed,
+            "fake_groq": vars(fake.config),
+            "shared_tier": args.shared_tier,
+            "env": {key: value for key, value in os.environ.items()
+                    if key.startswith(("GROQ_", "RESPONSE_CACHE_", "QUESTION_INDEX_", "TRIAGE_", "ROUTER_",
+                                        "SHARED_TIER_"))
+                    and key not in ("GROQ_API_KEY", "SHARED_TIER_URL")},
+        },
+        "wall_seconds": wall,
+        "throughput": {
+            "steps_per_second": len(timings) / wall if wall else None,
+            "sessions_per_second": args.sessions / wall if wall else None,
+        },
+        "steps": steps,
+        "all_steps": summarize([t["seconds"] for t in timings]),
+        "errors": {
+            "count": len(errors),
+            "rate": len(errors) / len(timings) if timings else 0.0,
+            "examples": sorted({t["error"] for t in errors})[:5],
+        },
+        "model": {
+            "latency": summarize([s["latency"] for s in model_calls]),
+            "ttft": summarize([s["ttft"] for s in model_calls if s["ttft"] is not None]),
+            "sources": {source: sum(1 for s in samples if s["source"] == source)
+                        for source in sorted({s["source"] for s in samples})},
+        },
+        "fake_groq": fake.stats(),
+        "router": get_model_router().stats(),
+        "shared_tier": shared_stats,
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "rss_per_session_bytes": (
+                (rss_after - rss_before) / len(sessions) if rss_before and rss_after and sessions else None
+            ),
+        },
+    }
+
+
+def _fmt(value, scale=1000.0, unit="ms"):
+    return "-" if value is None else f"{value * scale:.1f} {unit}"
+
+
+def print_report(result, baseline=None):
+    print(f"{result['config']['sessions']} sessions, concurrency {result['config']['concurrency']}, "
+          f"{result['wall_seconds']:.1f}s wall")
+    print(f"throughput: {result['throughput']['steps_per_second']:.2f} steps/s, "
+          f"{result['throughput']['sessions_per_second']:.2f} sessions/s")
+    print(f"{'step':<18}{'count':>7}{'p50':>12}{'p95':>12}{'p99':>12}{'errors':>8}")
+    for step, stats in result["steps"].items():
+        line = (f"{step:<18}{stats['count']:>7}{_fmt(stats.get('p50')):>12}"
+                f"{_fmt(stats.get('p95')):>12}{_fmt(stats.get('p99')):>12}{stats['errors']:>8}")
+        if baseline and step in baseline["steps"] and baseline["steps"][step].get("p95"):
+            change = stats.get("p95", 0) / baseline["steps"][step]["p95"] - 1
+            line += f"   p95 {change:+.0%} vs baseline"
+        print(line)
+    model = result["model"]
+    print(f"model latency p50/p95/p99: {_fmt(model['latency'].get('p50'))} / "
+          f"{_fmt(model['latency'].get('p95'))} / {_fmt(model['latency'].get('p99'))}")
+    print(f"time to first token p50/p95/p99: {_fmt(model['ttft'].get('p50'))} / "
+          f"{_fmt(model['ttft'].get('p95'))} / {_fmt(model['ttft'].get('p99'))}")
+    print(f"answer sources: {model['sources']}; fake server: {result['fake_groq']}")
+    if result.get("shared_tier"):
+        print(f"shared tier: {result['shared_tier']}")
+    print(f"errors: {result['errors']['count']} ({result['errors']['rate']:.1%})")
+    print(f"memory per session: {_fmt(result['memory']['rss_per_session_bytes'], 1 / 1024, 'KiB')}")
+    if baseline:
+        before = baseline["throughput"]["steps_per_second"]
+        after = result["throughput"]["steps_per_second"]
+        print(f"throughput vs baseline ({baseline.get('commit')}): {after / before - 1:+.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app against a local fake Groq server")
+    parser.add_argument("--sessions", type=int, default=20, help="simulated sessions to run")
+    parser.add_argument("--concurrency", type=int, default=5, help="sessions running at the same time")
+    parser.add_argument("--chat-turns", type=int, default=3, help="chat questions asked per session")
+    parser.add_argument("--distinct-questions", type=int, default=len(QUESTIONS),
+                        help=f"size of the question pool sessions draw from (max {len(QUESTIONS)})")
+    parser.add_argument("--output", help="results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--shared-tier", choices=["none", "sqlite", "redis"], default="none",
+                        help="shared tier behind the response cache (redis starts a local fake server)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = 0
+
+    result = run_benchmark(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    path = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
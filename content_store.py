@@ -0,0 +1,188 @@
+"""Versioned, lazily loaded content store for the Educational Library.
+
+Content lives under content/library. manifest.json holds the content
+version and the list of sections. Each section is its own JSON file,
+parsed the first time it is opened and then kept for the life of the
+process. search_index.json is a prebuilt BM25 inverted index over every
+article, glossary entry, FAQ and quiz question. Rebuild it after editing
+content with:
+
+    python content_store.py build-index
+"""
+import argparse
+import functools
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+
+CONTENT_DIR = os.getenv(
+    "LIBRARY_CONTENT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "content", "library"),
+)
+INDEX_FILE = "search_index.json"
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+_SNIPPET_CHARS = 160
+
+_WORD = re.compile(r"[a-z0-9]+")
+_MARKDOWN = re.compile(r"[*_#>\[\]`]|\(https?://[^)]*\)")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do for from how i in is it its of on or the
+this to what when where which with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase and split text into search terms"""
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+@functools.lru_cache(maxsize=1)
+def load_manifest():
+    """Read the content manifest once per process"""
+    with open(os.path.join(CONTENT_DIR, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def section_titles():
+    """Return the section titles in sidebar order"""
+    return [section["title"] for section in load_manifest()["sections"]]
+
+
+@functools.lru_cache(maxsize=1)
+def _sections_by_title():
+    return {section["title"]: section for section in load_manifest()["sections"]}
+
+
+@functools.lru_cache(maxsize=256)
+def load_section(title):
+    """Parse one section the first time it is requested"""
+    entry = _sections_by_title()[title]
+    with open(os.path.join(CONTENT_DIR, entry["file"]), encoding="utf-8") as f:
+        section = json.load(f)
+    section["slug"] = entry["slug"]
+    return section
+
+
+def _plain(text):
+    return " ".join(_MARKDOWN.sub(" ", text).split())
+
+
+def iter_documents(section):
+    """Yield every searchable item in a section as a flat document"""
+    slug, title = section["slug"], section["title"]
+    for article in section.get("articles", []):
+        yield {"id": f"{slug}#{article['id']}", "section": title,
+               "title": article["title"], "text": article["body"]}
+    for entry in section.get("glossary", []):
+        yield {"id": f"{slug}#{entry['term']}", "section": title,
+               "title": entry["term"], "text": entry["definition"]}
+    for n, entry in enumerate(section.get("faq", [])):
+        yield {"id": f"{slug}#faq-{n}", "section": title,
+               "title": entry["question"], "text": entry["answer"]}
+    for n, entry in enumerate(section.get("quiz", [])):
+        yield {"id": f"{slug}#quiz-{n}", "section": title,
+               "title": entry["question"], "text": entry.get("explanation", "")}
+
+
+def build_index():
+    """Build the inverted index data for every section in the manifest"""
+    docs = []
+    doc_lengths = []
+    postings = {}
+    for title in section_titles():
+        section = load_section(title)
+        for doc in iter_documents(section):
+            # Titles count twice so they outrank passing mentions in body text
+            terms = Counter(tokenize(doc["title"]) * 2 + tokenize(doc["text"]))
+            doc_id = len(docs)
+            plain = _plain(doc["text"])
+            docs.append({
+                "id": doc["id"],
+                "section": doc["section"],
+                "title": doc["title"],
+                "snippet": plain[:_SNIPPET_CHARS] + ("..." if len(plain) > _SNIPPET_CHARS else ""),
+            })
+            doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append([doc_id, tf])
+    return {
+        "version": load_manifest()["version"],
+        "docs": docs,
+        "doc_lengths": doc_lengths,
+        "postings": postings,
+    }
+
+
+class SearchIndex:
+    """BM25 ranking over a prebuilt inverted index"""
+
+    def __init__(self, data):
+        self.version = data["version"]
+        self.docs = data["docs"]
+        self.doc_lengths = data["doc_lengths"]
+        self.postings = data["postings"]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def search(self, query, limit=10):
+        """Return up to limit (score, doc) pairs, best first"""
+        n_docs = len(self.docs)
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting:
+                norm = 1 - _B + _B * self.doc_lengths[doc_id] / self.avg_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / (tf + _K1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score, self.docs[doc_id]) for doc_id, score in ranked]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """Load the prebuilt search index once, rebuilding it if it is missing or stale"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                data = None
+                try:
+                    with open(os.path.join(CONTENT_DIR, INDEX_FILE), encoding="utf-8") as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    pass
+                if data is None or data.get("version") != load_manifest()["version"]:
+                    data = build_index()
+                _index = SearchIndex(data)
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Educational Library content tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("build-index", help="rebuild the prebuilt search index")
+    args = parser.parse_args()
+
+    if args.command == "build-index":
+        data = build_index()
+        path = os.path.join(CONTENT_DIR, INDEX_FILE)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"Indexed {len(data['docs'])} documents (content version {data['version']}) into {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Token-budgeted conversation memory for the assistant chats.
+
+Recent turns are kept verbatim in a sliding window measured in tokens.
+Turns that fall out of the window are folded into a short running summary,
+so the context sent with each request stays roughly constant in size no
+matter how long the conversation gets.
+"""
+import math
+import re
+from collections import deque
+
+
+DEFAULT_WINDOW_TOKENS = 1200
+DEFAULT_SUMMARY_TOKENS = 300
+
+# Words kept from each turn when it is folded into the summary
+_SUMMARY_WORDS_PER_TURN = 30
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text):
+    """Roughly count tokens (about four characters each for English text)"""
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / 4))
+
+
+def _first_sentence(text, max_words=_SUMMARY_WORDS_PER_TURN):
+    sentence = _SENTENCE_END.split(" ".join(text.split()), maxsplit=1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "..."
+    return sentence
+
+
+class ConversationMemory:
+    """Sliding window of recent turns plus a running summary of older ones"""
+
+    def __init__(self, max_window_tokens=DEFAULT_WINDOW_TOKENS,
+                 max_summary_tokens=DEFAULT_SUMMARY_TOKENS):
+        self.max_window_tokens = max_window_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.turns = deque()
+        self.window_tokens = 0
+        self.summary_lines = deque()
+        self.summary_tokens = 0
+
+    def add(self, role, content):
+        """Append a turn, folding the oldest turns into the summary when over budget"""
+        tokens = estimate_tokens(content)
+        self.turns.append({"role": role, "content": content, "tokens": tokens})
+        self.window_tokens += tokens
+        while self.window_tokens > self.max_window_tokens and len(self.turns) > 1:
+            oldest = self.turns.popleft()
+            self.window_tokens -= oldest["tokens"]
+            self._summarize(oldest)
+
+    def messages(self):
+        """Return the compact context as chat messages, oldest first"""
+        messages = []
+        if self.summary_lines:
+            messages.append({
+                "role": "system",
+                "content": "Summary of earlier conversation:\n" + "\n".join(self.summary_lines),
+            })
+        messages.extend(
+            {"role": turn["role"], "content": turn["content"]} for turn in self.turns
+        )
+        return messages
+
+    def token_count(self):
+        """Return the approximate token size of messages()"""
+        return self.window_tokens + self.summary_tokens
+
+    def clear(self):
+        self.turns.clear()
+        self.window_tokens = 0
+        self.summary_lines.clear()
+        self.summary_tokens = 0
+
+    def _summarize(self, turn):
+        speaker = "User asked" if turn["role"] == "user" else "Assistant answered"
+        line = f"- {speaker}: {_first_sentence(turn['content'])}"
+        self.summary_lines.append(line)
+        self.summary_tokens += estimate_tokens(line)
+        while self.summary_tokens > self.max_summary_tokens and len(self.summary_lines) > 1:
+            self.summary_tokens -= estimate_tokens(self.summary_lines.popleft())
+
+    def to_dict(self):
+        """Compact, JSON-ready form: the summary and the verbatim turns"""
+        return {
+            "summary": list(self.summary_lines),
+            "turns": [[turn["role"], turn["content"]] for turn in self.turns],
+        }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        """Rebuild a memory saved with to_dict()"""
+        memory = cls(**kwargs)
+        for line in data.get("summary", []):
+            memory.summary_lines.append(line)
+            memory.summary_tokens += estimate_tokens(line)
+        for role, content in data.get("turns", []):
+            memory.add(role, content)
+        return memory
@@ -0,0 +1,91 @@
+"""Memory-bounded preparation of meal photos for the vision model.
+
+Phone photos are decoded at reduced scale with Pillow's draft mode, shrunk
+with thumbnail, stripped of EXIF (after applying its orientation) and
+re-encoded as a small JPEG, so a 12 MB upload becomes a few hundred KB
+before it is base64-encoded. Hashing and base64 work straight from the
+upload and output buffers without copying them. Decoding runs in a small
+process-wide thread pool; Pillow releases the GIL while it decodes.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import lazy_import
+
+
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_QUALITY = 80
+DEFAULT_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", DEFAULT_MAX_SIDE))
+QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", DEFAULT_QUALITY))
+MAX_UPLOAD_BYTES = int(os.getenv("PHOTO_MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES))
+
+ACCEPTED_TYPES = ["jpg", "jpeg", "png", "webp"]
+
+
+class PhotoError(ValueError):
+    """The upload is not an image we can prepare"""
+
+
+def image_hash(upload):
+    """Hash an uploaded file's bytes without copying them"""
+    return hashlib.sha256(upload.getbuffer()).hexdigest()
+
+
+def prepare_image(upload, max_side=MAX_SIDE, quality=QUALITY):
+    """Decode, shrink and re-encode an upload; return (base64 JPEG, info)
+
+    upload is any binary file object, such as Streamlit's UploadedFile.
+    """
+    Image = lazy_import("PIL.Image")
+    ImageOps = lazy_import("PIL.ImageOps")
+
+    upload.seek(0)
+    try:
+        with Image.open(upload) as image:
+            original_size = image.size
+            # For JPEGs, decode straight to the smallest DCT scale that is
+            # still at least max_side, instead of decoding every pixel
+            image.draft("RGB", (max_side, max_side))
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            # Rotate the already small image upright before the EXIF is dropped
+            ImageOps.exif_transpose(image, in_place=True)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            buffer = io.BytesIO()
+            # No exif/icc arguments, so no metadata is carried into the output
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            size = image.size
+    except (OSError, Image.DecompressionBombError) as e:
+        raise PhotoError("That file could not be read as a photo") from e
+
+    encoded = base64.b64encode(buffer.getbuffer()).decode("ascii")
+    return encoded, {
+        "original_size": original_size,
+        "size": size,
+        "jpeg_bytes": buffer.getbuffer().nbytes,
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_image_pool():
+    """Return the process-wide thread pool used to decode and encode photos"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("PHOTO_WORKERS", DEFAULT_WORKERS)),
+                    thread_name_prefix="photo-worker",
+                )
+    return _pool
@@ -0,0 +1,298 @@
+"""Durable chat and assessment history in SQLite.
+
+Messages are appended to a queue and written in batches by a background
+thread, so saving history never blocks a page render. The database runs in
+WAL mode, so sessions page through their history while the writer commits.
+Before a session reads, it waits for its own pending writes (and only
+those) to be committed, so it always sees its own messages. Export every message in chunks with
+
+    python history_store.py export assessments.parquet --kind symptom
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from profiling import lazy_import
+
+
+DEFAULT_DB_PATH = "history.db"
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_EXPORT_CHUNK_ROWS = 50_000
+
+EXPORT_COLUMNS = ["id", "session_id", "kind", "role", "content", "details", "created_at"]
+
+_STOP = object()
+# Queued by a reading session to have the writer commit what it has at once
+_FLUSH = object()
+
+
+class HistoryStore:
+    """Append-only message log with batched background writes"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Notified whenever a batch is done, for sessions waiting on their writes
+        self._written = threading.Condition(self._lock)
+        self._pending = Counter()
+        self._local = threading.local()
+        self.written = 0
+        self.batches = 0
+
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "kind TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "details TEXT, created_at REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, kind, id)"
+        )
+        db.commit()
+        db.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        # One read connection per thread; WAL lets them read while the writer commits
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def append(self, session_id, kind, role, content, details=None, created_at=None):
+        """Queue a message for writing and return immediately"""
+        with self._lock:
+            self._pending[session_id] += 1
+        self._queue.put((
+            session_id, kind, role, content,
+            json.dumps(details, sort_keys=True) if details is not None else None,
+            created_at or time.time(),
+        ))
+
+    def _write_loop(self):
+        db = self._connect()
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            flushing = False
+            taken = 0
+            while True:
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                elif item is _FLUSH:
+                    flushing = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                if flushing:
+                    # A session is waiting: take what is already queued, without waiting for more
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    continue
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            written = bool(batch)
+            if batch:
+                try:
+                    with db:
+                        db.executemany(
+                            "INSERT INTO messages (session_id, kind, role, content, details, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            batch,
+                        )
+                except sqlite3.Error as e:
+                    # Keep the writer alive; losing a batch beats blocking every session
+                    written = False
+                    print(f"history: failed to write {len(batch)} messages: {e}", file=sys.stderr)
+            with self._written:
+                if written:
+                    self.written += len(batch)
+                    self.batches += 1
+                for row in batch:
+                    self._pending[row[0]] -= 1
+                    if self._pending[row[0]] <= 0:
+                        del self._pending[row[0]]
+                self._written.notify_all()
+            # task_done() once for every item taken, sentinels included
+            for _ in range(taken):
+                self._queue.task_done()
+        db.close()
+        with self._written:
+            self._written.notify_all()
+
+    def flush(self):
+        """Block until every queued message has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Write anything still queued and stop the writer"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+    def _sync(self, session_id):
+        # Read-your-writes: wait for this session's queued messages only, not everyone's
+        with self._written:
+            if not self._pending.get(session_id):
+                return
+        self._queue.put(_FLUSH)
+        with self._written:
+            while self._pending.get(session_id) and self._writer.is_alive():
+                self._written.wait(self.flush_interval)
+
+    def count(self, session_id, kind):
+        """Number of stored messages of one kind for a session"""
+        self._sync(session_id)
+        return self._reader().execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND kind = ?", (session_id, kind)
+        ).fetchone()[0]
+
+    def page(self, session_id, kind, limit, offset=0):
+        """Return up to limit messages, skipping the newest offset, oldest first
+
+        Page 0 is the most recent page.
+        """
+        self._sync(session_id)
+        rows = self._reader().execute(
+            "SELECT role, content, details, created_at FROM messages "
+            "WHERE session_id = ? AND kind = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (session_id, kind, limit, offset),
+        ).fetchall()
+        return [
+            {
+                "role": role,
+                "content": content,
+                "details": json.loads(details) if details else None,
+                "created_at": created_at,
+            }
+            for role, content, details, created_at in reversed(rows)
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+            }
+
+    def export(self, path, fmt=None, kind=None, chunk_rows=DEFAULT_EXPORT_CHUNK_ROWS):
+        """Stream stored messages to CSV or Parquet without loading them all at once
+
+        Returns the number of rows written.
+        """
+        pd = lazy_import("pandas")
+        fmt = fmt or ("parquet" if path.endswith(".parquet") else "csv")
+        if fmt not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported export format: {fmt}")
+        self.flush()
+
+        query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM messages"
+        params = ()
+        if kind:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        query += " ORDER BY id"
+
+        db = self._connect()
+        writer = None
+        rows = 0
+        tmp_path = path + ".tmp"
+        try:
+            for chunk in pd.read_sql_query(query, db, params=params, chunksize=chunk_rows):
+                chunk["created_at"] = pd.to_datetime(chunk["created_at"], unit="s", utc=True)
+                if fmt == "csv":
+                    chunk.to_csv(tmp_path, mode="w" if rows == 0 else "a", header=rows == 0, index=False)
+                else:
+                    pa = lazy_import("pyarrow")
+                    pq = lazy_import("pyarrow.parquet")
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    writer.write_table(table)
+                rows += len(chunk)
+            if rows == 0:
+                empty = pd.DataFrame(columns=EXPORT_COLUMNS)
+                if fmt == "csv":
+                    empty.to_csv(tmp_path, index=False)
+                else:
+                    empty.to_parquet(tmp_path, index=False)
+        finally:
+            if writer is not None:
+                writer.close()
+            db.close()
+        os.replace(tmp_path, path)
+        return rows
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Return the process-wide history store, configured from the environment"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore(
+                    db_path=os.getenv("HISTORY_DB", DEFAULT_DB_PATH),
+                    batch_size=int(os.getenv("HISTORY_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+                    flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+                )
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat and assessment history tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export = subcommands.add_parser("export", help="export stored messages to CSV or Parquet")
+    export.add_argument("path", help="output file; .parquet selects Parquet, anything else CSV")
+    export.add_argument("--format", choices=["csv", "parquet"])
+    export.add_argument("--kind", choices=["nutrition", "symptom"],
+                        help="only export one history (default: both)")
+    export.add_argument("--chunk-rows", type=int, default=DEFAULT_EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        store = get_history_store()
+        rows = store.export(args.path, args.format, args.kind, args.chunk_rows)
+        print(f"Exported {rows} messages from {store.db_path} to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
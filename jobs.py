@@ -0,0 +1,211 @@
+"""Background jobs for slow model calls.
+
+A button that needs the model submits the call as a job tied to the
+session instead of running it on the Streamlit script thread. The page
+polls the job from a fragment while it runs, shows its partial output and
+offers a cancel button. Jobs live in a process-wide manager keyed by
+session, so a result survives navigating away and back. Each session keeps
+only its latest job of each kind, and finished jobs expire after JOB_TTL
+seconds.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_WORKERS = 32
+DEFAULT_TTL = 3600.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that tries to publish output after being cancelled"""
+
+
+class Job:
+    """One background call: its state, partial output and result"""
+
+    def __init__(self, session_id, kind, params=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.kind = kind
+        # What the job was asked to do, for rendering its output
+        self.params = params or {}
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        # Pieces of output published while running, e.g. streamed chunks
+        self.partial = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._future = None
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def emit(self, item):
+        """Publish a piece of partial output; raise JobCancelled once the job is cancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.partial.append(item)
+
+    def text(self):
+        """The partial output so far, joined as text"""
+        return "".join(self.partial)
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; return False on timeout"""
+        return self._finished.wait(timeout)
+
+    def cancel(self):
+        """Stop the job
+
+        A queued job never starts. A running job is marked cancelled at once
+        and stops at its next emit(); a blocking call it is waiting on still
+        finishes, but its result is discarded.
+        """
+        self._cancel.set()
+        if self._future is not None:
+            self._future.cancel()
+        return self._finish(CANCELLED)
+
+    def _finish(self, state, result=None, error=None):
+        with self._lock:
+            if self._finished.is_set():
+                return False
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._finished.set()
+            return True
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            if self._finished.is_set():
+                return
+            self.state = RUNNING
+            self.started_at = time.time()
+        try:
+            result = fn(self, *args, **kwargs)
+        except JobCancelled:
+            self._finish(CANCELLED)
+        except Exception as e:
+            self._finish(FAILED, error=f"I apologize, but I encountered an error: {str(e)}")
+        else:
+            self._finish(DONE, result=result)
+        finally:
+            # Anything else escaping fn (e.g. GeneratorExit) must not leave the job running
+            if self.cancelled:
+                self._finish(CANCELLED)
+            else:
+                self._finish(FAILED, error="I apologize, but I encountered an error: the request was interrupted")
+
+
+class JobManager:
+    """Runs jobs on a shared thread pool and keeps each session's latest job per kind"""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.replaced = 0
+
+    def submit(self, session_id, kind, fn, *args, params=None, **kwargs):
+        """Run fn(job, *args, **kwargs) in the background and return the job
+
+        fn publishes partial output with job.emit() and returns the result.
+        A new job replaces, and cancels, the session's earlier job of the
+        same kind.
+        """
+        job = Job(session_id, kind, params)
+        with self._lock:
+            self._prune(time.time())
+            previous = self._jobs.get((session_id, kind))
+            self._jobs[(session_id, kind)] = job
+            self.submitted += 1
+        if previous is not None and previous.active:
+            previous.cancel()
+            with self._lock:
+                self.replaced += 1
+        job._future = self._pool.submit(job._run, fn, args, kwargs)
+        return job
+
+    def record(self, session_id, kind, result, params=None):
+        """Keep a result computed on the spot as the session's finished job of a kind
+
+        Instant answers are shown and kept across navigation like background ones.
+        """
+        job = Job(session_id, kind, params)
+        job._run(lambda job: result, (), {})
+        with self._lock:
+            previous = self._jobs.get((session_id, kind))
+            self._jobs[(session_id, kind)] = job
+        if previous is not None and previous.active:
+            previous.cancel()
+        return job
+
+    def get(self, session_id, kind):
+        """Return the session's latest job of a kind, or None"""
+        with self._lock:
+            return self._jobs.get((session_id, kind))
+
+    def cancel(self, session_id, kind):
+        """Cancel the session's job of a kind if it is still running"""
+        job = self.get(session_id, kind)
+        return job is not None and job.cancel()
+
+    def _prune(self, now):
+        # Caller holds the lock
+        expired = [
+            key for key, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for key in expired:
+            del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                "submitted": self.submitted,
+                "replaced": self.replaced,
+                "queued": states.count(QUEUED),
+                "running": states.count(RUNNING),
+                "retained": len(states),
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, configured from the environment"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(
+                    max_workers=int(os.getenv("JOB_WORKERS", DEFAULT_WORKERS)),
+                    ttl=float(os.getenv("JOB_TTL", DEFAULT_TTL)),
+                )
+    return _manager
@@ -0,0 +1,200 @@
+"""Shared, connection-pooled Groq client and global request limiter.
+
+One Groq client is created per process so every Streamlit session reuses
+the same keep-alive connection pool. All model calls go through the
+RateLimiter, which caps in-flight requests and reads Groq's rate-limit
+response headers so bursts queue locally instead of failing with 429.
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import lazy_import
+
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_QUEUE_TIMEOUT = 60.0
+
+# Groq reports reset windows as e.g. "2m59.56s", "7.66s" or "250ms"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_reset_duration(value):
+    """Convert a rate-limit reset header into seconds, or None if unparseable"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class RateLimiter:
+    """Bound concurrent model calls and pause while the provider quota is exhausted"""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.in_flight = 0
+        self.throttled = 0
+
+    def acquire(self):
+        """Wait for a free slot and for any rate-limit window to reset"""
+        deadline = time.monotonic() + self.queue_timeout
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            raise TimeoutError("Timed out waiting for a free Groq request slot")
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    delay = self._blocked_until - now
+                if delay <= 0:
+                    break
+                if now + delay > deadline:
+                    raise TimeoutError("Groq rate limit did not reset before the queue timeout")
+                time.sleep(min(delay, 1.0))
+        except BaseException:
+            self._semaphore.release()
+            raise
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def observe(self, response):
+        """httpx response hook that records Groq's x-ratelimit-* headers"""
+        headers = response.headers
+        block_for = 0.0
+
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if response.status_code == 429:
+            block_for = parse_reset_duration(headers.get("retry-after")) or 1.0
+        else:
+            if remaining_requests == "0":
+                block_for = parse_reset_duration(headers.get("x-ratelimit-reset-requests")) or 0.0
+            if remaining_tokens == "0":
+                block_for = max(
+                    block_for,
+                    parse_reset_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0,
+                )
+
+        with self._lock:
+            if remaining_requests is not None and remaining_requests.isdigit():
+                self.remaining_requests = int(remaining_requests)
+            if remaining_tokens is not None and remaining_tokens.isdigit():
+                self.remaining_tokens = int(remaining_tokens)
+            if block_for > 0:
+                self.throttled += 1
+                self._blocked_until = max(self._blocked_until, time.monotonic() + block_for)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "remaining_requests": self.remaining_requests,
+                "remaining_tokens": self.remaining_tokens,
+                "throttled": self.throttled,
+            }
+
+
+_limiter = None
+_client = None
+_worker_pool = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide request limiter"""
+    global _limiter
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                    queue_timeout=float(os.getenv("GROQ_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+                )
+    return _limiter
+
+
+def get_worker_pool():
+    """Return the process-wide thread pool used to fan out model calls"""
+    global _worker_pool
+    if _worker_pool is None:
+        with _lock:
+            if _worker_pool is None:
+                _worker_pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("GROQ_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                    thread_name_prefix="groq-worker",
+                )
+    return _worker_pool
+
+
+def get_groq_client():
+    """Return the process-wide Groq client, creating it on first use"""
+    global _client
+    if _client is None:
+        limiter = get_rate_limiter()
+        # groq and httpx are only loaded by pages that talk to the model
+        httpx = lazy_import("httpx")
+        Groq = lazy_import("groq").Groq
+        with _lock:
+            if _client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=int(
+                            os.getenv("GROQ_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+                        ),
+                        max_keepalive_connections=int(
+                            os.getenv("GROQ_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)
+                        ),
+                        keepalive_expiry=float(
+                            os.getenv("GROQ_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+                        ),
+                    ),
+                    timeout=httpx.Timeout(
+                        float(os.getenv("GROQ_TIMEOUT", DEFAULT_TIMEOUT)),
+                        connect=float(os.getenv("GROQ_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+                    ),
+                    event_hooks={"response": [limiter.observe]},
+                )
+                try:
+                    _client = Groq(
+                        api_key=os.getenv("GROQ_API_KEY"),
+                        http_client=http_client,
+                        max_retries=int(os.getenv("GROQ_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+                    )
+                except Exception:
+                    http_client.close()
+                    raise
+    return _client
@@ -0,0 +1,155 @@
+"""Structured (JSON) meal plans with per-meal token budgets.
+
+Each meal is generated on its own as compact JSON of foods, portions and
+key nutrients, validated, and repaired if needed, so meals can be cached
+individually, recombined into a full day and shown as a table. Token
+budgets are sized per meal type instead of one fixed max_tokens.
+"""
+import json
+import re
+
+
+# Completion token budgets per meal type
+MEAL_TOKEN_BUDGETS = {"Breakfast": 300, "Lunch": 350, "Dinner": 400, "Snacks": 250}
+PROSE_TOKEN_BUDGETS = {"Breakfast": 500, "Lunch": 600, "Dinner": 700, "Snacks": 400}
+REPAIR_TOKEN_BUDGET = 450
+
+MAX_ITEMS = 8
+MAX_NUTRIENTS = 4
+_MAX_TEXT = 120
+
+SCHEMA_HINT = (
+    '{"meal": "<meal type>", "items": [{"food": "<food>", "portion": "<amount>", '
+    '"nutrients": ["<key nutrient>", ...]}], "tip": "<one short sentence>"}'
+)
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class MealPlanError(ValueError):
+    """The model's answer could not be turned into a valid meal"""
+
+
+def structured_prompt(meal_type, pregnancy_month):
+    """Build the JSON-mode prompt for one meal"""
+    return (
+        f"Create a {meal_type.lower()} for someone {pregnancy_month} months pregnant. "
+        f"Respond with only a JSON object in this form: {SCHEMA_HINT} "
+        f"Use 2-{MAX_ITEMS // 2 + 2} items, short portions like \"1 cup\", "
+        f"at most {MAX_NUTRIENTS} nutrients per item, and no other text."
+    )
+
+
+def repair_prompt(text, error):
+    """Ask the model to turn a broken answer into the expected JSON"""
+    return (
+        f"This meal plan should be a JSON object of the form {SCHEMA_HINT} "
+        f"but it is invalid ({error}). Return only the corrected JSON object, "
+        f"keeping the same foods:\n{text[:3000]}"
+    )
+
+
+def _close_truncated(text):
+    """Close strings, arrays and objects left open by a cut-off answer"""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    return text + "".join(reversed(stack))
+
+
+def load_json(text):
+    """Parse the model's JSON, fixing fences, surrounding prose, trailing commas and truncation"""
+    text = _FENCE.sub("", text.strip())
+    start = text.find("{")
+    if start == -1:
+        raise MealPlanError("no JSON object in the answer")
+    text = text[start:]
+    end = text.rfind("}")
+    candidates = [text[:end + 1]] if end != -1 else []
+    candidates.append(_close_truncated(text))
+
+    error = None
+    for candidate in candidates:
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                data = json.loads(attempt)
+            except json.JSONDecodeError as e:
+                error = e
+                continue
+            if isinstance(data, dict):
+                return data
+    raise MealPlanError(f"invalid JSON: {error}")
+
+
+def _text(value):
+    if value is None:
+        return ""
+    return " ".join(str(value).split())[:_MAX_TEXT]
+
+
+def validate_meal(data, meal_type):
+    """Check and normalize a parsed meal, returning the canonical dict"""
+    if not isinstance(data, dict):
+        raise MealPlanError("the answer is not a JSON object")
+    items = data.get("items")
+    if not isinstance(items, list):
+        raise MealPlanError('missing "items" list')
+
+    clean = []
+    for item in items[:MAX_ITEMS]:
+        if not isinstance(item, dict):
+            continue
+        food = _text(item.get("food"))
+        if not food:
+            continue
+        nutrients = item.get("nutrients") or []
+        if isinstance(nutrients, str):
+            nutrients = re.split(r"[,;/]", nutrients)
+        clean.append({
+            "food": food,
+            "portion": _text(item.get("portion")),
+            "nutrients": [n for n in (_text(n) for n in nutrients) if n][:MAX_NUTRIENTS],
+        })
+    if not clean:
+        raise MealPlanError("no valid food items")
+    return {"meal": meal_type, "items": clean, "tip": _text(data.get("tip"))}
+
+
+def parse_meal(text, meal_type):
+    """Parse and validate a model answer into a canonical meal dict"""
+    return validate_meal(load_json(text), meal_type)
+
+
+def dump_meal(meal):
+    """Serialize a canonical meal compactly, e.g. for the response cache"""
+    return json.dumps(meal, separators=(",", ":"), ensure_ascii=False)
+
+
+def meal_rows(meal):
+    """Flatten a meal into table rows"""
+    return [
+        {
+            "Meal": meal["meal"],
+            "Food": item["food"],
+            "Portion": item["portion"],
+            "Key nutrients": ", ".join(item["nutrients"]),
+        }
+        for item in meal["items"]
+    ]
@@ -0,0 +1,245 @@
+"""Instrumentation for model calls and a Prometheus-style exposition.
+
+Every assistant request is recorded with its latency, time to first token,
+token usage, model, error class and whether it was served from a cache.
+Totals and histograms are rendered in the Prometheus text format. Set
+METRICS_PORT to serve them over HTTP at /metrics, or METRICS_FILE to have
+them written to a file every METRICS_FILE_INTERVAL seconds. Recent samples
+are kept in memory for the percentile charts on the Resources page.
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+DEFAULT_SAMPLES = 5000
+DEFAULT_FILE_INTERVAL = 15.0
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+        self.total += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class CallTimer:
+    """Times one model call from start to first token to finish"""
+
+    def __init__(self, registry, request_type, model):
+        self.registry = registry
+        self.request_type = request_type
+        self.model = model
+        self.start = time.perf_counter()
+        self.ttft = None
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def finish(self, source="llm", prompt_tokens=None, completion_tokens=None):
+        latency = time.perf_counter() - self.start
+        self.registry.record(
+            self.request_type, self.model, latency,
+            ttft=latency if self.ttft is None else self.ttft,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            source=source,
+        )
+
+    def fail(self, error):
+        self.registry.record(
+            self.request_type, self.model, time.perf_counter() - self.start,
+            ttft=self.ttft, error=type(error).__name__,
+        )
+
+
+class MetricsRegistry:
+    """Thread-safe counters, histograms and recent samples for model calls"""
+
+    def __init__(self, max_samples=DEFAULT_SAMPLES):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latency = defaultdict(_Histogram)
+        self.ttft = defaultdict(_Histogram)
+        self.samples = deque(maxlen=max_samples)
+        self._collectors = {}
+
+    def start_call(self, request_type, model="none"):
+        """Begin timing a call; finish() or fail() the returned timer
+
+        Set the timer's model once it is known, e.g. after routing.
+        """
+        return CallTimer(self, request_type, model)
+
+    def record(self, request_type, model, latency, ttft=None, prompt_tokens=None,
+               completion_tokens=None, source="llm", error=None):
+        """Record one finished (or failed) request
+
+        source says where the answer came from: "llm", "cache" (exact match),
+        "coalesced" (shared an in-flight call), "replica" (waited for another
+        replica's call through the shared tier), "similar" (near-duplicate
+        question index) or "triage" (local triage engine).
+        """
+        outcome = "error" if error else source
+        with self._lock:
+            self.requests[(request_type, model, outcome)] += 1
+            if error:
+                self.errors[(model, error)] += 1
+            if prompt_tokens:
+                self.tokens[(model, "prompt")] += prompt_tokens
+            if completion_tokens:
+                self.tokens[(model, "completion")] += completion_tokens
+            if source == "llm" and not error:
+                self.latency[model].observe(latency)
+                if ttft is not None:
+                    self.ttft[model].observe(ttft)
+            self.samples.append({
+                "time": time.time(),
+                "request_type": request_type,
+                "model": model,
+                "source": source,
+                "latency": latency,
+                "ttft": ttft,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "error": error,
+            })
+
+    def record_local(self, request_type, source):
+        """Record a request answered without calling a model"""
+        self.record(request_type, "local", 0.0, ttft=0.0, source=source)
+
+    def add_collector(self, name, collector):
+        """Register (or replace) a callable returning extra (name, type, labels, value) samples"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def recent_samples(self):
+        with self._lock:
+            return list(self.samples)
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP mh_llm_requests_total Assistant requests by where the answer came from.",
+                "# TYPE mh_llm_requests_total counter",
+            ]
+            for (request_type, model, outcome), value in sorted(self.requests.items()):
+                lines.append(
+                    f"mh_llm_requests_total{_labels(request_type=request_type, model=model, outcome=outcome)} {value}"
+                )
+
+            lines += ["# HELP mh_llm_errors_total Failed model calls by error class.",
+                      "# TYPE mh_llm_errors_total counter"]
+            for (model, error), value in sorted(self.errors.items()):
+                lines.append(f"mh_llm_errors_total{_labels(model=model, error=error)} {value}")
+
+            lines += ["# HELP mh_llm_tokens_total Tokens reported by the provider.",
+                      "# TYPE mh_llm_tokens_total counter"]
+            for (model, kind), value in sorted(self.tokens.items()):
+                lines.append(f"mh_llm_tokens_total{_labels(model=model, kind=kind)} {value}")
+
+            for name, help_text, histograms in (
+                ("mh_llm_request_duration_seconds", "Model call latency.", self.latency),
+                ("mh_llm_time_to_first_token_seconds", "Time until the first token arrived.", self.ttft),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for model, histogram in sorted(histograms.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_labels(model=model, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{_labels(model=model, le='+Inf')} {histogram.total}")
+                    lines.append(f"{name}_sum{_labels(model=model)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_labels(model=model)} {histogram.total}")
+
+            collectors = list(self._collectors.values())
+
+        # Samples of one metric must be contiguous, whatever order collectors yield them in
+        families = {}
+        for collector in collectors:
+            for name, metric_type, labels, value in collector():
+                family = families.setdefault(name, [f"# TYPE {name} {metric_type}"])
+                family.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+        for family in families.values():
+            lines += family
+        return "\n".join(lines) + "\n"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+_exporters_started = False
+
+
+def get_metrics():
+    """Return the process-wide metrics registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry(
+                    max_samples=int(os.getenv("METRICS_SAMPLES", DEFAULT_SAMPLES))
+                )
+    return _registry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_metrics_file(path, interval):
+    while True:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(get_metrics().render_prometheus())
+        os.replace(tmp_path, path)
+        time.sleep(interval)
+
+
+def start_exporters():
+    """Start the /metrics endpoint and file writer configured in the environment, once"""
+    global _exporters_started
+    with _registry_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    port = os.getenv("METRICS_PORT")
+    if port:
+        server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "0.0.0.0"), int(port)), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+    path = os.getenv("METRICS_FILE")
+    if path:
+        interval = float(os.getenv("METRICS_FILE_INTERVAL", DEFAULT_FILE_INTERVAL))
+        threading.Thread(
+            target=_write_metrics_file, args=(path, interval), name="metrics-file", daemon=True
+        ).start()
@@ -0,0 +1,435 @@
+"""Latency- and error-aware model routing with hedged requests.
+
+Each request type has a list of candidate models. Every call is timed per
+model (total latency for blocking calls, time to first chunk for streams)
+and the healthiest, fastest candidate is tried first. If it has not
+answered by its own recent p95, a hedged request goes to the next
+candidate and whichever answers first wins. A model that keeps failing
+trips its circuit breaker and gets no traffic until a probe succeeds.
+Failures before an answer starts fall through to the next candidate.
+
+Latency is timed from when an attempt calls mark_started(), i.e. once it
+holds a local rate limiter slot, so queueing on this replica neither
+inflates a model's samples nor triggers hedges. Failures that are not the
+model's fault (local queue timeouts, 4xx client errors) end the request
+without counting against the model.
+
+Candidates are configured with comma-separated ROUTER_<TYPE>_MODELS, e.g.
+
+    ROUTER_NUTRITION_MODELS=mixtral-8x7b-32768,llama-3.3-70b-versatile
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+DEFAULT_ROUTES = {
+    "nutrition": ["mixtral-8x7b-32768", "llama-3.3-70b-versatile"],
+    "symptom": ["llama3-8b-8192", "llama-3.1-8b-instant"],
+    "photo": [os.getenv("VISION_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")],
+}
+
+DEFAULT_WINDOW = 200
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_HEDGE_RATIO = 0.1
+DEFAULT_HEDGE_MIN_DELAY = 0.25
+# Hedge deadlines used until a model has enough samples for its own p95
+DEFAULT_HEDGE_DELAY = {"complete": 8.0, "stream": 2.0}
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+_END = object()
+
+
+class NoModelAvailable(RuntimeError):
+    """Every candidate model for a request type is failing"""
+
+
+def is_model_failure(error, started):
+    """Whether an attempt's error should count against the model
+
+    Errors before the attempt started (e.g. a local limiter timeout) and
+    client errors other than timeouts, rate limits and unknown models are
+    the request's own problem.
+    """
+    if not started:
+        return False
+    status = getattr(error, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (404, 408, 429))
+
+
+class CircuitBreaker:
+    """Closed until failure_threshold failures in a row, then open for reset_timeout
+
+    After the timeout one probe request is let through (half-open); its
+    outcome closes or re-opens the breaker. A probe that ends without a
+    verdict on the model re-opens it for another timeout.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def available(self, now):
+        """Whether a request could be sent now, without claiming the probe"""
+        if self.state == "closed":
+            return True
+        return self.state == "open" and now - self.opened_at >= self.reset_timeout
+
+    def acquire(self, now):
+        """Claim permission to send a request"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return True
+        return False
+
+    def success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def inconclusive(self, now):
+        """The probe ended without saying anything about the model"""
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = now
+
+    def failure(self, now):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = now
+
+
+class _ModelStats:
+    def __init__(self, window, breaker):
+        self.latency = {"complete": deque(maxlen=window), "stream": deque(maxlen=window)}
+        self.outcomes = deque(maxlen=window)
+        self.breaker = breaker
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def quantile(self, mode, q):
+        samples = sorted(self.latency[mode])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ModelRouter:
+    """Pick, hedge and fail over between candidate models per request type"""
+
+    def __init__(self, routes=None, window=DEFAULT_WINDOW, min_samples=DEFAULT_MIN_SAMPLES,
+                 hedge_ratio=DEFAULT_HEDGE_RATIO, hedge_min_delay=DEFAULT_HEDGE_MIN_DELAY,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 max_workers=32):
+        self.routes = {name: list(models) for name, models in (routes or DEFAULT_ROUTES).items()}
+        self.window = window
+        self.min_samples = min_samples
+        self.hedge_ratio = hedge_ratio
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._models = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        self._local = threading.local()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def _stats(self, model):
+        # Caller holds the lock
+        stats = self._models.get(model)
+        if stats is None:
+            stats = self._models[model] = _ModelStats(
+                self.window, CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            )
+        return stats
+
+    def candidates(self, request_type, mode="complete"):
+        """Return the request type's models that can take traffic, best first
+
+        Models are ranked by their recent median latency, inflated by their
+        error rate. Models without enough samples keep their configured order
+        ahead of slower measured ones, so new candidates get tried.
+        """
+        models = self.routes.get(request_type)
+        if not models:
+            raise KeyError(f"No models configured for request type {request_type!r}")
+        now = time.monotonic()
+        ranked = []
+        with self._lock:
+            for order, model in enumerate(models):
+                stats = self._stats(model)
+                if not stats.breaker.available(now):
+                    continue
+                if len(stats.latency[mode]) >= self.min_samples:
+                    score = stats.quantile(mode, 0.5) / max(0.05, 1.0 - stats.error_rate())
+                else:
+                    score = 0.0
+                ranked.append((score, order, model))
+        return [model for _, _, model in sorted(ranked)]
+
+    def hedge_delay(self, model, mode="complete"):
+        """How long to wait on model before hedging: its recent p95, or a default"""
+        with self._lock:
+            stats = self._stats(model)
+            p95 = stats.quantile(mode, 0.95) if len(stats.latency[mode]) >= self.min_samples else None
+        if p95 is None:
+            p95 = DEFAULT_HEDGE_DELAY[mode]
+        return max(self.hedge_min_delay, p95)
+
+    def record(self, model, mode, latency=None, ok=True):
+        """Record one finished attempt against model"""
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats(model)
+            stats.outcomes.append(ok)
+            if ok:
+                stats.latency[mode].append(latency)
+                stats.breaker.success()
+            else:
+                stats.breaker.failure(now)
+
+    def release(self, model):
+        """Record an attempt that ended without counting for or against model
+
+        If it was the breaker's half-open probe, the breaker re-opens rather
+        than waiting forever on a probe that will never report.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._stats(model).breaker.inconclusive(now)
+
+    def report_failure(self, model, mode="stream"):
+        """Record a failure noticed by the caller, e.g. a stream that broke midway"""
+        self.record(model, mode, ok=False)
+
+    def mark_started(self):
+        """Called by an attempt once it is about to send its request upstream
+
+        Time spent before this, e.g. waiting for a rate limiter slot, is not
+        the model's latency.
+        """
+        mark = getattr(self._local, "mark", None)
+        if mark is not None:
+            mark()
+
+    def _claim(self, model):
+        with self._lock:
+            return self._stats(model).breaker.acquire(time.monotonic())
+
+    def _may_hedge(self):
+        # Caller holds the lock; hedges are capped at a fraction of requests
+        return self.hedges < self.hedge_ratio * self.requests
+
+    def _run(self, request_type, mode, attempt, on_loser):
+        """Race attempts across candidates; return (model, result) from the first to succeed
+
+        attempt(model) runs on the router's pool, calls mark_started() right
+        before sending its request, and returns the result. on_loser(result)
+        is called on results that lost the race.
+        """
+        with self._lock:
+            self.requests += 1
+        queue = self.candidates(request_type, mode)
+        pending = {}
+        # When each launched attempt actually started its upstream call
+        starts = {}
+        hedged = False
+        last_error = None
+
+        def run(model):
+            self._local.mark = lambda: starts.setdefault(model, time.perf_counter())
+            try:
+                return attempt(model)
+            finally:
+                self._local.mark = None
+
+        def launch():
+            while queue:
+                model = queue.pop(0)
+                if self._claim(model):
+                    pending[self._pool.submit(run, model)] = model
+                    return model
+            return None
+
+        def abandon():
+            # Let attempts still running finish in the background, then discard them
+            for other, other_model in pending.items():
+                other.add_done_callback(
+                    lambda f, m=other_model: self._finish_loser(f, m, starts, mode, on_loser)
+                )
+
+        primary = launch()
+        if primary is None:
+            raise NoModelAvailable(f"No healthy model for {request_type}")
+        hedge_delay = self.hedge_delay(primary, mode)
+
+        while pending:
+            timeout = None
+            if not hedged and queue:
+                if primary in starts:
+                    timeout = max(0.0, starts[primary] + hedge_delay - time.perf_counter())
+                else:
+                    # Still queued locally; a hedge would only queue behind it
+                    timeout = 0.05
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if primary not in starts:
+                    continue
+                # The primary is slower than its p95: race it against the next candidate
+                hedged = True
+                with self._lock:
+                    allowed = self._may_hedge()
+                    if allowed:
+                        self.hedges += 1
+                if allowed:
+                    launch()
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not is_model_failure(e, model in starts):
+                        self.release(model)
+                        abandon()
+                        raise
+                    self.record(model, mode, ok=False)
+                    last_error = e
+                    continue
+                self.record(model, mode, time.perf_counter() - starts.get(model, time.perf_counter()))
+                with self._lock:
+                    if model != primary and hedged:
+                        self.hedge_wins += 1
+                    elif model != primary:
+                        self.fallbacks += 1
+
+                # Late finishers still feed the statistics, then are discarded
+                abandon()
+                return model, result
+
+            if not pending:
+                # Everything in flight failed before answering: fall through to the next model
+                launch()
+
+        raise last_error or NoModelAvailable(f"No healthy model for {request_type}")
+
+    def _finish_loser(self, future, model, starts, mode, on_loser):
+        try:
+            result = future.result()
+        except Exception as e:
+            if is_model_failure(e, model in starts):
+                self.record(model, mode, ok=False)
+            else:
+                self.release(model)
+            return
+        self.record(model, mode, time.perf_counter() - starts.get(model, time.perf_counter()))
+        if on_loser is not None:
+            on_loser(result)
+
+    def complete(self, request_type, call):
+        """Run call(model) for a blocking completion; return (model, result)"""
+        return self._run(request_type, "complete", call, None)
+
+    def stream(self, request_type, open_stream):
+        """Open open_stream(model) iterators until one yields; return (model, iterator)
+
+        Hedging and failover happen on the time to the first chunk. The
+        returned iterator continues the winning stream; losing streams are
+        closed as soon as they produce their first chunk.
+        """
+        def first_chunk(model):
+            iterator = iter(open_stream(model))
+            return iterator, next(iterator, _END)
+
+        def close_stream(result):
+            iterator, _ = result
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+        model, (iterator, first) = self._run(request_type, "stream", first_chunk, close_stream)
+
+        def chunks():
+            try:
+                if first is not _END:
+                    yield first
+                    yield from iterator
+            finally:
+                close_stream((iterator, first))
+
+        return model, chunks()
+
+    def stats(self):
+        """Per-model health and latency, plus hedging counters"""
+        with self._lock:
+            models = {
+                model: {
+                    "state": stats.breaker.state,
+                    "trips": stats.breaker.trips,
+                    "error_rate": stats.error_rate(),
+                    "p50_complete": stats.quantile("complete", 0.5),
+                    "p95_complete": stats.quantile("complete", 0.95),
+                    "p50_stream": stats.quantile("stream", 0.5),
+                    "p95_stream": stats.quantile("stream", 0.95),
+                }
+                for model, stats in self._models.items()
+            }
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "fallbacks": self.fallbacks,
+                "models": models,
+            }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def routes_from_env():
+    """Read ROUTER_<TYPE>_MODELS overrides on top of the default routes"""
+    routes = {}
+    for request_type, models in DEFAULT_ROUTES.items():
+        configured = os.getenv(f"ROUTER_{request_type.upper()}_MODELS")
+        if configured:
+            models = [model.strip() for model in configured.split(",") if model.strip()]
+        routes[request_type] = models
+    return routes
+
+
+def get_model_router():
+    """Return the process-wide model router, configured from the environment"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter(
+                    routes=routes_from_env(),
+                    window=int(os.getenv("ROUTER_WINDOW", DEFAULT_WINDOW)),
+                    min_samples=int(os.getenv("ROUTER_MIN_SAMPLES", DEFAULT_MIN_SAMPLES)),
+                    hedge_ratio=float(os.getenv("ROUTER_HEDGE_RATIO", DEFAULT_HEDGE_RATIO)),
+                    hedge_min_delay=float(os.getenv("ROUTER_HEDGE_MIN_DELAY", DEFAULT_HEDGE_MIN_DELAY)),
+                    failure_threshold=int(os.getenv("ROUTER_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+                    reset_timeout=float(os.getenv("ROUTER_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT)),
+                )
+    return _router
@@ -0,0 +1,107 @@
+"""Import-time and render-time profiling for cold start tuning.
+
+Heavy dependencies are loaded through lazy_import so pages only pay for
+what they use, and each first import is timed. Page renders are timed with
+timed_render, and full-script runs and fragment-only reruns are counted
+with count_rerun. Set MH_PROFILE_STARTUP=1, or run
+
+    streamlit run app.py -- --profile-startup
+
+to print the timings to stderr and show them in the sidebar.
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+
+ENABLED = (
+    os.getenv("MH_PROFILE_STARTUP", "").lower() in ("1", "true", "yes")
+    or "--profile-startup" in sys.argv
+)
+
+# When the app first started loading in this process
+PROCESS_START = time.perf_counter()
+
+_RENDER_SAMPLES = 100
+
+_lock = threading.Lock()
+import_times = {}
+render_times = defaultdict(lambda: deque(maxlen=_RENDER_SAMPLES))
+rerun_counts = Counter()
+first_render_seconds = None
+
+
+def _log(message):
+    if ENABLED:
+        print(f"[profile] {message}", file=sys.stderr)
+
+
+def record_import(name, seconds):
+    """Record how long an import took, keeping only the first (cold) measurement"""
+    with _lock:
+        if name in import_times:
+            return
+        import_times[name] = seconds
+    _log(f"import {name}: {seconds * 1000:.1f} ms")
+
+
+def lazy_import(name):
+    """Import a module on first use, timing the import"""
+    module = sys.modules.get(name)
+    # A module another thread is still importing is already in sys.modules;
+    # import_module waits for it to finish instead of returning it half-built
+    if module is not None and not getattr(getattr(module, "__spec__", None), "_initializing", False):
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    record_import(name, time.perf_counter() - start)
+    return module
+
+
+@contextmanager
+def timed_render(page):
+    """Time one render of a page"""
+    global first_render_seconds
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            render_times[page].append(end - start)
+            first = first_render_seconds is None
+            if first:
+                first_render_seconds = end - PROCESS_START
+        if first:
+            _log(f"first page rendered {first_render_seconds * 1000:.1f} ms after the app started loading")
+        _log(f"render {page}: {(end - start) * 1000:.1f} ms")
+
+
+def count_rerun(scope):
+    """Count a full script run ("script") or a fragment-only rerun ("fragment:<name>")"""
+    with _lock:
+        rerun_counts[scope] += 1
+
+
+def summary():
+    """Return import times and per-page render statistics in milliseconds"""
+    with _lock:
+        pages = {
+            page: {
+                "renders": len(samples),
+                "last_ms": samples[-1] * 1000,
+                "mean_ms": sum(samples) / len(samples) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+            for page, samples in render_times.items() if samples
+        }
+        return {
+            "imports_ms": {name: seconds * 1000 for name, seconds in import_times.items()},
+            "first_render_ms": None if first_render_seconds is None else first_render_seconds * 1000,
+            "pages": pages,
+            "reruns": dict(rerun_counts),
+        }
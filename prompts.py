@@ -0,0 +1,222 @@
+"""Prompt templates compiled into canonical, byte-stable text.
+
+Every system context starts with a static prefix that is byte-for-byte the
+same for all requests of its kind, followed by a short tail with the
+month and restrictions. Restriction lists are deduplicated, sorted and
+joined the same way whatever order they were picked in, and whitespace is
+fixed by the template rather than by the caller, so logically identical
+requests render to identical bytes: they share response cache keys, and
+the provider can reuse its cached prefix. Contexts are compiled once per
+month and restriction combination and kept.
+
+Rendered prompts are measured with the same token estimate as the chat
+memory, and PromptBudget.fit() keeps a request within PROMPT_TOKEN_BUDGET
+by dropping the oldest conversation history first. Callers fit a request
+before building its cache key, so the key describes what is actually sent.
+"""
+import functools
+import os
+import threading
+
+from conversation_memory import estimate_tokens
+
+
+DEFAULT_TOKEN_BUDGET = 3000
+# Rough per-message cost of the chat format around each message's content
+MESSAGE_OVERHEAD_TOKENS = 4
+# Counted for each image part, which estimate_tokens cannot measure
+IMAGE_TOKENS = 800
+
+PREGNANCY_MONTHS = range(1, 10)
+
+NUTRITION_PREFIX = (
+    "You are a maternal nutrition expert.\n"
+    "Provide nutritional advice that:\n"
+    "1. Is safe for pregnancy\n"
+    "2. Meets increased nutritional needs for the specific pregnancy month\n"
+    "3. Avoids any listed allergens\n"
+    "4. Respects dietary preferences\n"
+    "5. Includes specific food suggestions and portions\n"
+)
+
+SYMPTOM_PREFIX = (
+    "You are a virtual doctor.\n"
+    "Provide a detailed assessment including:\n"
+    "1. Possible causes\n"
+    "2. Whether this is normal for their stage of pregnancy\n"
+    "3. Recommended actions\n"
+    "4. When to seek immediate medical attention\n"
+)
+
+
+class PromptBudgetError(ValueError):
+    """A request does not fit the prompt token budget even without history"""
+
+
+def _clean(text):
+    return " ".join(str(text).split())
+
+
+def canonical_list(items):
+    """Deduplicate, tidy and sort a list of choices into a stable tuple"""
+    seen = {}
+    for item in items or ():
+        item = _clean(item)
+        if item:
+            key = item.casefold()
+            # Of two spellings differing only in case, keep the same one whatever the order
+            seen[key] = min(seen.get(key, item), item)
+    return tuple(seen[key] for key in sorted(seen))
+
+
+def _join(items):
+    return ", ".join(items) if items else "None"
+
+
+@functools.lru_cache(maxsize=4096)
+def _nutrition_context(pregnancy_month, preferences, allergies):
+    return (
+        f"{NUTRITION_PREFIX}"
+        f"The user is {pregnancy_month} months pregnant.\n"
+        f"Dietary preferences: {_join(preferences)}\n"
+        f"Food allergies: {_join(allergies)}\n"
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _symptom_context(pregnancy_month):
+    return f"{SYMPTOM_PREFIX}The patient is {pregnancy_month} months pregnant.\n"
+
+
+def nutrition_context(pregnancy_month, preferences=None, allergies=None):
+    """Return the system context for nutrition queries"""
+    return _nutrition_context(int(pregnancy_month), canonical_list(preferences), canonical_list(allergies))
+
+
+def symptom_context(pregnancy_month):
+    """Return the system context for symptom assessment queries"""
+    return _symptom_context(int(pregnancy_month))
+
+
+def compile_contexts(preference_choices=(), allergy_choices=()):
+    """Compile the contexts for every month with no restriction or any single one
+
+    Other combinations are compiled on first use and kept as well.
+    """
+    for month in PREGNANCY_MONTHS:
+        symptom_context(month)
+        nutrition_context(month)
+        for preference in preference_choices:
+            nutrition_context(month, [preference])
+        for allergy in allergy_choices:
+            nutrition_context(month, None, [allergy])
+
+
+def symptom_prompt(pregnancy_week, symptoms, severity, previous_complications, description):
+    """Build the symptom assessment prompt from the checker's inputs"""
+    return (
+        f"Patient is {int(pregnancy_week)} weeks pregnant with the following symptoms:\n"
+        f"- Current Symptoms: {_join(canonical_list(symptoms))}\n"
+        f"- Severity: {_clean(severity)}\n"
+        f"- Previous Complications: {_join(canonical_list(previous_complications))}\n"
+        f"- Additional Details: {_clean(description or '') or 'None'}\n"
+    )
+
+
+def meal_plan_prompt(meal_type, pregnancy_month):
+    """Build the meal planner prompt for a single meal type"""
+    return f"Create a {meal_type.lower()} meal plan for someone {int(pregnancy_month)} months pregnant."
+
+
+def content_tokens(content):
+    """Estimate the tokens in a message's content: text, or a list of text and image parts"""
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    return sum(
+        estimate_tokens(part.get("text", "")) if part.get("type") == "text" else IMAGE_TOKENS
+        for part in content
+    )
+
+
+def message_tokens(messages):
+    """Estimate the prompt tokens of a list of chat messages"""
+    return sum(MESSAGE_OVERHEAD_TOKENS + content_tokens(m["content"]) for m in messages)
+
+
+class PromptBudget:
+    """Keeps requests within a prompt token budget and counts what it trims"""
+
+    def __init__(self, max_tokens=DEFAULT_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.trimmed = 0
+        self.rejected = 0
+
+    def _trim(self, context, prompt, history, images):
+        # Return how many of the oldest history messages to drop, and the tokens left
+        total = message_tokens([
+            {"role": "system", "content": context}, {"role": "user", "content": prompt}
+        ]) + images * IMAGE_TOKENS
+        history_tokens = [MESSAGE_OVERHEAD_TOKENS + content_tokens(m["content"]) for m in history]
+        total += sum(history_tokens)
+
+        dropped = 0
+        while total > self.max_tokens and dropped < len(history):
+            total -= history_tokens[dropped]
+            dropped += 1
+        return dropped, total
+
+    def _error(self, total):
+        return PromptBudgetError(
+            f"the request needs about {total} prompt tokens, over the budget of {self.max_tokens}"
+        )
+
+    def check(self, context, prompt, images=0):
+        """Raise PromptBudgetError if a request cannot fit the budget; nothing is counted"""
+        _, total = self._trim(context, prompt, [], images)
+        if total > self.max_tokens:
+            raise self._error(total)
+
+    def fit(self, context, prompt, history=None, images=0):
+        """Trim history so the request fits the budget; return (history, tokens)
+
+        The oldest history messages are dropped first. PromptBudgetError is
+        raised if the context and prompt (plus images) alone do not fit.
+        """
+        history = list(history or [])
+        dropped, total = self._trim(context, prompt, history, images)
+        with self._lock:
+            if total > self.max_tokens:
+                self.rejected += 1
+                raise self._error(total)
+            self.requests += 1
+            self.tokens += total
+            if dropped:
+                self.trimmed += 1
+        return history[dropped:], total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "trimmed": self.trimmed,
+                "rejected": self.rejected,
+                "contexts": _nutrition_context.cache_info().currsize + _symptom_context.cache_info().currsize,
+            }
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_prompt_budget():
+    """Return the process-wide prompt budget, configured from the environment"""
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = PromptBudget(int(os.getenv("PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)))
+    return _budget
@@ -0,0 +1,210 @@
+"""Local near-duplicate index for previously answered chat questions.
+
+Questions are reduced to TF-IDF term vectors and stored in an inverted
+index, one segment per pregnancy month and restriction set. A lookup only
+scores entries that share one of the query's rarest terms, so it stays
+fast as the index grows, and only entries with the same negation and
+polarity words ("not", "avoid", "harmful") as the query. Entries are evicted least-recently-used once the
+index reaches its size cap.
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_THRESHOLD = 0.8
+
+# Queries need this many content words before a stored answer is reused,
+# so vague follow-ups like "is it safe?" always go to the model
+MIN_QUERY_TERMS = 2
+
+# Only the rarest query terms are used to gather candidates
+_CANDIDATE_TERMS = 3
+_MAX_CANDIDATES = 64
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset("""
+a about am an and any are as at be been being but by can could do does doing
+during for from get had has have how i i'm if in into is it it's its just me
+my of ok okay on or please pregnancy pregnant should so some than that the
+their them then there these they this to too want was what when where which
+while who why will with would you your
+""".split())
+
+
+# "Can I eat X" and "is X safe" ask the same thing. Words that flip the
+# question ("avoid", "harmful") are never folded into these
+SYNONYMS = {
+    "eat": "safe", "eating": "safe", "consume": "safe",
+    "allowed": "safe", "fine": "safe", "alright": "safe",
+    "no": "not", "never": "not", "cannot": "not", "can't": "not", "cant": "not",
+    "don't": "not", "dont": "not", "shouldn't": "not", "shouldnt": "not",
+    "isn't": "not", "isnt": "not", "aren't": "not", "mustn't": "not",
+}
+
+# A stored answer is only reused for a question with the same polarity
+# terms, so "what should I avoid?" never gets the answer to "what is safe?"
+POLARITY_TERMS = frozenset({
+    "not", "avoid", "harmful", "unsafe", "dangerous", "risky", "risk", "bad", "limit",
+})
+
+
+def tokenize(text):
+    """Lowercase, drop stopwords, fold synonyms and simple plurals"""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        word = word.strip("'")
+        if not word or word in STOPWORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def segment_key(pregnancy_month, preferences=None, allergies=None):
+    """Build the segment an entry belongs to"""
+    return (pregnancy_month, tuple(sorted(preferences or [])), tuple(sorted(allergies or [])))
+
+
+class _Segment:
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log((len(self.docs) + 1) / (df + 1)) + 1.0
+
+    def add(self, doc_id, counts, answer):
+        # Store sublinear term frequencies; idf is applied at query time
+        weights = {term: 1 + math.log(tf) for term, tf in counts.items()}
+        self.docs[doc_id] = (weights, answer)
+        for term in counts:
+            self.postings.setdefault(term, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        weights, _ = self.docs.pop(doc_id)
+        for term in weights:
+            posting = self.postings[term]
+            posting.discard(doc_id)
+            if not posting:
+                del self.postings[term]
+
+
+class QuestionIndex:
+    """Segmented TF-IDF index mapping questions to stored answers"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, threshold=DEFAULT_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._segments = {}
+        self._order = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, segment, question, answer):
+        """Index an answered question, evicting the least recently used entry if full"""
+        counts = Counter(tokenize(question))
+        if not counts:
+            return
+        with self._lock:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._segments.setdefault(segment, _Segment()).add(doc_id, counts, answer)
+            self._order[doc_id] = segment
+            while len(self._order) > self.max_entries:
+                old_id, old_segment = self._order.popitem(last=False)
+                self._segments[old_segment].remove(old_id)
+                if not self._segments[old_segment].docs:
+                    del self._segments[old_segment]
+
+    def lookup(self, segment, question, threshold=None):
+        """Return (answer, score) for the closest stored question above threshold, else None"""
+        threshold = self.threshold if threshold is None else threshold
+        counts = Counter(tokenize(question))
+        with self._lock:
+            index = self._segments.get(segment)
+            if index is None or len(counts) < MIN_QUERY_TERMS:
+                self.misses += 1
+                return None
+
+            query = {term: (1 + math.log(tf)) * index.idf(term) for term, tf in counts.items()}
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+
+            # Gather candidates from the rarest query terms only
+            rare_terms = sorted(
+                (term for term in query if term in index.postings),
+                key=lambda term: len(index.postings[term]),
+            )[:_CANDIDATE_TERMS]
+            candidates = set()
+            for term in rare_terms:
+                for doc_id in index.postings[term]:
+                    candidates.add(doc_id)
+                    if len(candidates) >= _MAX_CANDIDATES:
+                        break
+
+            polarity = POLARITY_TERMS.intersection(query)
+            idf_cache = {}
+            best_id, best_score = None, 0.0
+            for doc_id in candidates:
+                doc_weights, _ = index.docs[doc_id]
+                if POLARITY_TERMS.intersection(doc_weights) != polarity:
+                    continue
+                dot = 0.0
+                doc_norm = 0.0
+                for term, tf_weight in doc_weights.items():
+                    idf = idf_cache.get(term)
+                    if idf is None:
+                        idf = idf_cache[term] = index.idf(term)
+                    weight = tf_weight * idf
+                    doc_norm += weight * weight
+                    if term in query:
+                        dot += weight * query[term]
+                score = dot / (query_norm * math.sqrt(doc_norm))
+                if score > best_score:
+                    best_id, best_score = doc_id, score
+
+            if best_id is None or best_score < threshold:
+                self.misses += 1
+                return None
+
+            self._order.move_to_end(best_id)
+            self.hits += 1
+            return index.docs[best_id][1], best_score
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._order),
+                "segments": len(self._segments),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        return len(self._order)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_question_index():
+    """Return the process-wide question index, configured from the environment"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = QuestionIndex(
+                    max_entries=int(os.getenv("QUESTION_INDEX_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                    threshold=float(os.getenv("QUESTION_INDEX_THRESHOLD", DEFAULT_THRESHOLD)),
+                )
+    return _index
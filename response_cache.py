@@ -0,0 +1,179 @@
+"""Process-wide cache for assistant responses.
+
+Entries live in an in-memory LRU with a TTL and a size cap. When a shared
+tier is configured (SHARED_TIER_URL, or RESPONSE_CACHE_DB for a SQLite
+file), it backs the memory tier, so cached answers are shared by every
+replica and survive restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared_tier import get_shared_tier
+
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# How long another replica's claim on a response is honoured, and waited for
+DEFAULT_CLAIM_TTL = 60.0
+DEFAULT_CLAIM_WAIT = 30.0
+
+
+def normalize_prompt(text):
+    """Collapse whitespace and case so equivalent prompts share a key"""
+    return " ".join(str(text).split()).lower()
+
+
+def make_cache_key(model, context, prompt, preferences=None, allergies=None, history=None):
+    """Build a stable cache key for one completion request
+
+    model names who answers: a model, or a routed request type whose
+    candidate models share answers.
+    """
+    payload = json.dumps(
+        [
+            model,
+            normalize_prompt(context),
+            normalize_prompt(prompt),
+            sorted(preferences or []),
+            sorted(allergies or []),
+            [[m["role"], normalize_prompt(m["content"])] for m in history or []],
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache in front of the optional shared tier
+
+    The in-memory LRU is this replica's near-cache for responses; the shared
+    tier makes every replica's responses hits on the others.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, shared=None,
+                 claim_ttl=DEFAULT_CLAIM_TTL, claim_wait=DEFAULT_CLAIM_WAIT):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.claim_ttl = claim_ttl
+        self.claim_wait = claim_wait
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.shared is not None:
+            # The memory tier already is the near-cache for responses
+            value = self.shared.get(f"response:{key}", near=False)
+            if value is not None:
+                with self._lock:
+                    self._remember(key, value, now + self.ttl_seconds)
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Store value under key in every tier"""
+        with self._lock:
+            self._remember(key, value, time.time() + self.ttl_seconds)
+        if self.shared is not None:
+            self.shared.set(f"response:{key}", value, self.ttl_seconds)
+
+    def claim(self, key):
+        """Claim computing key across replicas
+
+        Returns True if this replica should call the model, or False if
+        another replica already is; then wait_for() picks up its answer.
+        """
+        if self.shared is None:
+            return True
+        return self.shared.claim(f"response:{key}", self.claim_ttl)
+
+    def release(self, key):
+        """Drop this replica's claim on key, e.g. after the call failed"""
+        if self.shared is not None:
+            self.shared.release(f"response:{key}")
+
+    def wait_for(self, key):
+        """Poll the shared tier for a response another replica is computing
+
+        Returns None if it does not arrive within claim_wait seconds.
+        """
+        deadline = time.monotonic() + self.claim_wait
+        delay = 0.05
+        while time.monotonic() < deadline:
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            value = self.shared.get(f"response:{key}", near=False)
+            if value is not None:
+                with self._lock:
+                    self._remember(key, value, time.time() + self.ttl_seconds)
+                    self.shared_hits += 1
+                return value
+            delay = min(delay * 2, 0.5)
+        return None
+
+    def clear(self):
+        """Drop every entry from this replica's memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current sizes"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, value, expires_at):
+        # Caller holds the lock
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache, configured from the environment"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+                    shared=get_shared_tier(),
+                    claim_ttl=float(os.getenv("RESPONSE_CACHE_CLAIM_TTL", DEFAULT_CLAIM_TTL)),
+                    claim_wait=float(os.getenv("RESPONSE_CACHE_CLAIM_WAIT", DEFAULT_CLAIM_WAIT)),
+                )
+    return _cache
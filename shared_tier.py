@@ -0,0 +1,491 @@
+"""Shared key-value tier for state every replica should see.
+
+Model responses and per-session state (restrictions, chat memory and the
+last SHARED_HISTORY_MESSAGES messages of each history) are kept in one
+store that all Streamlit replicas behind a load balancer use, so a
+response cached by one replica is a hit on every other one and a session
+can reconnect to any replica. Older history stays in each replica's
+HISTORY_DB file. Two backends are available:
+
+    SHARED_TIER_URL=sqlite:////var/lib/mh/shared.db  (one host, several processes)
+    SHARED_TIER_URL=redis://:password@cache:6379/0    (any Redis-protocol server)
+
+RESPONSE_CACHE_DB=<path> still selects the SQLite backend when
+SHARED_TIER_URL is unset. Values are stored as compact JSON, zlib-compressed
+when that makes them smaller. Each replica keeps a small near-cache of
+recently read values in front of the backend, and replicas claim a key
+before computing it so a miss on several replicas at once reaches the
+model only once. If the backend is unreachable, the tier behaves as empty
+and every replica falls back to its own work.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+
+DEFAULT_NEAR_ENTRIES = 512
+DEFAULT_NEAR_TTL = 2.0
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_NAMESPACE = "mh"
+COMPRESS_MIN_BYTES = 256
+
+# Prune the SQLite backend once every this many writes
+_PRUNE_INTERVAL = 256
+
+_JSON = b"j"
+_ZLIB = b"z"
+
+# Delete KEYS[1] only while it still holds ARGV[1], atomically on the server
+COMPARE_AND_DELETE = (
+    'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) else return 0 end'
+)
+
+
+class SharedTierError(RuntimeError):
+    """The backend answered with an error"""
+
+
+def _serialize(value):
+    # Returns (stored bytes, uncompressed size)
+    data = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return _ZLIB + compressed, len(data) + 1
+    return _JSON + data, len(data) + 1
+
+
+def encode(value):
+    """Serialize a JSON-ready value compactly, compressing it when that helps"""
+    return _serialize(value)[0]
+
+
+def decode(data):
+    tag, body = data[:1], data[1:]
+    if tag == _ZLIB:
+        body = zlib.decompress(body)
+    elif tag != _JSON:
+        raise SharedTierError(f"Unknown value encoding {tag!r}")
+    return json.loads(body)
+
+
+class SQLiteBackend:
+    """Shared tier in a SQLite file, for replicas on one host"""
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS shared_kv ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS shared_kv_accessed ON shared_kv (accessed_at)")
+        self._db.commit()
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT key, value FROM shared_kv WHERE key IN ({', '.join('?' * len(keys))}) "
+                "AND expires_at > ?",
+                (*keys, now),
+            ).fetchall()
+            if rows:
+                self._db.executemany(
+                    "UPDATE shared_kv SET accessed_at = ? WHERE key = ?", [(now, key) for key, _ in rows]
+                )
+                self._db.commit()
+        found = dict(rows)
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO shared_kv (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % _PRUNE_INTERVAL == 0:
+                self._prune(now)
+            self._db.commit()
+
+    def add(self, key, value, ttl):
+        """Set key if it is absent, expired or already holds value; return whether it was set"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO shared_kv (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at "
+                "WHERE shared_kv.expires_at <= ? OR shared_kv.value = excluded.value",
+                (key, value, now + ttl, now, now),
+            )
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM shared_kv WHERE key = ?", (key,))
+            self._db.commit()
+
+    def delete_if(self, key, value):
+        """Delete key only while it still holds value"""
+        with self._lock:
+            self._db.execute("DELETE FROM shared_kv WHERE key = ? AND value = ?", (key, value))
+            self._db.commit()
+
+    def _prune(self, now):
+        # Caller holds the lock
+        self._db.execute("DELETE FROM shared_kv WHERE expires_at <= ?", (now,))
+        self._db.execute(
+            "DELETE FROM shared_kv WHERE key IN ("
+            "SELECT key FROM shared_kv ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisBackend:
+    """Shared tier on any server speaking the Redis protocol (RESP)
+
+    Keeps one connection per thread and expires keys with the server's own
+    TTLs, so eviction is left to the server's maxmemory policy.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, username=None,
+                 timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse(url)
+        path = parsed.path.lstrip("/")
+        return cls(
+            host=parsed.hostname or "127.0.0.1",
+            port=parsed.port or 6379,
+            db=int(path) if path else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+            username=unquote(parsed.username) if parsed.username else None,
+            timeout=timeout,
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self._local.connection = (sock, sock.makefile("rb"))
+            if self.password:
+                auth = [self.username, self.password] if self.username else [self.password]
+                self._call(connection, "AUTH", *auth)
+            if self.db:
+                self._call(connection, "SELECT", self.db)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def execute(self, *args):
+        """Send one command and return its reply"""
+        try:
+            return self._call(self._connection(), *args)
+        except (OSError, EOFError):
+            # A pooled connection may have gone stale; retry once on a fresh one
+            self._drop_connection()
+            try:
+                return self._call(self._connection(), *args)
+            except (OSError, EOFError):
+                self._drop_connection()
+                raise
+
+    def _call(self, connection, *args):
+        sock, reader = connection
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        sock.sendall(b"".join(parts))
+        return self._read_reply(reader)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise EOFError("Connection closed by the shared tier server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise SharedTierError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise EOFError("Connection closed by the shared tier server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise SharedTierError(f"Unexpected reply {line!r}")
+
+    def get_many(self, keys):
+        return self.execute("MGET", *keys)
+
+    def set(self, key, value, ttl):
+        self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl):
+        """Set key if it is absent or already holds value; return whether it was set"""
+        if self.execute("SET", key, value, "NX", "PX", max(1, int(ttl * 1000))) is not None:
+            return True
+        # Holding the key already counts as winning, as in the SQLite backend; this
+        # also covers a retried SET NX that finds its own first attempt's value
+        return self.execute("GET", key) == value
+
+    def delete(self, key):
+        self.execute("DEL", key)
+
+    def delete_if(self, key, value):
+        """Delete key only while it still holds value"""
+        self.execute("EVAL", COMPARE_AND_DELETE, 1, key, value)
+
+    def close(self):
+        self._drop_connection()
+
+
+class NearCache:
+    """Small LRU of recently read values, each kept for at most ttl seconds"""
+
+    def __init__(self, max_entries=DEFAULT_NEAR_ENTRIES, ttl=DEFAULT_NEAR_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SharedTier:
+    """Namespaced, serialized access to a shared backend behind a near-cache
+
+    Backend failures are counted and treated as misses (or skipped writes),
+    so the app keeps working on its own when the backend is down.
+    """
+
+    def __init__(self, backend, namespace=DEFAULT_NAMESPACE, near_entries=DEFAULT_NEAR_ENTRIES,
+                 near_ttl=DEFAULT_NEAR_TTL):
+        self.backend = backend
+        self.namespace = namespace
+        self.near = NearCache(near_entries, near_ttl)
+        self.replica_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self.near_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.claims_won = 0
+        self.claims_lost = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, key, near=True):
+        """Return the value stored under key, or None"""
+        return self.get_many([key], near)[0]
+
+    def get_many(self, keys, near=True):
+        """Return the values stored under keys, in one backend round trip"""
+        values = [None] * len(keys)
+        missing = []
+        for index, key in enumerate(keys):
+            found, value = self.near.get(key) if near else (False, None)
+            if found:
+                values[index] = value
+                self._count("near_hits")
+            else:
+                missing.append(index)
+        if not missing:
+            return values
+
+        try:
+            stored = self.backend.get_many([self._key(keys[index]) for index in missing])
+        except (OSError, EOFError, SharedTierError, sqlite3.Error):
+            self._count("errors")
+            self._count("misses", len(missing))
+            return values
+        for index, data in zip(missing, stored):
+            if data is None:
+                self._count("misses")
+                continue
+            try:
+                value = decode(data)
+            except (ValueError, zlib.error, SharedTierError):
+                # Unreadable entries, e.g. from a newer release, count as misses
+                self._count("errors")
+                self._count("misses")
+                continue
+            values[index] = value
+            self._count("hits")
+            if near:
+                self.near.put(keys[index], value)
+        return values
+
+    def set(self, key, value, ttl):
+        """Store a JSON-ready value for ttl seconds"""
+        data, raw_size = _serialize(value)
+        self.near.put(key, value)
+        try:
+            self.backend.set(self._key(key), data, ttl)
+        except (OSError, EOFError, SharedTierError, sqlite3.Error):
+            self._count("errors")
+            return
+        with self._lock:
+            self.writes += 1
+            self.raw_bytes += raw_size
+            self.stored_bytes += len(data)
+
+    def delete(self, key):
+        self.near.discard(key)
+        try:
+            self.backend.delete(self._key(key))
+        except (OSError, EOFError, SharedTierError, sqlite3.Error):
+            self._count("errors")
+
+    def claim(self, key, ttl):
+        """Claim the work for key across replicas; False if another replica holds the claim
+
+        A claim expires after ttl seconds, so a replica that dies mid-call
+        does not block the key. A replica that already holds the claim wins
+        it again. If the backend is down every replica wins.
+        """
+        try:
+            won = self.backend.add(self._key(f"claim:{key}"), self.replica_id.encode("ascii"), ttl)
+        except (OSError, EOFError, SharedTierError, sqlite3.Error):
+            self._count("errors")
+            won = True
+        self._count("claims_won" if won else "claims_lost")
+        return won
+
+    def release(self, key):
+        """Drop this replica's claim on key; a claim another replica took over is left alone"""
+        try:
+            self.backend.delete_if(self._key(f"claim:{key}"), self.replica_id.encode("ascii"))
+        except (OSError, EOFError, SharedTierError, sqlite3.Error):
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "near_hits": self.near_hits,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "errors": self.errors,
+                "raw_bytes": self.raw_bytes,
+                "stored_bytes": self.stored_bytes,
+                "claims_won": self.claims_won,
+                "claims_lost": self.claims_lost,
+            }
+
+
+def backend_from_url(url, max_entries=DEFAULT_MAX_ENTRIES, timeout=DEFAULT_TIMEOUT):
+    """Build a backend from redis://..., sqlite:///path.db or a plain SQLite file path"""
+    if url.startswith(("redis://", "rediss://")):
+        if url.startswith("rediss://"):
+            raise ValueError("TLS (rediss://) is not supported; use a local TLS proxy")
+        return RedisBackend.from_url(url, timeout=timeout)
+    if url.startswith("sqlite:///"):
+        # As in SQLAlchemy: sqlite:///relative.db, sqlite:////absolute/path.db
+        url = url[len("sqlite:///"):]
+    return SQLiteBackend(url, max_entries=max_entries)
+
+
+_tier = None
+_tier_lock = threading.Lock()
+_tier_ready = False
+
+
+def get_shared_tier():
+    """Return the process-wide shared tier, or None when none is configured"""
+    global _tier, _tier_ready
+    if not _tier_ready:
+        with _tier_lock:
+            if not _tier_ready:
+                url = os.getenv("SHARED_TIER_URL") or os.getenv("RESPONSE_CACHE_DB")
+                if url:
+                    _tier = SharedTier(
+                        backend_from_url(
+                            url,
+                            max_entries=int(os.getenv("SHARED_TIER_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                            timeout=float(os.getenv("SHARED_TIER_TIMEOUT", DEFAULT_TIMEOUT)),
+                        ),
+                        namespace=os.getenv("SHARED_TIER_NAMESPACE", DEFAULT_NAMESPACE),
+                        near_entries=int(os.getenv("SHARED_TIER_NEAR_ENTRIES", DEFAULT_NEAR_ENTRIES)),
+                        near_ttl=float(os.getenv("SHARED_TIER_NEAR_TTL", DEFAULT_NEAR_TTL)),
+                    )
+                _tier_ready = True
+    return _tier
@@ -0,0 +1,109 @@
+"""Request coalescing for identical in-flight model calls.
+
+The first caller for a key becomes the leader and makes the upstream call.
+Callers that arrive with the same key while it is still running wait for
+the leader's result instead of starting their own request. If the leader
+is cancelled rather than failing, its waiters get LeaderAbandoned and
+retry: one of them becomes the new leader.
+"""
+import threading
+
+
+class LeaderAbandoned(Exception):
+    """The leader stopped without a result, e.g. its stream was closed; retry the call"""
+
+
+class _Call:
+    """One in-flight upstream call and the callers waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for a coalesced request")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Share one upstream call between identical concurrent requests"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Join the call for key, returning (call, is_leader)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's result (or error) and release every waiter
+
+        A BaseException that is not an Exception (GeneratorExit, KeyboardInterrupt)
+        ends only the leader, so waiters get LeaderAbandoned instead.
+        """
+        if error is not None and not isinstance(error, Exception):
+            error = LeaderAbandoned()
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once per key among concurrent callers and return its result"""
+        while True:
+            call, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return call.wait(timeout)
+            except LeaderAbandoned:
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        """Return coalescing counters"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide single-flight group"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,64 @@
+"""The batched history store reads back each session's own writes.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore  # noqa: E402
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(os.path.join(self.directory.name, "history.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_reads_see_the_sessions_writes(self):
+        self.store.append("s", "nutrition", "user", "What about iron?")
+        self.store.append("s", "nutrition", "assistant", "Eat lentils.", details={"source": "llm"})
+        self.assertEqual(self.store.count("s", "nutrition"), 2)
+        page = self.store.page("s", "nutrition", 10)
+        self.assertEqual([(m["role"], m["content"]) for m in page],
+                         [("user", "What about iron?"), ("assistant", "Eat lentils.")])
+        self.assertEqual(page[1]["details"], {"source": "llm"})
+
+    def test_sessions_and_kinds_are_separate(self):
+        self.store.append("s", "nutrition", "user", "one")
+        self.store.append("s", "symptom", "user", "two")
+        self.store.append("t", "nutrition", "user", "three")
+        self.assertEqual(self.store.count("s", "nutrition"), 1)
+        self.assertEqual(self.store.count("s", "symptom"), 1)
+        self.assertEqual(self.store.count("t", "nutrition"), 1)
+
+    def test_pages_are_newest_first(self):
+        for n in range(5):
+            self.store.append("s", "nutrition", "user", str(n))
+        self.assertEqual([m["content"] for m in self.store.page("s", "nutrition", 2)], ["3", "4"])
+        self.assertEqual([m["content"] for m in self.store.page("s", "nutrition", 2, offset=2)], ["1", "2"])
+
+    def test_concurrent_writers_lose_nothing(self):
+        def writer(session):
+            for n in range(200):
+                self.store.append(session, "nutrition", "user", str(n))
+
+        threads = [threading.Thread(target=writer, args=(f"s{n}",)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([self.store.count(f"s{n}", "nutrition") for n in range(4)], [200] * 4)
+        self.store.flush()
+        self.assertEqual(self.store.stats()["written"], 800)
+
+
+if __name__ == "__main__":
+    unittest.main()
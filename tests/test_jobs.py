@@ -0,0 +1,80 @@
+"""Background jobs finish, fail and cancel cleanly.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import CANCELLED, DONE, FAILED, JobCancelled, JobManager  # noqa: E402
+
+
+class JobManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = JobManager(max_workers=2)
+
+    def test_job_publishes_partial_output_and_result(self):
+        def fn(job, words):
+            for word in words:
+                job.emit(word)
+            return job.text()
+
+        job = self.manager.submit("s", "chat", fn, ["a", "b"])
+        self.assertTrue(job.wait(5))
+        self.assertEqual((job.state, job.result, job.partial), (DONE, "ab", ["a", "b"]))
+
+    def test_error_fails_the_job(self):
+        def fn(job):
+            raise ValueError("upstream failed")
+
+        job = self.manager.submit("s", "chat", fn)
+        job.wait(5)
+        self.assertEqual(job.state, FAILED)
+        self.assertIn("upstream failed", job.error)
+
+    def test_escaping_base_exception_does_not_leave_the_job_running(self):
+        def fn(job):
+            raise GeneratorExit()
+
+        job = self.manager.submit("s", "chat", fn)
+        job.wait(5)
+        self.assertEqual(job.state, FAILED)
+
+    def test_cancel_stops_the_job_at_its_next_emit(self):
+        started = threading.Event()
+        resume = threading.Event()
+        stopped = []
+
+        def fn(job):
+            job.emit("first")
+            started.set()
+            resume.wait(5)
+            try:
+                job.emit("second")
+            except JobCancelled:
+                stopped.append(True)
+                raise
+
+        job = self.manager.submit("s", "chat", fn)
+        started.wait(5)
+        self.assertTrue(self.manager.cancel("s", "chat"))
+        resume.set()
+        self.manager._pool.shutdown(wait=True)
+        self.assertEqual((job.state, job.partial, stopped), (CANCELLED, ["first"], [True]))
+
+    def test_new_job_replaces_the_sessions_running_job(self):
+        release = threading.Event()
+        first = self.manager.submit("s", "chat", lambda job: release.wait(5))
+        second = self.manager.submit("s", "chat", lambda job: "second")
+        release.set()
+        second.wait(5)
+        self.assertEqual(first.state, CANCELLED)
+        self.assertIs(self.manager.get("s", "chat"), second)
+        self.assertEqual(self.manager.stats()["replaced"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""Circuit breaker transitions and how the router feeds them.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_router import CircuitBreaker, ModelRouter  # noqa: E402
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.failure(0)
+        self.assertEqual(breaker.state, "closed")
+        breaker.failure(0)
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.available(5))
+        self.assertFalse(breaker.acquire(5))
+
+    def test_half_open_probe_closes_or_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure(0)
+        self.assertTrue(breaker.acquire(10))
+        self.assertEqual(breaker.state, "half_open")
+        # Only one probe at a time
+        self.assertFalse(breaker.available(10))
+        self.assertFalse(breaker.acquire(10))
+        breaker.failure(11)
+        self.assertEqual((breaker.state, breaker.opened_at), ("open", 11))
+
+        self.assertTrue(breaker.acquire(21))
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.available(21))
+
+    def test_inconclusive_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure(0)
+        breaker.acquire(10)
+        breaker.inconclusive(12)
+        self.assertEqual((breaker.state, breaker.opened_at), ("open", 12))
+        self.assertTrue(breaker.available(22))
+
+    def test_inconclusive_leaves_closed_breaker_alone(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.inconclusive(5)
+        self.assertEqual(breaker.state, "closed")
+
+
+class RouterBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.router = ModelRouter(routes={"t": ["a", "b"]}, failure_threshold=1, reset_timeout=0.1)
+
+    def call(self, errors):
+        def attempt(model):
+            self.router.mark_started()
+            error = errors.get(model)
+            if error is not None:
+                raise error
+            return model
+        return self.router.complete("t", attempt)
+
+    def test_server_error_opens_breaker_and_fails_over(self):
+        self.assertEqual(self.call({"a": _StatusError(500)}), ("b", "b"))
+        self.assertEqual(self.router.stats()["models"]["a"]["state"], "open")
+        self.assertEqual(self.router.candidates("t"), ["b"])
+
+    def test_client_error_does_not_count_against_model(self):
+        with self.assertRaises(_StatusError):
+            self.call({"a": _StatusError(400)})
+        self.assertEqual(self.router.stats()["models"]["a"]["state"], "closed")
+
+    def test_probe_ending_in_client_error_does_not_strand_the_model(self):
+        self.call({"a": _StatusError(500)})
+        time.sleep(0.15)
+        with self.assertRaises(_StatusError):
+            self.call({"a": _StatusError(400)})
+        self.assertEqual(self.router.stats()["models"]["a"]["state"], "open")
+        time.sleep(0.15)
+        self.assertEqual(self.router.candidates("t"), ["a", "b"])
+        self.assertEqual(self.call({}), ("a", "a"))
+        self.assertEqual(self.router.stats()["models"]["a"]["state"], "closed")
+
+    def test_probe_queued_past_its_timeout_does_not_strand_the_model(self):
+        self.call({"a": _StatusError(500)})
+        time.sleep(0.15)
+
+        def attempt(model):
+            # A local limiter timeout, before the request was sent
+            raise TimeoutError("no rate limiter slot")
+        with self.assertRaises(TimeoutError):
+            self.router.complete("t", attempt)
+        time.sleep(0.15)
+        self.assertIn("a", self.router.candidates("t"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Requests over the prompt budget fail cleanly and never reach the model.
+
+Run with python -m pytest tests
+"""
+import csv
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+
+from fake_groq import FakeGroqServer  # noqa: E402
+from response_cache import get_response_cache  # noqa: E402
+
+
+class PromptBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeGroqServer().start()
+        os.environ.setdefault("GROQ_API_KEY", "test-key")
+        os.environ["GROQ_BASE_URL"] = cls.fake.base_url
+        # Keep the response cache in this process
+        os.environ.pop("SHARED_TIER_URL", None)
+        os.environ.pop("RESPONSE_CACHE_DB", None)
+        import app
+        import batch
+        from single_flight import get_single_flight
+        cls.app = app
+        cls.batch = batch
+        cls.flight = get_single_flight()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def _stream(self, prompt, history=None):
+        result = []
+        worker = threading.Thread(
+            target=lambda: result.append("".join(self.app.stream_nutrition_response(prompt, 5, history=history))),
+            daemon=True,
+        )
+        worker.start()
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive(), "the request hung")
+        return result[0]
+
+    def test_oversized_stream_fails_and_frees_the_call(self):
+        prompt = "Is this safe to eat? " * 700
+        sent = self.fake.requests
+        for _ in range(2):
+            text = self._stream(prompt)
+            self.assertTrue(self.app.is_error_response(text))
+            self.assertIn("over the budget", text)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+        self.assertEqual(self.fake.requests, sent)
+
+    def test_cache_key_uses_the_trimmed_history(self):
+        old = [{"role": "user", "content": "Breakfast ideas?"}, {"role": "assistant", "content": "word " * 2500}]
+        recent = [{"role": "user", "content": "Any fruit?"}, {"role": "assistant", "content": "Berries."}]
+        first = self._stream("What about dinner?", old + recent)
+        hits = get_response_cache().stats()["hits"]
+        second = self._stream("What about dinner?", recent)
+        self.assertFalse(self.app.is_error_response(first))
+        self.assertEqual(first, second)
+        self.assertEqual(get_response_cache().stats()["hits"], hits + 1)
+
+    def test_oversized_symptom_prompt_is_an_input_error(self):
+        prompt = "Headache " * 3000
+        text = self.app.get_symptom_assessment_response(prompt, 5)
+        self.assertTrue(text.startswith("Error:"))
+        self.assertIn("over the budget", text)
+        budget = self.app.get_prompt_budget()
+        rejected = budget.stats()["rejected"]
+        with self.assertRaises(self.app.PromptBudgetError):
+            budget.check(self.app.symptom_context(5), prompt)
+        # check() only answers; it is not a request
+        self.assertEqual(budget.stats()["rejected"], rejected)
+
+    def test_batch_does_not_retry_an_oversized_checkin(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "checkins.csv")
+            output = os.path.join(directory, "assessments.csv")
+            with open(source, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["id", "week", "symptoms", "severity", "description"])
+                writer.writerow(["long", 20, "Headache", "Moderate", "It hurts. " * 3000])
+            sent = self.fake.requests
+            started = time.monotonic()
+            counts = self.batch.assess_file(source, output, force_llm=True, log=io.StringIO())
+            self.assertLess(time.monotonic() - started, 1.5)
+            self.assertEqual(counts["invalid"], 1)
+            self.assertEqual(self.fake.requests, sent)
+            with open(output, newline="") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([row["id"] for row in rows], ["long"])
+        self.assertIn("over the budget", rows[0]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+"""Near-duplicate questions share answers; opposite questions never do.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_index import QuestionIndex, segment_key  # noqa: E402
+
+
+SEGMENT = segment_key(5)
+
+
+class QuestionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = QuestionIndex()
+
+    def test_rephrased_question_matches(self):
+        self.index.add(SEGMENT, "Is sushi safe?", "sushi answer")
+        match = self.index.lookup(SEGMENT, "Can I eat sushi while pregnant?")
+        self.assertIsNotNone(match)
+        self.assertEqual(match[0], "sushi answer")
+
+    def test_avoid_and_safe_questions_do_not_match(self):
+        self.index.add(SEGMENT, "What foods are safe to eat?", "safe foods")
+        self.assertIsNone(self.index.lookup(SEGMENT, "What foods should I avoid?"))
+
+        other = QuestionIndex()
+        other.add(SEGMENT, "What foods should I avoid?", "foods to avoid")
+        self.assertIsNone(other.lookup(SEGMENT, "What foods are safe to eat?"))
+
+    def test_negated_question_does_not_match(self):
+        self.index.add(SEGMENT, "Is it safe to eat soft cheese?", "cheese answer")
+        self.assertIsNone(self.index.lookup(SEGMENT, "Is it not safe to eat soft cheese?"))
+        self.assertIsNone(self.index.lookup(SEGMENT, "Is soft cheese harmful?"))
+
+    def test_segments_are_separate(self):
+        self.index.add(SEGMENT, "Is sushi safe?", "sushi answer")
+        self.assertIsNone(self.index.lookup(segment_key(6), "Is sushi safe?"))
+
+
+if __name__ == "__main__":
+    unittest.main()
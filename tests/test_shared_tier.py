@@ -0,0 +1,102 @@
+"""SharedTier values and claims, on SQLite and on a Redis-protocol server.
+
+The Redis tests run against bench/fake_redis.py. Each test uses two
+SharedTier instances on one store, as two replicas would.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+
+from fake_redis import FakeRedisServer  # noqa: E402
+from shared_tier import RedisBackend, SharedTier, SQLiteBackend  # noqa: E402
+
+
+class _SharedTierTests:
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.one = SharedTier(self.make_backend())
+        self.two = SharedTier(self.make_backend())
+
+    def tearDown(self):
+        self.one.backend.close()
+        self.two.backend.close()
+
+    def test_values_are_shared(self):
+        self.one.set("answer", {"text": "Eat leafy greens", "tokens": [1, 2]}, 60)
+        self.assertEqual(self.two.get("answer"), {"text": "Eat leafy greens", "tokens": [1, 2]})
+        self.assertEqual(self.two.get_many(["answer", "missing"]), [{"text": "Eat leafy greens", "tokens": [1, 2]}, None])
+
+    def test_values_expire(self):
+        self.one.set("short", "gone soon", 0.1)
+        time.sleep(0.2)
+        self.assertIsNone(self.two.get("short"))
+
+    def test_one_replica_wins_a_claim(self):
+        self.assertTrue(self.one.claim("key", 60))
+        self.assertFalse(self.two.claim("key", 60))
+        # The holder wins its own claim again, e.g. on a retried call
+        self.assertTrue(self.one.claim("key", 60))
+
+    def test_claim_expires(self):
+        self.assertTrue(self.one.claim("key", 0.1))
+        time.sleep(0.2)
+        self.assertTrue(self.two.claim("key", 60))
+        self.assertFalse(self.one.claim("key", 60))
+
+    def test_release_by_owner_frees_the_claim(self):
+        self.one.claim("key", 60)
+        self.one.release("key")
+        self.assertTrue(self.two.claim("key", 60))
+
+    def test_release_by_non_owner_is_ignored(self):
+        self.one.claim("key", 60)
+        self.two.release("key")
+        self.assertFalse(self.two.claim("key", 60))
+
+    def test_late_release_leaves_a_taken_over_claim(self):
+        self.one.claim("key", 0.1)
+        time.sleep(0.2)
+        self.assertTrue(self.two.claim("key", 60))
+        # The first replica finishes late; its release must not free the new claim
+        self.one.release("key")
+        self.assertFalse(self.one.claim("key", 60))
+
+
+class SQLiteSharedTierTest(_SharedTierTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def make_backend(self):
+        return SQLiteBackend(os.path.join(self.directory.name, "shared.db"))
+
+
+class RedisSharedTierTest(_SharedTierTests, unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRedisServer().start()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.stop()
+
+    def make_backend(self):
+        return RedisBackend.from_url(self.server.url)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Concurrent identical calls share one leader's result, error or retry.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from single_flight import LeaderAbandoned, SingleFlight  # noqa: E402
+
+FOLLOWERS = 8
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+
+    def wait_for_followers(self, count):
+        # Followers have joined once they are counted as coalesced
+        for _ in range(500):
+            if self.flight.stats()["coalesced"] >= count:
+                return
+            threading.Event().wait(0.01)
+        self.fail("followers never joined the call")
+
+    def run_callers(self, fn, count):
+        results = [None] * count
+
+        def caller(index):
+            try:
+                results[index] = ("ok", self.flight.do("key", fn, timeout=5))
+            except Exception as e:
+                results[index] = ("error", e)
+
+        threads = [threading.Thread(target=caller, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def join(self, threads):
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+
+    def test_followers_share_the_leaders_result(self):
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        threads, results = self.run_callers(fn, FOLLOWERS + 1)
+        self.wait_for_followers(FOLLOWERS)
+        release.set()
+        self.join(threads)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [("ok", "answer")] * (FOLLOWERS + 1))
+        self.assertEqual(self.flight.stats(), {"in_flight": 0, "leaders": 1, "coalesced": FOLLOWERS})
+
+    def test_followers_share_the_leaders_error(self):
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise ValueError("upstream failed")
+
+        threads, results = self.run_callers(fn, FOLLOWERS + 1)
+        self.wait_for_followers(FOLLOWERS)
+        release.set()
+        self.join(threads)
+        self.assertTrue(all(kind == "error" and str(error) == "upstream failed" for kind, error in results))
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    def test_abandoned_leader_hands_over_to_a_follower(self):
+        call, leader = self.flight.begin("key")
+        self.assertTrue(leader)
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        threads, results = self.run_callers(fn, FOLLOWERS)
+        self.wait_for_followers(FOLLOWERS)
+        # The leader's stream is closed without a result: one follower takes
+        # over and the rest join it
+        self.flight.finish("key", call, error=GeneratorExit())
+        self.wait_for_followers(2 * FOLLOWERS - 1)
+        release.set()
+        self.join(threads)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [("ok", "answer")] * FOLLOWERS)
+
+    def test_abandoned_leader_is_not_an_error(self):
+        call, _ = self.flight.begin("key")
+        follower, leader = self.flight.begin("key")
+        self.assertFalse(leader)
+        self.flight.finish("key", call, error=KeyboardInterrupt())
+        with self.assertRaises(LeaderAbandoned):
+            follower.wait(1)
+
+    def test_finished_calls_are_not_joined(self):
+        self.assertEqual(self.flight.do("key", lambda: 1), 1)
+        self.assertEqual(self.flight.do("key", lambda: 2), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Broken and empty streams are never passed off, or cached, as answers.
+
+Run with python -m pytest tests
+"""
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+import app  # noqa: E402
+from response_cache import get_response_cache  # noqa: E402
+from single_flight import get_single_flight  # noqa: E402
+
+
+def _chunk(text):
+    delta = types.SimpleNamespace(content=text)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], x_groq=None, usage=None)
+
+
+class _Stream:
+    def __init__(self, texts, error=None):
+        self.texts = texts
+        self.error = error
+
+    def __iter__(self):
+        for text in self.texts:
+            yield _chunk(text)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        pass
+
+
+class StreamFailureTest(unittest.TestCase):
+    def stream(self, question, stream):
+        """Return the chunks received, and the error raised if any"""
+        create = mock.Mock(return_value=stream)
+        client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+        received = []
+        with mock.patch.object(app, "get_groq_client", return_value=client), \
+                mock.patch.object(app, "_groq_client", return_value=client):
+            try:
+                for chunk in app.stream_nutrition_response(question, 5):
+                    received.append(chunk)
+            except Exception as e:
+                return received, e
+        return received, None
+
+    def assertNothingKept(self, question):
+        key = app.make_cache_key("nutrition", app.nutrition_context(5), question, [], [], [])
+        self.assertIsNone(get_response_cache().get(key))
+        self.assertEqual(get_single_flight().stats()["in_flight"], 0)
+
+    def test_stream_broken_after_output_raises(self):
+        question = "How much iron do I need daily?"
+        received, error = self.stream(question, _Stream(["Take ", "iron"], ConnectionError("reset")))
+        self.assertEqual(received, ["Take ", "iron"])
+        self.assertIsInstance(error, ConnectionError)
+        self.assertNothingKept(question)
+
+    def test_empty_stream_is_an_error(self):
+        question = "How much folate do I need daily?"
+        received, error = self.stream(question, _Stream([]))
+        self.assertIsNone(error)
+        self.assertTrue(app.is_error_response("".join(received)))
+        self.assertNothingKept(question)
+
+    def test_complete_stream_is_cached(self):
+        question = "How much calcium do I need daily?"
+        received, error = self.stream(question, _Stream(["About ", "1000 mg"]))
+        self.assertEqual(("".join(received), error), ("About 1000 mg", None))
+        key = app.make_cache_key("nutrition", app.nutrition_context(5), question, [], [], [])
+        self.assertEqual(get_response_cache().get(key), "About 1000 mg")
+
+
+if __name__ == "__main__":
+    unittest.main()
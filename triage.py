@@ -0,0 +1,194 @@
+"""Local triage engine for common, low-risk symptom combinations.
+
+Known-safe combinations of week bucket, symptoms, severity and previous
+complications are answered instantly from vetted guidance. Anything
+uncommon or risky returns None so the caller escalates to the LLM.
+The lookup table is precomputed once at import time.
+"""
+import os
+from itertools import combinations
+
+
+SEVERITY_ORDER = ["Mild", "Moderate", "Severe"]
+
+# Previous complications that do not change the advice for these symptoms
+SAFE_COMPLICATIONS = frozenset({"None", "Morning Sickness"})
+
+# Symptoms that always need a full assessment
+RED_FLAG_SYMPTOMS = frozenset({"Bleeding", "Fever", "Cramping", "Other"})
+
+# Combinations that can point to preeclampsia even when each one is mild
+RED_FLAG_COMBINATIONS = [frozenset({"Headache", "Swelling"})]
+
+# Phrases in the free-text description that force escalation
+RED_FLAG_PHRASES = (
+    "blood", "bleed", "spotting", "fever", "vision", "blurr", "faint", "dizz",
+    "chest", "breath", "seizure", "fluid", "leak", "waters", "contraction",
+    "not moving", "less movement", "reduced movement", "can't keep", "cannot keep",
+    "upper abdomen", "severe", "worst", "sudden", "fall", "fell",
+)
+
+# Largest number of symptoms handled locally in one assessment
+MAX_LOCAL_SYMPTOMS = 3
+
+FORCE_LLM = os.getenv("TRIAGE_FORCE_LLM", "").lower() in ("1", "true", "yes")
+
+
+def week_bucket(pregnancy_week):
+    """Map a pregnancy week to its trimester bucket"""
+    if pregnancy_week <= 13:
+        return "first"
+    if pregnancy_week <= 27:
+        return "second"
+    return "third"
+
+
+# Vetted guidance per symptom: the highest severity handled locally in each
+# trimester bucket, plus the text used to build the assessment.
+SYMPTOM_GUIDANCE = {
+    "Nausea": {
+        "max_severity": {"first": "Moderate", "second": "Mild", "third": "Mild"},
+        "causes": "Rising pregnancy hormones (hCG and estrogen) and a more sensitive sense of smell",
+        "normal": {
+            "first": "Nausea is very common in the first trimester and usually eases by weeks 12-14.",
+            "second": "Mild nausea can linger into the second trimester for some people.",
+            "third": "Occasional mild nausea late in pregnancy is often linked to the baby pressing on the stomach.",
+        },
+        "actions": [
+            "Eat small, frequent meals and keep plain crackers nearby",
+            "Sip water, ginger tea or clear fluids through the day",
+            "Avoid strong smells and greasy or spicy foods",
+        ],
+        "seek_care": "You cannot keep fluids down for 24 hours, lose weight, or pass very little dark urine",
+    },
+    "Fatigue": {
+        "max_severity": {"first": "Moderate", "second": "Moderate", "third": "Moderate"},
+        "causes": "Higher progesterone, increased blood volume and disturbed sleep",
+        "normal": {
+            "first": "Tiredness is one of the most common early pregnancy symptoms.",
+            "second": "Energy usually improves in the second trimester, but some tiredness is normal.",
+            "third": "Fatigue often returns in the third trimester as the baby grows and sleep gets harder.",
+        },
+        "actions": [
+            "Rest or nap when you can and keep a regular bedtime",
+            "Eat iron-rich foods and keep taking your prenatal vitamins",
+            "Gentle activity such as short walks can help your energy",
+        ],
+        "seek_care": "Tiredness comes with shortness of breath, a racing heart, pale skin or fainting, which can signal anaemia",
+    },
+    "Back Pain": {
+        "max_severity": {"first": "Mild", "second": "Moderate", "third": "Moderate"},
+        "causes": "Loosening ligaments, a shifting centre of gravity and the growing bump",
+        "normal": {
+            "first": "Mild back ache can start early as ligaments begin to soften.",
+            "second": "Back pain is common in the second trimester as your posture changes.",
+            "third": "Back pain is very common in the third trimester.",
+        },
+        "actions": [
+            "Keep good posture and wear low, supportive shoes",
+            "Sleep on your side with a pillow between your knees",
+            "Try warm (not hot) compresses and gentle prenatal stretches",
+        ],
+        "seek_care": "The pain is rhythmic or comes in waves, is one-sided with fever, or comes with bleeding or fluid loss",
+    },
+    "Headache": {
+        "max_severity": {"first": "Mild", "second": "Mild"},
+        "causes": "Hormonal changes, dehydration, caffeine withdrawal or tiredness",
+        "normal": {
+            "first": "Mild headaches are common in early pregnancy.",
+            "second": "Occasional mild headaches can happen in the second trimester.",
+        },
+        "actions": [
+            "Drink plenty of water and eat regularly",
+            "Rest in a quiet, dark room",
+            "Ask your pharmacist or provider before taking any pain relief",
+        ],
+        "seek_care": "The headache is severe or does not go away, or comes with vision changes or sudden swelling",
+    },
+    "Swelling": {
+        "max_severity": {"second": "Mild", "third": "Mild"},
+        "causes": "Extra fluid and pressure from the uterus on the veins in your legs",
+        "normal": {
+            "second": "Mild swelling of the feet and ankles is common later in the day.",
+            "third": "Mild swelling of the feet and ankles is very common in the third trimester.",
+        },
+        "actions": [
+            "Put your feet up and avoid standing for long periods",
+            "Stay hydrated and keep moving with gentle walks",
+            "Wear comfortable shoes and avoid tight socks",
+        ],
+        "seek_care": "Swelling is sudden, affects your face or hands, or comes with headache or vision problems",
+    },
+}
+
+_GENERAL_SEEK_CARE = [
+    "Any vaginal bleeding or fluid leaking",
+    "Fever of 38°C (100.4°F) or higher",
+    "Severe abdominal pain or regular contractions",
+    "Your baby moving less than usual (from about 24 weeks)",
+]
+
+
+def _build_assessment(bucket, symptoms):
+    guidance = [SYMPTOM_GUIDANCE[symptom] for symptom in symptoms]
+    return {
+        "source": "local",
+        "symptoms": list(symptoms),
+        "possible_causes": [f"{symptom}: {g['causes']}" for symptom, g in zip(symptoms, guidance)],
+        "is_normal": " ".join(g["normal"][bucket] for g in guidance),
+        "recommended_actions": [action for g in guidance for action in g["actions"]],
+        "seek_care": [g["seek_care"] for g in guidance] + _GENERAL_SEEK_CARE,
+    }
+
+
+def _precompute_table():
+    """Build the lookup of every known-safe (bucket, symptoms, severity) combination"""
+    table = {}
+    for bucket in ("first", "second", "third"):
+        handled = sorted(
+            symptom for symptom, g in SYMPTOM_GUIDANCE.items() if bucket in g["max_severity"]
+        )
+        for size in range(1, MAX_LOCAL_SYMPTOMS + 1):
+            for symptoms in combinations(handled, size):
+                symptom_set = frozenset(symptoms)
+                if any(combo <= symptom_set for combo in RED_FLAG_COMBINATIONS):
+                    continue
+                ceiling = min(
+                    SEVERITY_ORDER.index(SYMPTOM_GUIDANCE[s]["max_severity"][bucket])
+                    for s in symptoms
+                )
+                assessment = _build_assessment(bucket, symptoms)
+                for severity in SEVERITY_ORDER[:ceiling + 1]:
+                    table[(bucket, symptom_set, severity)] = assessment
+    return table
+
+
+_TABLE = _precompute_table()
+
+
+def triage(pregnancy_week, symptoms, severity, previous_complications, description=""):
+    """Return a local structured assessment, or None if the case must go to the LLM"""
+    if not symptoms:
+        return None
+    if not SAFE_COMPLICATIONS.issuperset(previous_complications or []):
+        return None
+    if RED_FLAG_SYMPTOMS.intersection(symptoms):
+        return None
+
+    text = (description or "").lower()
+    if any(phrase in text for phrase in RED_FLAG_PHRASES):
+        return None
+
+    return _TABLE.get((week_bucket(pregnancy_week), frozenset(symptoms), severity))
+
+
+def format_assessment(assessment):
+    """Render a local assessment as markdown in the same sections the LLM uses"""
+    lines = ["**1. Possible causes**"]
+    lines += [f"- {cause}" for cause in assessment["possible_causes"]]
+    lines += ["", "**2. Is this normal for your stage of pregnancy?**", assessment["is_normal"]]
+    lines += ["", "**3. Recommended actions**"]
+    lines += [f"- {action}" for action in assessment["recommended_actions"]]
+    lines += ["", "**4. Seek immediate medical attention if:**"]
+    lines += [f"- {item}" for item in assessment["seek_care"]]
+    return "\n".join(lines)